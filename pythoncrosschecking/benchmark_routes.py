@@ -0,0 +1,333 @@
+"""
+Route Analyzer Benchmarks
+=========================
+Times the analyzers on synthetic fleets produced by synthetic_routes.py, so
+speed can be measured and compared between versions without customer data.
+
+Benchmarks per fleet size:
+- process_file:        per route kind, seconds per file and points per second
+- checks:              validate / distance / anomalies / alternating regions /
+                       mixed-format parsing on cached point arrays
+- codec:               bytes per point and encode/decode time of trace formats
+- process_all_routes:  route_analyzer (serial), analyzerv2 serial and pool
+- startup:             fresh interpreter running route_cli.py / importing the
+                       analysis modules (run once, fleet size 0)
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy tqdm
+
+Usage:
+------
+python benchmark_routes.py --sizes 20 100 500 --output bench_results.json
+python benchmark_routes.py --compare old_results.json new_results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import trace_codec
+from synthetic_routes import SyntheticRouteGenerator, load_cached_points, load_manifest
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _best_of(fn, repeat=3):
+    """Run fn repeat times and return the fastest wall time in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def _load_engines():
+    """Import both analyzers with their console output silenced"""
+    import route_analyzer
+    import analyzerv2
+    for name in ('analyzerv2', 'route_pipeline'):
+        logging.getLogger(name).setLevel(logging.CRITICAL)
+    return {'route_analyzer': route_analyzer, 'analyzerv2': analyzerv2}
+
+
+class RouteBenchmark:
+    def __init__(self, workdir='bench_fleets', seed=42, repeat=3, num_workers=None, huge_points=100000):
+        self.workdir = workdir
+        self.seed = seed
+        self.repeat = repeat
+        # analyzerv2 defaults to cpu_count() - 1, which is 0 on single-core boxes
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.huge_points = huge_points
+        self.engines = _load_engines()
+        self.results = []
+
+    def prepare_fleet(self, fleet_size):
+        """Generate (or reuse) a synthetic fleet and return its folder and manifest
+
+        A fleet is only reused when it was generated with the same parameters
+        (e.g. --huge-points); otherwise it is generated again.
+        """
+        fleet_dir = os.path.join(self.workdir, f"fleet_{fleet_size}_seed{self.seed}")
+        generator = SyntheticRouteGenerator(seed=self.seed, huge_points=self.huge_points)
+        if os.path.exists(os.path.join(fleet_dir, 'manifest.json')):
+            parameters, manifest = load_manifest(fleet_dir)
+            if parameters == generator.parameters(fleet_size, include_huge=1):
+                return fleet_dir, manifest
+            print(f"Regenerating {fleet_dir}: generator parameters changed")
+            shutil.rmtree(fleet_dir)
+        manifest = generator.generate(fleet_dir, fleet_size, include_huge=1)
+        return fleet_dir, manifest
+
+    def record(self, fleet_size, benchmark, engine, case, seconds, points=0, files=0, **extra):
+        entry = {
+            'fleet_size': fleet_size,
+            'benchmark': benchmark,
+            'engine': engine,
+            'case': case,
+            'seconds': round(seconds, 6),
+            'points': int(points),
+            'files': int(files),
+            'points_per_second': round(points / seconds, 1) if seconds > 0 and points else None,
+            'files_per_second': round(files / seconds, 3) if seconds > 0 and files else None,
+        }
+        entry.update(extra)
+        self.results.append(entry)
+        print(f"  {benchmark:<20} {engine:<15} {case:<26} {seconds:10.4f}s")
+        return entry
+
+    def bench_process_file(self, fleet_size, fleet_dir, manifest):
+        data_folder = os.path.join(fleet_dir, 'data')
+        by_kind = {}
+        for item in manifest:
+            if item['kind'] != 'missing':
+                by_kind.setdefault(item['kind'], []).append(item)
+
+        for name, module in self.engines.items():
+            analyzer = module.RouteAnalyzer(os.path.join(fleet_dir, 'routesinformation.csv'), data_folder)
+            for kind, items in sorted(by_kind.items()):
+                paths = [os.path.join(data_folder, item['filename']) for item in items]
+
+                def run():
+                    for path in paths:
+                        analyzer.process_file(path)
+
+                seconds = _best_of(run, self.repeat)
+                self.record(fleet_size, 'process_file', name, kind, seconds,
+                            points=sum(item['rows'] for item in items), files=len(items))
+
+    def bench_checks(self, fleet_size, fleet_dir, manifest):
+        cache_folder = os.path.join(fleet_dir, 'cache')
+        data_folder = os.path.join(fleet_dir, 'data')
+        traces = [load_cached_points(cache_folder, item['file_id']) for item in manifest
+                  if item['valid_points'] > 1]
+        point_lists = [[tuple(p) for p in trace.tolist()] for trace in traces]
+        n_points = sum(len(points) for points in point_lists)
+        mixed_frames = [pd.read_excel(os.path.join(data_folder, item['filename']))
+                        for item in manifest if item['kind'] == 'mixed_format']
+
+        for name, module in self.engines.items():
+            analyzer = module.RouteAnalyzer('', data_folder)
+            distances = [analyzer.calculate_route_distance(points)[1] for points in point_lists]
+
+            checks = {
+                'validate_coordinates': lambda: [analyzer.validate_coordinates(lat, lon)
+                                                 for points in point_lists for lat, lon in points],
+                'calculate_route_distance': lambda: [analyzer.calculate_route_distance(points)
+                                                     for points in point_lists],
+                'detect_anomalies': lambda: [analyzer.detect_anomalies(points, dists)
+                                             for points, dists in zip(point_lists, distances)],
+                'check_alternating_regions': lambda: [analyzer.check_alternating_regions(points)
+                                                      for points in point_lists],
+            }
+            for check, fn in checks.items():
+                self.record(fleet_size, 'check', name, check, _best_of(fn, self.repeat),
+                            points=n_points, files=len(point_lists))
+
+            if mixed_frames:
+                seconds = _best_of(lambda: [analyzer.parse_mixed_coordinates(df) for df in mixed_frames],
+                                   self.repeat)
+                self.record(fleet_size, 'check', name, 'parse_mixed_coordinates', seconds,
+                            points=sum(len(df) for df in mixed_frames), files=len(mixed_frames))
+
+    def bench_codec(self, fleet_size, fleet_dir, manifest):
+        """Bytes per point and encode/decode time of the trace transfer formats"""
+        cache_folder = os.path.join(fleet_dir, 'cache')
+        traces = [load_cached_points(cache_folder, item['file_id']) for item in manifest
+                  if item['valid_points'] > 1]
+        n_points = sum(len(trace) for trace in traces)
+
+        def float_tuples(trace):
+            return pickle.dumps([tuple(p) for p in trace.tolist()], protocol=pickle.HIGHEST_PROTOCOL)
+
+        formats = {
+            'float_tuples_pickle': (float_tuples, pickle.loads),
+            'numpy_pickle': (lambda t: pickle.dumps(t, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+            'trace_p6': (lambda t: trace_codec.encode_trace(t[:, 0], t[:, 1], precision=6),
+                         trace_codec.decode_trace),
+            'trace_lossless': (lambda t: trace_codec.encode_trace(t[:, 0], t[:, 1], precision=None),
+                               trace_codec.decode_trace),
+            'polyline_p5': (lambda t: trace_codec.encode_polyline(t[:, 0], t[:, 1]),
+                            trace_codec.decode_polyline),
+        }
+        for case, (encode, decode) in formats.items():
+            encoded = [encode(trace) for trace in traces]
+            bytes_per_point = round(sum(len(e) for e in encoded) / max(n_points, 1), 3)
+            self.record(fleet_size, 'codec_encode', 'trace_codec', case,
+                        _best_of(lambda: [encode(trace) for trace in traces], self.repeat),
+                        points=n_points, files=len(traces), bytes_per_point=bytes_per_point)
+            self.record(fleet_size, 'codec_decode', 'trace_codec', case,
+                        _best_of(lambda: [decode(e) for e in encoded], self.repeat),
+                        points=n_points, files=len(traces), bytes_per_point=bytes_per_point)
+
+    def bench_startup(self):
+        """Wall time of fresh interpreters: CLI entry point and imports of the analysis path"""
+        cli = os.path.join(SCRIPT_DIR, 'route_cli.py')
+        with tempfile.TemporaryDirectory() as cache_folder:
+            commands = {
+                'cli_help': [cli, '--help'],
+                'cli_cache_stats': [cli, 'cache', 'stats', '--folder', cache_folder],
+                'import_route_pipeline': ['-c', 'import route_pipeline'],
+                'import_analyzerv2': ['-c', 'import analyzerv2'],
+                'import_route_renderer': ['-c', 'import route_renderer'],
+            }
+            for case, command in commands.items():
+                def run():
+                    subprocess.run([sys.executable] + command, cwd=SCRIPT_DIR, check=True,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+                self.record(0, 'startup', 'python', case, _best_of(run, self.repeat))
+
+    def bench_process_all_routes(self, fleet_size, fleet_dir, manifest):
+        csv_file = os.path.join(fleet_dir, 'routesinformation.csv')
+        data_folder = os.path.join(fleet_dir, 'data')
+        n_points = sum(item['rows'] for item in manifest)
+
+        modes = [('route_analyzer', 'serial', {}),
+                 ('analyzerv2', 'serial', {'use_multiprocessing': False}),
+                 ('analyzerv2', 'pool', {'use_multiprocessing': True})]
+        for name, mode, kwargs in modes:
+            module = self.engines[name]
+
+            def run():
+                if name == 'analyzerv2':
+                    analyzer = module.RouteAnalyzer(csv_file, data_folder, num_workers=self.num_workers)
+                else:
+                    analyzer = module.RouteAnalyzer(csv_file, data_folder)
+                # The analyzers print progress; keep the benchmark output readable
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    analyzer.load_csv_index()
+                    analyzer.process_all_routes(**kwargs)
+
+            seconds = _best_of(run, 1)
+            self.record(fleet_size, 'process_all_routes', name, mode, seconds,
+                        points=n_points, files=len(manifest))
+
+    def run(self, fleet_sizes, include_pool=True, include_startup=True):
+        started = time.time()
+        if include_startup:
+            print("\n=== Startup ===")
+            self.bench_startup()
+        for fleet_size in fleet_sizes:
+            print(f"\n=== Fleet size {fleet_size} ===")
+            fleet_dir, manifest = self.prepare_fleet(fleet_size)
+            self.bench_process_file(fleet_size, fleet_dir, manifest)
+            self.bench_checks(fleet_size, fleet_dir, manifest)
+            self.bench_codec(fleet_size, fleet_dir, manifest)
+            if include_pool:
+                self.bench_process_all_routes(fleet_size, fleet_dir, manifest)
+        return {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'git_revision': _git_revision(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'seed': self.seed,
+                'repeat': self.repeat,
+                'fleet_sizes': list(fleet_sizes),
+                'total_seconds': round(time.time() - started, 2),
+            },
+            'results': self.results,
+        }
+
+
+def compare_results(old_file, new_file):
+    """Print per-benchmark speedups between two saved result files"""
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+
+    def key(entry):
+        return (entry['fleet_size'], entry['benchmark'], entry['engine'], entry['case'])
+
+    old_index = {key(e): e for e in old['results']}
+    print(f"Baseline: {old['meta'].get('git_revision')}  Candidate: {new['meta'].get('git_revision')}")
+    print(f"{'fleet':>6} {'benchmark':<20} {'engine':<15} {'case':<26} {'old s':>10} {'new s':>10} {'speedup':>8}")
+    rows = []
+    for entry in new['results']:
+        base = old_index.get(key(entry))
+        if base is None or not entry['seconds']:
+            continue
+        speedup = base['seconds'] / entry['seconds']
+        rows.append((*key(entry), base['seconds'], entry['seconds'], speedup))
+        flag = '  REGRESSION' if speedup < 0.9 else ''
+        print(f"{entry['fleet_size']:>6} {entry['benchmark']:<20} {entry['engine']:<15} {entry['case']:<26} "
+              f"{base['seconds']:>10.4f} {entry['seconds']:>10.4f} {speedup:>7.2f}x{flag}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the route analyzers on synthetic fleets')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100], help='Fleet sizes to benchmark')
+    parser.add_argument('--output', default='bench_results.json', help='JSON file for the results')
+    parser.add_argument('--workdir', default='bench_fleets', help='Folder for generated fleets')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per timing (best is kept)')
+    parser.add_argument('--workers', type=int, default=None, help='Pool size for analyzerv2')
+    parser.add_argument('--huge-points', type=int, default=100000, help='Points in the huge trace per fleet')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-fleet-run', action='store_true', help='Skip the process_all_routes timings')
+    parser.add_argument('--no-startup', action='store_true', help='Skip the interpreter startup timings')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    bench = RouteBenchmark(args.workdir, seed=args.seed, repeat=args.repeat,
+                           num_workers=args.workers, huge_points=args.huge_points)
+    report = bench.run(args.sizes, include_pool=not args.no_fleet_run, include_startup=not args.no_startup)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
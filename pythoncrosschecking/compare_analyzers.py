@@ -0,0 +1,439 @@
+"""
+Analyzer Equivalence Harness
+============================
+Runs several analyzer implementations over the same corpus and reports every
+route where their results disagree, so performance rewrites cannot silently
+change statuses, point counts, distances or anomalies.
+
+route_analyzer.py and analyzerv2.py both run the shared RoutePipeline, so the
+first engine is 'reference': a frozen copy of the original per-row
+process_file logic (iterrows, geopy per segment). Do not optimise or change
+it - every other engine is checked against it. Results are normalised to one
+schema before comparison (route_analyzer.py writes csv_col1..4, analyzerv2.py
+writes BU_Code/Location/Row_Labels/Customer_Name). Outputs of the reference
+engine can be recorded as a golden file and later compared against new
+engines without paying for the slow reference run.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+
+Usage:
+------
+python compare_analyzers.py --csv routesinformation.csv --data data
+python compare_analyzers.py --csv synthetic/routesinformation.csv --data synthetic/data --record golden.jsonl
+python compare_analyzers.py --csv synthetic/routesinformation.csv --data synthetic/data --engines route_analyzer chunked --golden golden.jsonl
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import math
+import multiprocessing as mp
+import os
+import time
+
+import pandas as pd
+
+# Engine name -> "module.Class"; the class must provide process_file(filepath, csv_row_data).
+# The first engine is the reference the others are compared against.
+ENGINES = {
+    'reference': 'compare_analyzers.ReferenceAnalyzer',
+    'route_analyzer': 'route_analyzer.RouteAnalyzer',
+    'analyzerv2': 'analyzerv2.RouteAnalyzer',
+    'chunked': 'route_chunked.ChunkedRouteAnalyzer',
+}
+
+# Index columns under the different result schemas
+COLUMN_ALIASES = {
+    'csv_col1': 'BU_Code',
+    'csv_col2': 'Location',
+    'csv_col3': 'Row_Labels',
+    'csv_col4': 'Customer_Name',
+}
+
+COMPARED_FIELDS = ['status', 'total_points', 'valid_points', 'total_distance_km',
+                   'start_location', 'end_location', 'anomalies']
+
+# Anomaly kinds added after the reference engine (route_regions). When the expected result has
+# none of a kind, the compared engine's anomalies of that kind - and the 'Good' -> 'Has anomalies'
+# status change they cause - are not mismatches.
+INTRODUCED_ANOMALIES = ('Teleport-back pattern', 'Interleaved trace', 'Wide region span')
+
+_engines = {}
+
+
+class ReferenceAnalyzer:
+    """Frozen baseline route_analyzer.RouteAnalyzer.process_file (reference engine - keep unchanged)"""
+
+    def __init__(self, csv_file, data_folder='data'):
+        self.csv_file = csv_file
+        self.data_folder = data_folder
+
+    def validate_coordinates(self, lat, lon):
+        try:
+            lat = float(lat)
+            lon = float(lon)
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                if 6 <= lat <= 38 and 68 <= lon <= 98:
+                    return True
+            return False
+        except Exception:
+            return False
+
+    def calculate_route_distance(self, points):
+        from geopy.distance import geodesic
+        total_distance = 0
+        distances = []
+        for i in range(len(points) - 1):
+            try:
+                dist = geodesic(points[i], points[i + 1]).kilometers
+                distances.append(dist)
+                total_distance += dist
+            except Exception:
+                distances.append(0)
+        return total_distance, distances
+
+    def detect_anomalies(self, points, distances):
+        anomalies = []
+        duplicates = 0
+        for i in range(len(points) - 1):
+            if points[i] == points[i + 1]:
+                duplicates += 1
+        if duplicates > 0:
+            anomalies.append(f"Found {duplicates} duplicate consecutive points")
+        large_jumps = [i for i, d in enumerate(distances) if d > 100]
+        if large_jumps:
+            anomalies.append(f"Large jumps (>100km) at positions: {large_jumps}")
+        stationary = [i for i, d in enumerate(distances) if 0 < d < 0.01]
+        if len(stationary) > 5:
+            anomalies.append(f"Many stationary points ({len(stationary)} segments < 10m)")
+        return anomalies
+
+    def parse_mixed_coordinates(self, df):
+        valid_points = []
+        anomalies = []
+        mixed_format_detected = False
+        for idx, row in df.iterrows():
+            values = [v for v in row.values if pd.notna(v)]
+            if len(values) == 0:
+                continue
+            numeric_values = []
+            for v in values:
+                try:
+                    numeric_values.append(float(v))
+                except Exception:
+                    continue
+            if len(numeric_values) == 4:
+                mixed_format_detected = True
+                lat1, lon1 = numeric_values[0], numeric_values[1]
+                lat2, lon2 = numeric_values[2], numeric_values[3]
+                if self.validate_coordinates(lat1, lon1):
+                    valid_points.append((lat1, lon1))
+                if self.validate_coordinates(lat2, lon2):
+                    valid_points.append((lat2, lon2))
+            elif len(numeric_values) == 2:
+                lat, lon = numeric_values[0], numeric_values[1]
+                if self.validate_coordinates(lat, lon):
+                    valid_points.append((lat, lon))
+            elif len(numeric_values) == 3:
+                anomalies.append(f"Row {idx}: Found 3 values, expected 2 or 4")
+                lat, lon = numeric_values[0], numeric_values[1]
+                if self.validate_coordinates(lat, lon):
+                    valid_points.append((lat, lon))
+        if mixed_format_detected:
+            anomalies.append("Mixed format detected: Multiple coordinate pairs per row")
+        return valid_points, anomalies
+
+    def check_alternating_regions(self, points):
+        if len(points) < 2:
+            return []
+        anomalies = []
+        lat_groups = {}
+        for i, (lat, lon) in enumerate(points):
+            lat_groups.setdefault(int(lat), []).append(i)
+        if len(lat_groups) > 1:
+            region_desc = ", ".join([f"{prefix}° ({len(indices)} points)" for prefix, indices in lat_groups.items()])
+            anomalies.append(f"Route spans multiple latitude regions: {region_desc}")
+            prev_prefix = int(points[0][0])
+            alternations = 0
+            for lat, lon in points[1:]:
+                curr_prefix = int(lat)
+                if curr_prefix != prev_prefix:
+                    alternations += 1
+                    prev_prefix = curr_prefix
+            if alternations > len(points) * 0.3:
+                anomalies.append(f"Frequent alternation between regions detected ({alternations} times)")
+        return anomalies
+
+    def _result(self, filepath, csv_row_data, status, total_points=0, valid_points=(), total_distance=0,
+                anomalies=()):
+        filename = os.path.basename(filepath)
+        row = csv_row_data if csv_row_data is not None else [None] * 4
+        return {
+            'file_id': filename.split('.')[0],
+            'filename': filename,
+            'csv_col1': row[0] if csv_row_data is None else row.iloc[0],
+            'csv_col2': row[1] if csv_row_data is None else row.iloc[1],
+            'csv_col3': row[2] if csv_row_data is None else row.iloc[2],
+            'csv_col4': row[3] if csv_row_data is None else row.iloc[3],
+            'status': status,
+            'total_points': total_points,
+            'valid_points': len(valid_points),
+            'total_distance_km': round(total_distance, 2),
+            'start_location': f"{valid_points[0][0]:.6f}, {valid_points[0][1]:.6f}" if valid_points else None,
+            'end_location': f"{valid_points[-1][0]:.6f}, {valid_points[-1][1]:.6f}" if valid_points else None,
+            'anomalies': list(anomalies) if anomalies else ['None detected'],
+        }
+
+    def process_file(self, filepath, csv_row_data=None):
+        try:
+            try:
+                df = pd.read_excel(filepath)
+            except Exception:
+                return self._result(filepath, csv_row_data, 'Error reading file',
+                                    anomalies=['Could not read Excel file'])
+
+            lat_col = None
+            lon_col = None
+            lat_variations = ['Latitude', 'latitude', 'lat', 'Lat', 'LATITUDE']
+            lon_variations = ['Longitude', 'longitude', 'lon', 'Lon', 'LONGITUDE', 'Long']
+            for col in df.columns:
+                if any(lat_var in str(col) for lat_var in lat_variations):
+                    lat_col = col
+                if any(lon_var in str(col) for lon_var in lon_variations):
+                    lon_col = col
+
+            format_anomalies = []
+            total_points = len(df)
+            if lat_col is not None and lon_col is not None:
+                valid_points = []
+                for idx, row in df.iterrows():
+                    lat = row[lat_col]
+                    lon = row[lon_col]
+                    if self.validate_coordinates(lat, lon):
+                        valid_points.append((float(lat), float(lon)))
+            else:
+                valid_points, format_anomalies = self.parse_mixed_coordinates(df)
+
+            if len(valid_points) == 0:
+                return self._result(filepath, csv_row_data, 'No valid coordinates', total_points,
+                                    anomalies=['No valid coordinates found'] + format_anomalies)
+
+            total_distance, distances = self.calculate_route_distance(valid_points)
+            anomalies = self.detect_anomalies(valid_points, distances)
+            anomalies.extend(format_anomalies)
+            anomalies.extend(self.check_alternating_regions(valid_points))
+
+            if len(valid_points) < total_points * 0.5:
+                status = 'Poor quality data'
+            elif anomalies:
+                status = 'Has anomalies'
+            else:
+                status = 'Good'
+            return self._result(filepath, csv_row_data, status, total_points, valid_points, total_distance,
+                                anomalies)
+        except Exception as e:
+            return self._result(filepath, csv_row_data, 'Processing error', anomalies=[f'Error: {str(e)}'])
+
+
+def load_engine(name):
+    """Instantiate the analyzer registered under name (or given as module.Class)"""
+    spec = ENGINES.get(name, name)
+    module_name, class_name = spec.rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    # analyzerv2 logs every file at DEBUG; the harness only wants mismatches
+    for logger_name in (module_name, 'route_pipeline', 'route_chunked'):
+        logging.getLogger(logger_name).setLevel(logging.CRITICAL)
+    return getattr(module, class_name)('', '')
+
+
+def normalize_result(result):
+    """Map a result dict onto the common schema"""
+    normalized = {COLUMN_ALIASES.get(k, k): v for k, v in result.items()}
+    anomalies = normalized.get('anomalies') or []
+    if isinstance(anomalies, str):
+        anomalies = [anomalies]
+    normalized['anomalies'] = sorted(a for a in anomalies if a != 'None detected')
+    for key in ('total_points', 'valid_points'):
+        if normalized.get(key) is not None:
+            normalized[key] = int(normalized[key])
+    if normalized.get('total_distance_km') is not None:
+        normalized['total_distance_km'] = float(normalized['total_distance_km'])
+    for key in ('BU_Code', 'Location', 'Row_Labels', 'Customer_Name'):
+        if normalized.get(key) is not None:
+            normalized[key] = str(normalized[key])
+    return normalized
+
+
+def compare_results(expected, actual, distance_tol=0.01, distance_rel_tol=1e-6):
+    """Return a list of (field, expected, actual) differences"""
+    introduced = [kind for kind in INTRODUCED_ANOMALIES
+                  if not any(a.startswith(kind) for a in expected.get('anomalies') or [])]
+    actual_anomalies = actual.get('anomalies') or []
+    kept = [a for a in actual_anomalies if not a.startswith(tuple(introduced))]
+    if len(kept) < len(actual_anomalies):
+        actual = dict(actual, anomalies=kept)
+        if not kept and actual.get('status') == 'Has anomalies' and expected.get('status') == 'Good':
+            actual['status'] = 'Good'
+    differences = []
+    for field in COMPARED_FIELDS:
+        a, b = expected.get(field), actual.get(field)
+        if field == 'total_distance_km' and a is not None and b is not None:
+            if not math.isclose(a, b, rel_tol=distance_rel_tol, abs_tol=distance_tol + 1e-9):
+                differences.append((field, a, b))
+        elif field == 'anomalies':
+            if set(a or []) != set(b or []):
+                missing = sorted(set(a or []) - set(b or []))
+                extra = sorted(set(b or []) - set(a or []))
+                differences.append((field, missing, extra))
+        elif a != b:
+            differences.append((field, a, b))
+    return differences
+
+
+def _init_worker(engine_names):
+    for name in engine_names:
+        _engines[name] = load_engine(name)
+
+
+def _run_engines(task):
+    """Run every loaded engine on one route (executed in the worker pool)"""
+    filepath, row_values = task
+    row = pd.Series(row_values)
+    outputs = {}
+    for name, analyzer in _engines.items():
+        start = time.perf_counter()
+        result = analyzer.process_file(filepath, row)
+        outputs[name] = (normalize_result(result), time.perf_counter() - start)
+    return filepath, outputs
+
+
+def load_golden(golden_file):
+    with open(golden_file) as f:
+        return {entry['file_id']: entry for entry in map(json.loads, f)}
+
+
+class EquivalenceHarness:
+    def __init__(self, csv_file, data_folder, engines=None, num_workers=None,
+                 distance_tol=0.01, distance_rel_tol=1e-6):
+        self.csv_file = csv_file
+        self.data_folder = data_folder
+        self.engines = engines or list(ENGINES)
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.distance_tol = distance_tol
+        self.distance_rel_tol = distance_rel_tol
+
+    def build_tasks(self):
+        """Existing Excel files from the index, with their CSV row values"""
+        csv_data = pd.read_csv(self.csv_file)
+        tasks, missing = [], []
+        for _, row in csv_data.iterrows():
+            filename = f"{row.iloc[0]}_{row.iloc[2]}.xlsx"
+            filepath = os.path.join(self.data_folder, filename)
+            if os.path.exists(filepath):
+                tasks.append((filepath, row.tolist()))
+            else:
+                missing.append(filename)
+        return tasks, missing
+
+    def run(self, golden=None, record_file=None):
+        """Run all engines; compare against the first engine (the reference) or a golden file"""
+        tasks, missing = self.build_tasks()
+        print(f"Comparing {len(self.engines)} engine(s) on {len(tasks)} files "
+              f"({len(missing)} missing) with {self.num_workers} workers")
+
+        start = time.time()
+        if self.num_workers > 1 and len(tasks) > 1:
+            chunksize = max(1, len(tasks) // (self.num_workers * 8))
+            with mp.Pool(self.num_workers, initializer=_init_worker, initargs=(self.engines,)) as pool:
+                outputs = list(pool.imap_unordered(_run_engines, tasks, chunksize=chunksize))
+        else:
+            _init_worker(self.engines)
+            outputs = [_run_engines(task) for task in tasks]
+        elapsed = time.time() - start
+
+        mismatches = []
+        timings = {name: 0.0 for name in self.engines}
+        recorded = []
+        for filepath, per_engine in sorted(outputs):
+            reference_name = 'golden' if golden is not None else self.engines[0]
+            if golden is not None:
+                file_id = os.path.basename(filepath).split('.')[0]
+                reference = golden.get(file_id)
+                if reference is None:
+                    mismatches.append({'file_id': file_id, 'engine': '*', 'reference': 'golden',
+                                       'field': 'file_id', 'expected': None, 'actual': file_id})
+                    continue
+            else:
+                reference = per_engine[reference_name][0]
+            for name, (result, seconds) in per_engine.items():
+                timings[name] += seconds
+                if name == reference_name:
+                    continue
+                for field, expected, actual in compare_results(reference, result, self.distance_tol,
+                                                               self.distance_rel_tol):
+                    mismatches.append({'file_id': result['file_id'], 'engine': name,
+                                       'reference': reference_name, 'field': field,
+                                       'expected': expected, 'actual': actual})
+            if record_file:
+                recorded.append(per_engine[self.engines[0]][0])
+
+        if record_file:
+            with open(record_file, 'w') as f:
+                for entry in recorded:
+                    f.write(json.dumps(entry, default=str) + '\n')
+            print(f"Recorded {len(recorded)} golden results from {self.engines[0]} to: {record_file}")
+
+        return {'files': len(tasks), 'missing': missing, 'mismatches': mismatches,
+                'engine_seconds': timings, 'elapsed_seconds': elapsed}
+
+
+def print_report(report, output_file=None):
+    mismatches = report['mismatches']
+    by_file = {}
+    for m in mismatches:
+        by_file.setdefault(m['file_id'], []).append(m)
+
+    print("\n=== EQUIVALENCE REPORT ===")
+    print(f"Files compared: {report['files']}")
+    print(f"Files with mismatches: {len(by_file)}")
+    print(f"Wall time: {report['elapsed_seconds']:.2f} s")
+    for name, seconds in report['engine_seconds'].items():
+        print(f"  {name}: {seconds:.2f} s total engine time")
+    for file_id, items in list(by_file.items())[:20]:
+        fields = ", ".join(f"{m['engine']}:{m['field']}" for m in items)
+        print(f"  {file_id}: {fields}")
+    if len(by_file) > 20:
+        print(f"  ... {len(by_file) - 20} more")
+
+    if output_file and mismatches:
+        pd.DataFrame(mismatches).to_csv(output_file, index=False)
+        print(f"Mismatch details saved to: {output_file}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Differential test of route analyzer implementations')
+    parser.add_argument('--csv', default='routesinformation.csv', help='Route index CSV')
+    parser.add_argument('--data', default='data', help='Folder with Excel files')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES),
+                        help=f"Engines to compare (registered: {', '.join(ENGINES)}, or module.Class)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--distance-tol', type=float, default=0.01, help='Absolute distance tolerance (km)')
+    parser.add_argument('--golden', help='Compare all engines against a recorded golden file')
+    parser.add_argument('--record', help='Record the first engine\'s results as a golden file')
+    parser.add_argument('--output', default='equivalence_mismatches.csv', help='CSV for mismatch details')
+    args = parser.parse_args(argv)
+
+    harness = EquivalenceHarness(args.csv, args.data, engines=args.engines, num_workers=args.workers,
+                                 distance_tol=args.distance_tol)
+    golden = load_golden(args.golden) if args.golden else None
+    report = harness.run(golden=golden, record_file=args.record)
+    print_report(report, args.output)
+    return 1 if report['mismatches'] else 0
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    raise SystemExit(main())
@@ -0,0 +1,391 @@
+"""
+Chunked Route Analysis
+======================
+Memory-bounded analysis of very large trace files (e.g. long-haul routes
+logged at 1 Hz). Instead of loading the whole sheet into a DataFrame, rows
+are streamed from openpyxl's read-only reader in blocks of chunk_rows, and
+only the state that crosses chunk boundaries is kept:
+
+- the last valid point (for the segment into the next chunk)
+- the running distance (as exact fsum partials)
+- duplicate, stationary and large-jump counters
+- the run-length encoded grid cells of the region profile (the latitude
+  bands are taken from them; geohash cells straddle whole degrees, so for
+  those the band counts and band changes are carried separately)
+- when the clean or motion stage is enabled, the compact trace: the valid
+  points (and the seconds of every timestamp column candidate) as float
+  arrays, about 1/30 of the memory of the sheet's DataFrame
+
+Results match the full pipeline for the distance, anomalies, format,
+regions, clean and motion stages; cleaning and motion analytics run once on
+the compact trace after the last chunk. The point stride of sampled triage
+runs (the 'stride' stage) is applied while streaming. The trace export and the trace cache
+are skipped for chunked routes, which get a 'chunks' result column instead.
+Sheets without coordinate headers (mixed format) are not streamed.
+
+RouteAnalyzerBase streams files whose estimated in-memory size exceeds its
+per-worker memory_budget_mb; route_executor.py keeps the sum of the worker
+budgets within the available memory.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+
+Usage:
+------
+ctx = analyze_chunked('data/1527_0041000139.xlsx', RoutePipeline(), chunk_rows=50000)
+analyzer = RouteAnalyzer(csv_file, data_folder, memory_budget_mb=512)   # analyzerv2.py
+python compare_analyzers.py --engines reference chunked --csv routesinformation.csv --data data
+"""
+
+import datetime
+import logging
+import math
+import os
+
+import numpy as np
+
+import route_cleaning  # registers the trace cleaning stage
+import route_motion  # registers the speed / stop analytics stage
+from route_pipeline import (STAGES, REGION_COLUMNS, TIME_VARIATIONS, RouteAnalyzerBase, RouteContext,
+                            anomaly_count_messages, band_messages, count_duplicates, count_stationary,
+                            detect_coordinate_columns, segment_distances_km, to_float_array, to_seconds,
+                            valid_coordinate_mask)
+from route_regions import cell_runs, cell_steps, cells_per_degree, grid_cells, profile_messages, runs_profile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 50000
+MIN_CHUNK_ROWS = 1000
+# Per-worker memory budget used by analyzerv2.py
+MEMORY_BUDGET_MB = 512
+# Peak memory of the full pipeline per byte of .xlsx (read_excel + DataFrame + trace arrays)
+XLSX_MEMORY_FACTOR = 30
+# Memory per streamed row (openpyxl row tuple and cells, column lists, chunk arrays)
+BYTES_PER_STREAMED_ROW = 500
+# Share of the memory budget a chunk may take
+CHUNK_BUDGET_SHARE = 0.5
+# Small odd chunk size of the equivalence engine, so chunk boundaries fall everywhere
+EQUIVALENCE_CHUNK_ROWS = 97
+# Stages run on the compact trace kept across chunks
+TRACE_STAGES = ('clean', 'motion')
+# Stages computed for chunked routes; every other stage is skipped
+CHUNKED_STAGES = ('read', 'parse', 'stride', 'distance', 'anomalies', 'format', 'regions') + TRACE_STAGES
+# Share of a timestamp column's values that must parse (detect_timestamp_column)
+MIN_PARSED_TIMES = 0.5
+
+
+def estimate_memory_mb(filepath):
+    """Estimated peak memory of analyzing a file with the full pipeline"""
+    return os.path.getsize(filepath) * XLSX_MEMORY_FACTOR / 2 ** 20
+
+
+def chunk_rows_for_budget(memory_budget_mb):
+    """Rows per chunk that keep a chunk within its share of the memory budget"""
+    rows = int(memory_budget_mb * 2 ** 20 * CHUNK_BUDGET_SHARE / BYTES_PER_STREAMED_ROW)
+    return max(MIN_CHUNK_ROWS, min(CHUNK_ROWS, rows))
+
+
+def header_names(header):
+    """Column names as read_excel gives them for the coordinate column lookup"""
+    return [f"Unnamed: {i}" if value is None else value for i, value in enumerate(header)]
+
+
+def is_empty_row(row):
+    return all(value is None or value == '' for value in row)
+
+
+def column_values(rows, index):
+    """One column of a block of row tuples (rows may be shorter than the header)"""
+    return [row[index] if index < len(row) else None for row in rows]
+
+
+def is_datetime_column(values):
+    """Values read_excel would turn into a datetime column"""
+    return all(value is None or isinstance(value, datetime.datetime) for value in values)
+
+
+def time_candidates(names, row):
+    """Timestamp column candidates: datetime cells in the first data row, then columns named like a time"""
+    typed = [i for i, value in enumerate(row) if isinstance(value, datetime.datetime)]
+    named = [i for i, name in enumerate(names) if any(var in str(name) for var in TIME_VARIATIONS)]
+    return typed + [i for i in named if i not in typed]
+
+
+class ChunkState:
+    """Per-route state carried from chunk to chunk"""
+
+    def __init__(self, cell_deg, geohash_precision, keep_trace=False, point_stride=1):
+        self.total_points = 0
+        self.rows_seen = 0
+        self.chunks = 0
+        self.lat_step, self.lon_step = cell_steps(cell_deg, geohash_precision)
+        # Bands are only tracked point by point when the cells do not tile whole degrees
+        self.track_bands = cells_per_degree(self.lat_step) is None
+        self.geohash_precision = geohash_precision
+        self.keep_trace = keep_trace
+        # Timestamp column candidate -> parsed values, and whether all values so far are datetimes
+        self.time_parsed = {}
+        self.time_typed = {}
+        # Every point_stride-th valid point is kept, like the full pipeline's 'stride' stage.
+        # Routes of at most point_stride valid points are not strided, so the first ones are
+        # held until the route is known to be longer.
+        self.point_stride = point_stride
+        self.stride_seen = 0
+        self.head = None
+        self.reset_points()
+
+    def reset_points(self):
+        self.valid_points = 0
+        self.first = None
+        self.last = None
+        # fsum of every chunk plus its rounding residual; fsum of all is the exact total
+        self.distance_partials = []
+        self.duplicates = 0
+        self.stationary = 0
+        self.large_jumps = []
+        # Latitude band -> points, in order of first appearance
+        self.band_counts = {}
+        self.band_changes = 0
+        self.last_band = None
+        self.runs = []
+        # Compact trace for the clean and motion stages
+        self.lat_parts = []
+        self.lon_parts = []
+        # Timestamp column candidate -> seconds of the valid points per chunk
+        self.time_parts = {}
+
+    def add_rows(self, rows, lat_index, lon_index, time_indices=()):
+        """Add a block of sheet rows (trailing empty rows are only counted once data follows)"""
+        self.chunks += 1
+        nonempty = [i for i, row in enumerate(rows) if not is_empty_row(row)]
+        if nonempty:
+            self.total_points = self.rows_seen + nonempty[-1] + 1
+        self.rows_seen += len(rows)
+        lat = to_float_array(np.array(column_values(rows, lat_index), dtype=object))
+        lon = to_float_array(np.array(column_values(rows, lon_index), dtype=object))
+        mask = valid_coordinate_mask(lat, lon)
+        seconds = self.add_times(rows, time_indices) if self.keep_trace else {}
+        if self.point_stride > 1:
+            mask = self.stride_mask(mask, lat, lon, seconds)
+        if self.keep_trace:
+            for index, values in seconds.items():
+                self.time_parts.setdefault(index, []).append(values[mask])
+            self.lat_parts.append(lat[mask])
+            self.lon_parts.append(lon[mask])
+        self.add_points(lat[mask], lon[mask])
+
+    def add_times(self, rows, time_indices):
+        """Parse the timestamp column candidates of a block; returns index -> seconds per row"""
+        parsed = {}
+        for index in time_indices:
+            values = column_values(rows, index)
+            seconds = to_seconds(values) if values else np.zeros(0)
+            parsed[index] = seconds
+            self.time_parsed[index] = self.time_parsed.get(index, 0) + int(np.count_nonzero(~np.isnan(seconds)))
+            self.time_typed[index] = self.time_typed.get(index, True) and is_datetime_column(values)
+        return parsed
+
+    def stride_mask(self, mask, lat, lon, seconds):
+        """Narrow the valid point mask to every point_stride-th valid point of the route"""
+        valid = np.flatnonzero(mask)
+        position = self.stride_seen + np.arange(len(valid))
+        if self.stride_seen <= self.point_stride:
+            head = valid[position < self.point_stride]
+            if self.head is None:
+                self.head = ([], [], {})
+            self.head[0].append(lat[head])
+            self.head[1].append(lon[head])
+            for index, values in seconds.items():
+                self.head[2].setdefault(index, []).append(values[head])
+        self.stride_seen += len(valid)
+        if self.stride_seen > self.point_stride:
+            self.head = None
+        strided = np.zeros_like(mask)
+        strided[valid[position % self.point_stride == 0]] = True
+        return strided
+
+    def unstride(self):
+        """Redo the points of a route too short to stride from the held first points"""
+        lat_parts, lon_parts, time_parts = self.head
+        self.head = None
+        self.reset_points()
+        lat, lon = np.concatenate(lat_parts), np.concatenate(lon_parts)
+        if self.keep_trace:
+            self.lat_parts, self.lon_parts = [lat], [lon]
+            self.time_parts = {index: [np.concatenate(parts)] for index, parts in time_parts.items()}
+        self.add_points(lat, lon)
+
+    def trace_seconds(self):
+        """Seconds of the valid points from the column detect_timestamp_column would pick, or None"""
+        typed = [index for index in self.time_parts if self.time_typed[index]]
+        for index in typed + [index for index in self.time_parts if index not in typed]:
+            if self.total_points and self.time_parsed[index] >= MIN_PARSED_TIMES * self.total_points:
+                return np.concatenate(self.time_parts[index])
+        return None
+
+    def add_points(self, lat, lon):
+        n = len(lat)
+        if n == 0:
+            return
+        offset = self.valid_points - 1
+        if self.last is not None:
+            # Segment from the previous chunk's last point into this chunk
+            lat_all = np.concatenate(([self.last[0]], lat))
+            lon_all = np.concatenate(([self.last[1]], lon))
+        else:
+            lat_all, lon_all = lat, lon
+            self.first = (lat[0], lon[0])
+            offset = 0
+
+        segment_km = segment_distances_km(lat_all, lon_all)
+        total = math.fsum(segment_km)
+        self.distance_partials += [total, math.fsum(np.append(segment_km, -total))]
+        self.duplicates += count_duplicates((lat_all[:-1] == lat_all[1:]) & (lon_all[:-1] == lon_all[1:]))
+        self.stationary += count_stationary(segment_km)
+        self.large_jumps.extend((np.flatnonzero(segment_km > 100) + offset).tolist())
+
+        if self.track_bands:
+            self.add_bands(np.trunc(lat).astype(np.int64))
+        self.add_runs(*cell_runs(*grid_cells(lat, lon, self.lat_step, self.lon_step)))
+        self.valid_points += n
+        self.last = (lat[-1], lon[-1])
+
+    def add_bands(self, lat_band):
+        run_starts = np.concatenate(([0], np.flatnonzero(lat_band[1:] != lat_band[:-1]) + 1))
+        if self.last_band is not None:
+            self.band_changes += int(lat_band[0] != self.last_band)
+        self.band_changes += len(run_starts) - 1
+        bands, first_run = np.unique(lat_band[run_starts], return_index=True)
+        counts = np.bincount(lat_band - bands[0])[bands - bands[0]]
+        for i in np.argsort(first_run):
+            band = int(bands[i])
+            self.band_counts[band] = self.band_counts.get(band, 0) + int(counts[i])
+        self.last_band = lat_band[-1]
+
+    def add_runs(self, rows, cols, lengths):
+        if self.runs:
+            last_rows, last_cols, last_lengths = self.runs[-1]
+            if last_rows[-1] == rows[0] and last_cols[-1] == cols[0]:
+                # The chunk continues the previous chunk's last cell
+                last_lengths[-1] += lengths[0]
+                rows, cols, lengths = rows[1:], cols[1:], lengths[1:]
+        if len(lengths):
+            self.runs.append((rows, cols, lengths))
+
+    def finish(self, ctx, stage_names):
+        """Fill the context like the full pipeline's stages would"""
+        if self.head is not None:
+            self.unstride()
+        ctx.total_points = self.total_points
+        ctx.streamed_points = self.valid_points
+        if self.point_stride > 1 and self.stride_seen > self.point_stride:
+            # Scale the row count like the 'stride' stage does
+            ctx.total_points = round(self.total_points * self.valid_points / self.stride_seen)
+            ctx.extra['point_stride'] = self.point_stride
+        ctx.extra['chunks'] = self.chunks
+        logger.debug(f"Found {ctx.valid_points} valid points out of {ctx.total_points} in {self.chunks} chunks")
+        if self.valid_points == 0:
+            ctx.stop('No valid coordinates', ['No valid coordinates found'])
+            return ctx
+        if self.keep_trace:
+            ctx.lat = np.concatenate(self.lat_parts)
+            ctx.lon = np.concatenate(self.lon_parts)
+            ctx.seconds = self.trace_seconds()
+            self.lat_parts = self.lon_parts = []
+            self.time_parts = {}
+        else:
+            ctx.lat = np.array([self.first[0], self.last[0]])
+            ctx.lon = np.array([self.first[1], self.last[1]])
+
+        if 'distance' in stage_names:
+            ctx.metrics['total_distance_km'] = math.fsum(self.distance_partials)
+        if self.keep_trace:
+            # Cleaning and motion analytics run once on the whole compact trace
+            for name in stage_names:
+                if name in TRACE_STAGES:
+                    STAGES[name].run(ctx)
+        if 'anomalies' in stage_names:
+            ctx.anomalies.extend(anomaly_count_messages(self.duplicates, self.large_jumps, self.stationary))
+        if 'regions' in stage_names:
+            profile = runs_profile(*(np.concatenate(parts) for parts in zip(*self.runs)),
+                                   self.lat_step, self.lon_step, self.geohash_precision)
+            bands = profile['lat_bands']
+            if bands is None:
+                bands = list(self.band_counts), list(self.band_counts.values()), self.band_changes
+            ctx.anomalies.extend(band_messages(*bands, self.valid_points))
+            ctx.anomalies.extend(profile_messages(profile))
+            ctx.artifacts['regions'] = profile
+            ctx.extra.update({key: profile[key] for key in REGION_COLUMNS})
+        ctx.finalize()
+        return ctx
+
+
+def analyze_chunked(filepath, pipeline, chunk_rows=CHUNK_ROWS):
+    """Analyze a file streamed in blocks of chunk_rows rows.
+
+    Returns the RouteContext, or None when the sheet has no coordinate headers
+    and needs the full pipeline.
+    """
+    ctx = RouteContext(filepath)
+    skipped = [name for name in pipeline.stage_names if name not in CHUNKED_STAGES]
+    if skipped:
+        logger.debug(f"Stages skipped for chunked analysis of {ctx.filename}: {skipped}")
+    regions = STAGES['regions']
+    state = ChunkState(regions.cell_deg, regions.geohash_precision,
+                       keep_trace=any(name in TRACE_STAGES for name in pipeline.stage_names),
+                       point_stride=pipeline.point_stride if 'stride' in pipeline.stage_names else 1)
+
+    import openpyxl
+    try:
+        workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    except Exception as e:
+        ctx.error = str(e)
+        ctx.stop('Error reading file', ['Could not read Excel file'])
+        return ctx
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        lat_index = lon_index = None
+        if header is not None:
+            names = header_names(header)
+            lat_col, lon_col = detect_coordinate_columns(names)
+            lat_index = names.index(lat_col) if lat_col is not None else None
+            lon_index = names.index(lon_col) if lon_col is not None else None
+        if lat_index is None or lon_index is None:
+            logger.debug(f"No standard lat/lon columns in {ctx.filename}, not streaming")
+            return None
+        logger.debug(f"Streaming {ctx.filename} in chunks of {chunk_rows} rows ({lat_col}, {lon_col})")
+
+        block = []
+        time_indices = None
+        for row in rows:
+            block.append(row)
+            if time_indices is None:
+                time_indices = time_candidates(names, row)
+            if len(block) == chunk_rows:
+                state.add_rows(block, lat_index, lon_index, time_indices)
+                block = []
+        if block or state.chunks == 0:
+            state.add_rows(block, lat_index, lon_index, time_indices or ())
+    except Exception as e:
+        ctx.error = str(e)
+        ctx.stop('Error reading file', ['Could not read Excel file'])
+        return ctx
+    finally:
+        workbook.close()
+    return state.finish(ctx, pipeline.stage_names)
+
+
+class ChunkedRouteAnalyzer(RouteAnalyzerBase):
+    """Analyzer that streams every file in chunks (equivalence testing of the chunked mode)"""
+
+    def __init__(self, csv_file, data_folder='data', stages=None, chunk_rows=EQUIVALENCE_CHUNK_ROWS):
+        super().__init__(csv_file, data_folder, stages)
+        self.chunk_rows = chunk_rows
+
+    def analyze_file(self, filepath, df=None):
+        ctx = analyze_chunked(filepath, self.pipeline, self.chunk_rows) if df is None else None
+        return ctx if ctx is not None else self.pipeline.run(filepath, df)
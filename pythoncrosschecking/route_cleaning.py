@@ -0,0 +1,213 @@
+"""
+Route Trace Cleaning
+====================
+Repairs GPS traces instead of only flagging them, and reports the distance
+of the cleaned trace next to the raw distance.
+
+Cleaning steps, all vectorized and linear in the number of points:
+1. Duplicate consecutive fixes are dropped.
+2. The trace is cut into pieces wherever consecutive points are more than
+   split_km apart, and the pieces are chained into tracks by spatial
+   continuity: a piece continues the recently extended track whose last point
+   is nearest to its start (within split_km), otherwise it starts a new track.
+   Interleaved traces (two vehicles' exports merged, e.g. 17° and 21° blocks)
+   end up as separate tracks; tracks shorter than min_track_points are spikes.
+3. Within each track, points far from the rolling median of their neighbours
+   (spike_km) or reached and left at an impossible speed (max_speed_kmh, only
+   when timestamps are available and increasing) are dropped.
+4. Runs of stationary segments (< stationary_km) are collapsed to their first
+   and last point.
+
+The corrected distance is the length of the primary track (most points).
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+
+Usage:
+------
+import route_cleaning                        # registers the 'clean' pipeline stage
+cleaned = route_cleaning.clean_trace(lat, lon)
+cleaned['distance_km'], cleaned['tracks']
+"""
+
+import logging
+import math
+
+import numpy as np
+
+from route_pipeline import Stage, geodesic_km, register_stage
+
+logger = logging.getLogger(__name__)
+
+SPLIT_KM = 25.0
+SPIKE_KM = 2.0
+STATIONARY_KM = 0.01
+MAX_SPEED_KMH = 200.0
+MEDIAN_WINDOW = 5
+MIN_TRACK_POINTS = 3
+# Tracks considered when chaining a piece; bounds the work on garbage traces
+MAX_ACTIVE_TRACKS = 8
+
+KM_PER_DEGREE = 111.32
+
+
+def approx_km(lat1, lon1, lat2, lon2):
+    """Equirectangular distance; only used for threshold decisions"""
+    lat1, lon1, lat2, lon2 = (np.asarray(a, dtype=float) for a in (lat1, lon1, lat2, lon2))
+    x = (lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    return np.hypot(lat2 - lat1, x) * KM_PER_DEGREE
+
+
+def pair_distances_km(idx, lat, lon, segment_km=None):
+    """Geodesic length between consecutive points of an index sequence.
+
+    Pairs that are adjacent in the original trace reuse segment_km.
+    """
+    if len(idx) < 2:
+        return np.zeros(0)
+    a, b = idx[:-1], idx[1:]
+    if segment_km is None:
+        return geodesic_km(lat[a], lon[a], lat[b], lon[b])
+    distances = np.empty(len(a))
+    adjacent = b == a + 1
+    distances[adjacent] = segment_km[a[adjacent]]
+    other = ~adjacent
+    if other.any():
+        distances[other] = geodesic_km(lat[a[other]], lon[a[other]], lat[b[other]], lon[b[other]])
+    return distances
+
+
+def chain_pieces(starts, ends, lat, lon, split_km=SPLIT_KM, max_active=MAX_ACTIVE_TRACKS):
+    """Track number of every piece (pieces given as start/end point indices)"""
+    track_of_piece = np.empty(len(starts), dtype=np.int64)
+    start_lat, start_lon = lat[starts].tolist(), lon[starts].tolist()
+    end_lat, end_lon = lat[ends].tolist(), lon[ends].tolist()
+    # Active tracks, most recently extended last: [track, end_lat, end_lon]
+    active = []
+    n_tracks = 0
+    for p in range(len(starts)):
+        best, best_gap = None, split_km
+        for i, (_, t_lat, t_lon) in enumerate(active):
+            # Scalar approx_km; the active list is short and numpy overhead dominates here
+            x = (start_lon[p] - t_lon) * math.cos(math.radians((start_lat[p] + t_lat) / 2))
+            gap = math.hypot(start_lat[p] - t_lat, x) * KM_PER_DEGREE
+            if gap <= best_gap:
+                best, best_gap = i, gap
+        if best is not None:
+            track = active.pop(best)[0]
+        else:
+            track = n_tracks
+            n_tracks += 1
+            if len(active) >= max_active:
+                active.pop(0)
+        track_of_piece[p] = track
+        active.append([track, end_lat[p], end_lon[p]])
+    return track_of_piece
+
+
+def median_spike_mask(lat, lon, window=MEDIAN_WINDOW, spike_km=SPIKE_KM):
+    """Points further than spike_km from the rolling median of their window"""
+    if len(lat) < window:
+        return np.zeros(len(lat), dtype=bool)
+    half = window // 2
+    windows = np.lib.stride_tricks.sliding_window_view
+    median_lat = np.median(windows(np.pad(lat, half, mode='edge'), window), axis=1)
+    median_lon = np.median(windows(np.pad(lon, half, mode='edge'), window), axis=1)
+    return approx_km(lat, lon, median_lat, median_lon) > spike_km
+
+
+def speed_spike_mask(distances_km, seconds, max_speed_kmh=MAX_SPEED_KMH):
+    """Points both reached and left faster than max_speed_kmh"""
+    mask = np.zeros(len(distances_km) + 1, dtype=bool)
+    if len(distances_km) < 2:
+        return mask
+    hours = np.diff(seconds) / 3600.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Segments with an unreadable, repeated or backwards timestamp have no known speed and are
+        # never too fast; far jumps among them are left to the median spike test
+        too_fast = np.where(hours > 0, distances_km / hours, 0.0) > max_speed_kmh
+    mask[1:-1] = too_fast[:-1] & too_fast[1:]
+    return mask
+
+
+def stationary_mask(distances_km, stationary_km=STATIONARY_KM):
+    """Interior points of runs of stationary segments"""
+    mask = np.zeros(len(distances_km) + 1, dtype=bool)
+    short = distances_km < stationary_km
+    mask[1:-1] = short[:-1] & short[1:]
+    return mask
+
+
+def clean_trace(lat, lon, segment_km=None, seconds=None, split_km=SPLIT_KM, spike_km=SPIKE_KM,
+                stationary_km=STATIONARY_KM, max_speed_kmh=MAX_SPEED_KMH, min_track_points=MIN_TRACK_POINTS):
+    """Clean a trace and split it into coherent tracks.
+
+    Returns a dict with the kept point indices of every track ('tracks', primary
+    track first), their lengths ('track_km'), the corrected distance of the
+    primary track ('distance_km') and removed point counts per reason.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    n = len(lat)
+    removed = {'duplicates': 0, 'spikes': 0, 'stationary': 0}
+    if n == 0:
+        return {'tracks': [], 'track_km': [], 'distance_km': 0.0, 'removed': removed}
+    if segment_km is None:
+        segment_km = geodesic_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+    keep = np.ones(n, dtype=bool)
+    keep[1:] = (lat[1:] != lat[:-1]) | (lon[1:] != lon[:-1])
+    removed['duplicates'] = n - int(np.count_nonzero(keep))
+    idx = np.flatnonzero(keep)
+
+    # A kept point follows only duplicates of its predecessor, so the gap is its incoming segment
+    gaps = segment_km[idx[1:] - 1]
+    cuts = np.flatnonzero(gaps > split_km) + 1
+    starts = np.concatenate(([0], cuts))
+    ends = np.concatenate((cuts, [len(idx)])) - 1
+    track_of_piece = chain_pieces(idx[starts], idx[ends], lat, lon, split_km)
+
+    point_track = np.repeat(track_of_piece, ends - starts + 1)
+    order = np.argsort(point_track, kind='stable')
+    _, first = np.unique(point_track[order], return_index=True)
+    tracks, track_km = [], []
+    for points in np.split(idx[order], first[1:]):
+        if len(points) < min_track_points:
+            removed['spikes'] += len(points)
+            continue
+        spikes = median_spike_mask(lat[points], lon[points], spike_km=spike_km)
+        if seconds is not None:
+            spikes |= speed_spike_mask(pair_distances_km(points, lat, lon, segment_km), seconds[points],
+                                       max_speed_kmh)
+        removed['spikes'] += int(np.count_nonzero(spikes))
+        points = points[~spikes]
+
+        stationary = stationary_mask(pair_distances_km(points, lat, lon, segment_km), stationary_km)
+        removed['stationary'] += int(np.count_nonzero(stationary))
+        points = points[~stationary]
+
+        tracks.append(points)
+        track_km.append(float(np.sum(pair_distances_km(points, lat, lon, segment_km))))
+
+    primary_first = sorted(range(len(tracks)), key=lambda t: -len(tracks[t]))
+    tracks = [tracks[t] for t in primary_first]
+    track_km = [track_km[t] for t in primary_first]
+    return {'tracks': tracks, 'track_km': track_km, 'distance_km': track_km[0] if tracks else 0.0,
+            'removed': removed}
+
+
+@register_stage(after='distance')
+class CleaningStage(Stage):
+    """Corrected distance of the cleaned, de-interleaved trace"""
+    name = 'clean'
+    requires = ('segment_km',)
+
+    def run(self, ctx):
+        cleaned = clean_trace(ctx.lat, ctx.lon, ctx.segment('segment_km'), seconds=ctx.seconds)
+        ctx.artifacts['cleaning'] = cleaned
+        ctx.extra.update({
+            'corrected_distance_km': round(cleaned['distance_km'], 2),
+            'cleaned_points': len(cleaned['tracks'][0]) if cleaned['tracks'] else 0,
+            'trace_segments': len(cleaned['tracks']),
+        })
@@ -0,0 +1,86 @@
+"""
+Route Tools Command Line
+========================
+One entry point for the route analysis tools. Only argparse and the standard
+library are imported at startup; every subcommand imports the modules it
+needs when it runs, so `--help` or `cache stats` do not pay for pandas,
+geopy or matplotlib.
+
+Subcommands:
+- analyze:    analyze all routes of an index (analyzerv2.py options)
+- visualize:  render route thumbnails (route_renderer.py options)
+- compare:    differential test of the analyzers (compare_analyzers.py options)
+- bench:      benchmarks incl. startup time (benchmark_routes.py options)
+- match:      map matching and road edge usage (route_matching.py options)
+- cache:      trace cache statistics / clearing
+
+Options after the subcommand are passed on unchanged; `route_cli.py analyze
+--help` shows them.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy tqdm
+pip install matplotlib      (visualize only)
+
+Usage:
+------
+python route_cli.py analyze --csv routesinformation.csv --data data --cache trace_cache
+python route_cli.py visualize --routes problem_routes.csv --limit 50
+python route_cli.py compare --csv synthetic/routesinformation.csv --data synthetic/data
+python route_cli.py bench --sizes 20 --no-fleet-run
+python route_cli.py match --routes route_analysis_summary.csv --network roads.npz
+python route_cli.py cache stats --folder trace_cache
+"""
+
+import argparse
+import multiprocessing as mp
+
+# Subcommand -> (module whose main(argv) runs it, help text)
+DELEGATED = {
+    'analyze': ('analyzerv2', 'Analyze all routes of a route index'),
+    'visualize': ('route_renderer', 'Render route thumbnails'),
+    'compare': ('compare_analyzers', 'Differential test of the analyzer implementations'),
+    'bench': ('benchmark_routes', 'Benchmark the analyzers and startup time'),
+    'match': ('route_matching', 'Map-match routes to a local road network'),
+}
+
+
+def run_cache(args):
+    from trace_codec import TraceCache
+    cache = TraceCache(args.folder)
+    if args.action == 'clear':
+        print(f"Removed {cache.clear()} cached traces from {args.folder}")
+    else:
+        stats = cache.stats()
+        print(f"{stats['traces']} cached traces, {stats['bytes'] / 1e6:.1f} MB in {stats['folder']}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='route_cli.py', description='Route analysis tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (_, help_text) in DELEGATED.items():
+        # Options (incl. --help) belong to the delegated module's own parser
+        subparsers.add_parser(name, help=help_text, add_help=False)
+    cache = subparsers.add_parser('cache', help='Trace cache statistics / clearing')
+    cache.add_argument('action', choices=['stats', 'clear'])
+    cache.add_argument('--folder', default='trace_cache', help='Trace cache folder')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command == 'cache':
+        if rest:
+            parser.error(f"unrecognized arguments: {' '.join(rest)}")
+        return run_cache(args)
+
+    import importlib
+    module = importlib.import_module(DELEGATED[args.command][0])
+    return module.main(rest)
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    raise SystemExit(main())
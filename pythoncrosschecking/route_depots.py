@@ -0,0 +1,224 @@
+"""
+Depot-Anchored Route Validation
+===============================
+Checks whether each route starts or ends near the depot of its BU Code and
+flags routes that start/end at another BU's depot (attributed to the wrong
+BU).
+
+Depot coordinates come from a table (BU Code, Location, Latitude, Longitude);
+when no table exists yet, one can be inferred from the median start point of
+each BU's routes in an analysis summary. Depots are held in a spatial index
+(unit-sphere k-d tree), and all routes of a fleet run are validated in one
+vectorized batch after processing, from the start/end locations the analysis
+already produced.
+
+Columns added to every result:
+- start_depot_km / end_depot_km    distance to the route's own depot
+- nearest_other_depot              BU Code of the nearest other depot
+- nearest_other_depot_km           distance of start or end to it
+- depot_check                      At depot / Away from depot / Other depot /
+                                   Unknown depot
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+pip install scipy      (optional, k-d tree for large depot tables)
+
+Usage:
+------
+python route_depots.py --summary route_analysis_summary.csv --depots depot_locations.csv
+python route_depots.py --summary route_analysis_summary.csv --infer depot_locations.csv
+"""
+
+import argparse
+import ast
+import logging
+
+import numpy as np
+import pandas as pd
+
+from route_pipeline import geodesic_km
+
+logger = logging.getLogger(__name__)
+
+DEPOT_COLUMNS = ['BU Code', 'Location', 'Latitude', 'Longitude']
+DEPOT_RADIUS_KM = 25.0
+DEPOT_ANOMALY = 'Route starts/ends at depot'
+
+
+def to_unit_vectors(lat, lon):
+    """Points on the unit sphere, so chord length orders great-circle distance"""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def parse_locations(locations):
+    """(lat, lon) arrays from 'lat, lon' strings; missing values become NaN"""
+    parts = pd.Series(locations, dtype=object).astype(str).str.split(',', n=1, expand=True)
+    if parts.shape[1] < 2:
+        return np.full(len(parts), np.nan), np.full(len(parts), np.nan)
+    lat = pd.to_numeric(parts[0], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(parts[1], errors='coerce').to_numpy(dtype=float)
+    return lat, lon
+
+
+def load_depot_table(depot_file):
+    depots = pd.read_csv(depot_file, dtype={'BU Code': str})
+    missing = set(DEPOT_COLUMNS) - set(depots.columns)
+    if missing:
+        raise ValueError(f"Depot table {depot_file} lacks columns: {sorted(missing)}")
+    depots['Location'] = depots['Location'].astype(str).str.strip()
+    return depots[DEPOT_COLUMNS].dropna(subset=['Latitude', 'Longitude'])
+
+
+def infer_depot_table(results, bu_column='BU_Code', location_column='Location'):
+    """Depot table from the median start point of each BU's routes"""
+    df = pd.DataFrame(results)
+    lat, lon = parse_locations(df['start_location'])
+    starts = pd.DataFrame({'BU Code': df[bu_column].astype(str),
+                           'Location': df[location_column].astype(str).str.strip(),
+                           'Latitude': lat, 'Longitude': lon}).dropna()
+    depots = starts.groupby('BU Code').agg(Location=('Location', 'first'), Latitude=('Latitude', 'median'),
+                                           Longitude=('Longitude', 'median'))
+    logger.info(f"Inferred {len(depots)} depots from {len(starts)} route starts")
+    return depots.reset_index()[DEPOT_COLUMNS]
+
+
+class DepotIndex:
+    def __init__(self, depots):
+        self.depots = depots.reset_index(drop=True)
+        self.codes = self.depots['BU Code'].astype(str).to_numpy()
+        self.lat = self.depots['Latitude'].to_numpy(dtype=float)
+        self.lon = self.depots['Longitude'].to_numpy(dtype=float)
+        self._xyz = to_unit_vectors(self.lat, self.lon)
+        try:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self._xyz)
+        except ImportError:
+            # Depot tables are small; a brute-force chord search is just as fast
+            self._tree = None
+
+    @classmethod
+    def from_file(cls, depot_file):
+        return cls(load_depot_table(depot_file))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def position(self, codes):
+        """Depot row of each BU Code (-1 when unknown)"""
+        return pd.Index(self.codes).get_indexer(pd.Series(codes).astype(str).str.strip())
+
+    def nearest(self, lat, lon, k=2):
+        """Depot rows of the k nearest depots of each point, nearest first"""
+        k = min(k, len(self))
+        xyz = to_unit_vectors(lat, lon)
+        if self._tree is not None:
+            _, rows = self._tree.query(xyz, k=k)
+            return rows.reshape(len(xyz), k)
+        chord = np.linalg.norm(xyz[:, None, :] - self._xyz[None, :, :], axis=2)
+        return np.argsort(chord, axis=1)[:, :k]
+
+    def nearest_other(self, lat, lon, own):
+        """Nearest depot row of each point, skipping the route's own depot"""
+        rows = self.nearest(lat, lon, k=2)
+        if rows.shape[1] == 1:
+            return np.where(rows[:, 0] == own, -1, rows[:, 0])
+        return np.where(rows[:, 0] == own, rows[:, 1], rows[:, 0])
+
+    def distance_km(self, lat, lon, rows):
+        """Geodesic distance from each point to depot row (NaN for -1)"""
+        distance = np.full(len(lat), np.nan)
+        ok = (rows >= 0) & ~np.isnan(lat)
+        distance[ok] = geodesic_km(lat[ok], lon[ok], self.lat[rows[ok]], self.lon[rows[ok]])
+        return distance
+
+
+def validate_depots(results, depot_index, bu_column='BU_Code', radius_km=DEPOT_RADIUS_KM):
+    """Add the depot columns to every result dict, flagging wrong-BU routes"""
+    if not results:
+        return results
+    df = pd.DataFrame(results)
+    start_lat, start_lon = parse_locations(df['start_location'])
+    end_lat, end_lon = parse_locations(df['end_location'])
+    own = depot_index.position(df[bu_column])
+    has_points = ~np.isnan(start_lat) & ~np.isnan(end_lat)
+
+    start_km = depot_index.distance_km(start_lat, start_lon, own)
+    end_km = depot_index.distance_km(end_lat, end_lon, own)
+    other_start = depot_index.nearest_other(np.nan_to_num(start_lat), np.nan_to_num(start_lon), own)
+    other_end = depot_index.nearest_other(np.nan_to_num(end_lat), np.nan_to_num(end_lon), own)
+    other_start_km = depot_index.distance_km(start_lat, start_lon, other_start)
+    other_end_km = depot_index.distance_km(end_lat, end_lon, other_end)
+    use_end = np.nan_to_num(other_end_km, nan=np.inf) < np.nan_to_num(other_start_km, nan=np.inf)
+    other = np.where(use_end, other_end, other_start)
+    other_km = np.where(use_end, other_end_km, other_start_km)
+
+    own_km = np.fmin(start_km, end_km)
+    at_own = own_km <= radius_km
+    at_other = (other_km <= radius_km) & ~(own_km <= other_km)
+    check = np.where(own < 0, 'Unknown depot',
+                     np.where(at_other, 'Other depot', np.where(at_own, 'At depot', 'Away from depot')))
+
+    for i, result in enumerate(results):
+        if not has_points[i]:
+            result.update({'start_depot_km': None, 'end_depot_km': None, 'nearest_other_depot': None,
+                           'nearest_other_depot_km': None, 'depot_check': None})
+            continue
+        result.update({
+            'start_depot_km': round(float(start_km[i]), 2) if own[i] >= 0 else None,
+            'end_depot_km': round(float(end_km[i]), 2) if own[i] >= 0 else None,
+            'nearest_other_depot': depot_index.codes[other[i]] if other[i] >= 0 else None,
+            'nearest_other_depot_km': round(float(other_km[i]), 2) if other[i] >= 0 else None,
+            'depot_check': str(check[i]),
+        })
+        # Replace the anomaly of an earlier check so repeated checks do not stack it
+        anomalies = [a for a in result['anomalies'] if a != 'None detected' and not a.startswith(DEPOT_ANOMALY)]
+        if check[i] == 'Other depot':
+            location = depot_index.depots['Location'].iloc[other[i]]
+            anomalies.append(f"{DEPOT_ANOMALY} {depot_index.codes[other[i]]} ({location}), "
+                             f"{other_km[i]:.1f} km away, not at its own BU depot")
+            if result['status'] == 'Good':
+                result['status'] = 'Has anomalies'
+        elif not anomalies and result['status'] == 'Has anomalies':
+            result['status'] = 'Good'
+        result['anomalies'] = anomalies or ['None detected']
+
+    flagged = int(np.count_nonzero(check[has_points] == 'Other depot'))
+    logger.info(f"Depot check: {flagged} of {int(has_points.sum())} routes start/end at another BU's depot")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate route start/end points against depot locations')
+    parser.add_argument('--summary', default='route_analysis_summary.csv', help='Analysis summary CSV')
+    parser.add_argument('--depots', default='depot_locations.csv', help='Depot coordinate table')
+    parser.add_argument('--infer', metavar='DEPOT_FILE', help='Write a depot table inferred from route starts')
+    parser.add_argument('--radius', type=float, default=DEPOT_RADIUS_KM, help='Depot radius (km)')
+    parser.add_argument('--output', default='depot_check.csv')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    summary = pd.read_csv(args.summary, dtype=str)
+    bu_column = 'BU_Code' if 'BU_Code' in summary.columns else 'csv_col1'
+    if args.infer:
+        location_column = 'Location' if 'Location' in summary.columns else 'csv_col2'
+        infer_depot_table(summary.to_dict('records'), bu_column, location_column).to_csv(args.infer, index=False)
+        print(f"Inferred depot table saved to: {args.infer}")
+        return
+
+    results = summary.to_dict('records')
+    for result in results:
+        # The summary CSV holds the anomaly lists as their repr
+        result['anomalies'] = ast.literal_eval(result['anomalies']) if str(result['anomalies']).startswith('[') \
+            else [result['anomalies']]
+    validate_depots(results, DepotIndex.from_file(args.depots), bu_column, args.radius)
+    checked = pd.DataFrame(results)
+    checked.to_csv(args.output, index=False)
+    print(checked['depot_check'].value_counts().to_string())
+    print(f"Depot check saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Hybrid Route Executor
+=====================
+Runs per-route tasks serially, on a thread pool or on a process pool,
+choosing from a short warm-up sample instead of a fixed cpu_count() - 1.
+
+The first warmup tasks run serially in the calling process while their wall
+and CPU time are measured:
+
+- tasks whose CPU time is a small share of their wall time wait on disk (or
+  spend their time in GIL-releasing NumPy calls, e.g. trace cache hits), so
+  the rest runs on threads, several per core;
+- CPU-bound tasks (read_excel of big sheets, geodesics of huge traces) run on
+  processes, with chunks sized to about target_chunk_seconds of work each;
+- when the remaining work is shorter than a process pool takes to start, it
+  finishes serially.
+
+With a per-worker memory_budget_mb, no more workers (processes or threads)
+run than have their budget fit in the available memory.
+
+The decision and the achieved throughput are kept in executor.report.
+
+Installation Requirements:
+------------------------
+No extra requirements (standard library only)
+pip install psutil      (optional, available memory outside Linux)
+
+Usage:
+------
+executor = HybridExecutor(num_workers=4)
+executor = HybridExecutor(num_workers=4, memory_budget_mb=512)   # at most available memory / 512 MB workers
+results = list(executor.imap(process_route, tasks, initializer=init_worker, initargs=(analyzer,)))
+executor.report  # {'mode': 'processes', 'workers': 4, 'chunksize': 3, ...}
+"""
+
+import logging
+import math
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MODES = ('serial', 'threads', 'processes')
+WARMUP_TASKS = 4
+# CPU share of wall time below which a task counts as I/O bound
+THREAD_CPU_FRACTION = 0.5
+THREADS_PER_WORKER = 4
+# Rough cost of starting a process pool that imports pandas in every worker
+POOL_STARTUP_SECONDS = 0.5
+TARGET_CHUNK_SECONDS = 0.2
+# Share of the available memory the worker budgets may add up to
+MEMORY_HEADROOM = 0.8
+
+
+def default_workers():
+    """Worker count leaving one core to the parent (at least 1, also on 1-CPU hosts)"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def available_memory_mb():
+    """Memory available to new work, incl. reclaimable page cache (None where not reported)"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 2 ** 20
+    except ImportError:
+        pass
+    # Free pages only (no page cache): an underestimate, the last resort
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def memory_worker_limit(memory_budget_mb, available_mb=None):
+    """Most workers whose memory budgets fit in the available memory (None: no limit)"""
+    available_mb = available_memory_mb() if available_mb is None else available_mb
+    if not memory_budget_mb or available_mb is None:
+        return None
+    return max(1, int(available_mb * MEMORY_HEADROOM // memory_budget_mb))
+
+
+def plan_execution(n_remaining, mean_seconds, cpu_fraction, num_workers):
+    """(mode, workers, chunksize) for the tasks left after the warm-up"""
+    workers = min(num_workers, n_remaining)
+    if workers <= 1 or n_remaining * mean_seconds < POOL_STARTUP_SECONDS:
+        return 'serial', 1, 1
+    if cpu_fraction < THREAD_CPU_FRACTION:
+        return 'threads', min(n_remaining, num_workers * THREADS_PER_WORKER), 1
+    chunksize = max(1, min(round(TARGET_CHUNK_SECONDS / max(mean_seconds, 1e-6)),
+                           math.ceil(n_remaining / (workers * 4))))
+    return 'processes', workers, chunksize
+
+
+class HybridExecutor:
+    def __init__(self, num_workers=None, mode=None, warmup=WARMUP_TASKS, memory_budget_mb=None):
+        """mode forces 'serial', 'threads' or 'processes'; None decides from the warm-up
+        memory_budget_mb: memory one task may use; caps the concurrent workers
+        """
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Unknown execution mode: {mode}")
+        self.num_workers = num_workers or default_workers()
+        self.mode = mode
+        self.warmup = warmup
+        self.memory_budget_mb = memory_budget_mb
+        self.report = {}
+
+    def imap(self, func, tasks, initializer=None, initargs=()):
+        """Results of func over tasks, in task order.
+
+        func and initializer must be module-level functions so process workers
+        can receive them; the initializer also runs once in this process for
+        the warm-up, serial and thread modes.
+        """
+        tasks = list(tasks)
+        start = time.time()
+        if initializer is not None:
+            initializer(*initargs)
+
+        n_warmup = 0 if self.mode is not None else min(self.warmup, len(tasks))
+        wall = cpu = 0.0
+        for task in tasks[:n_warmup]:
+            task_start, task_cpu = time.perf_counter(), time.thread_time()
+            result = func(task)
+            cpu += time.thread_time() - task_cpu
+            wall += time.perf_counter() - task_start
+            yield result
+
+        remaining = tasks[n_warmup:]
+        mean_seconds = wall / n_warmup if n_warmup else 0.0
+        cpu_fraction = cpu / wall if wall > 0 else 1.0
+        memory_limit = memory_worker_limit(self.memory_budget_mb)
+        num_workers = min(self.num_workers, memory_limit or self.num_workers)
+        if self.mode is None:
+            mode, workers, chunksize = plan_execution(len(remaining), mean_seconds, cpu_fraction, num_workers)
+        elif self.mode == 'threads':
+            mode, workers, chunksize = 'threads', num_workers * THREADS_PER_WORKER, 1
+        else:
+            mode, workers, chunksize = self.mode, 1 if self.mode == 'serial' else num_workers, 1
+        if mode == 'threads' and memory_limit is not None:
+            workers = min(workers, memory_limit)
+        logger.info(f"Executing {len(remaining)} tasks: {mode}, {workers} workers, chunksize {chunksize} "
+                    f"(warm-up {n_warmup} tasks, {mean_seconds * 1000:.1f} ms/task, "
+                    f"CPU share {cpu_fraction:.2f})")
+
+        if mode == 'processes':
+            with mp.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+                yield from pool.imap(func, remaining, chunksize=chunksize)
+        elif mode == 'threads':
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                yield from pool.map(func, remaining)
+        else:
+            for task in remaining:
+                yield func(task)
+
+        elapsed = time.time() - start
+        self.report = {
+            'mode': mode,
+            'workers': workers,
+            'chunksize': chunksize,
+            'warmup_tasks': n_warmup,
+            'warmup_ms_per_task': round(mean_seconds * 1000, 2),
+            'warmup_cpu_fraction': round(cpu_fraction, 3),
+            'memory_budget_mb': self.memory_budget_mb,
+            'memory_worker_limit': memory_limit,
+            'tasks': len(tasks),
+            'elapsed_seconds': round(elapsed, 3),
+            'tasks_per_second': round(len(tasks) / elapsed, 2) if elapsed > 0 else None,
+        }
@@ -0,0 +1,480 @@
+"""
+Fleet Heatmap Tiles
+===================
+Aggregates every valid point of the fleet, and separately every anomaly
+location, into multi-resolution count grids and writes them as precomputed
+map tiles that a dashboard can serve as static files.
+
+Grid: Web Mercator slippy-map tiles (z/x/y, as used by Leaflet and Google
+Maps), each split into bins x bins cells. Points are binned once at the
+highest zoom with vectorized arithmetic; lower zooms are derived by bit
+shifting the cell indices.
+
+Routes come from the summary CSV of an analysis run (--results; routes
+without valid points are left out) or from the route index. Traces are
+taken from the run's trace cache (--cache, default trace_cache when it
+exists); files missing from the cache are read, and files above the memory
+budget are streamed like in the analysis run (route_chunked.py).
+
+The anomaly layer holds the points of duplicate, stationary and large-jump
+segments, latitude band changes and distant cell jumps (region spans,
+teleport-backs, interleaving), the points the clean stage dropped or split
+off the primary track, and the start and end of routes that the run's depot
+check found at another BU's depot.
+
+The store keeps each route's cell counts, so re-analyzing a route replaces
+its old contribution and only the tiles it touches are rewritten; routes no
+longer in the index (or results) are removed from the store. Route files are
+buffered and written by save() after the layers they were merged into; every
+.npz is written to a temporary file and atomically replaced.
+
+Layout of the output folder:
+- store/<layer>.npz                  fleet cell counts at max zoom
+- store/routes/<file_id>.npz         per-route contribution
+- tiles/<layer>/<z>/<x>/<y>.json     {"bins": 64, "cells": [[col, row, count], ...]}
+- tiles/meta.json                    zoom range, bins, max count per zoom
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+
+Usage:
+------
+python route_heatmap.py --csv routesinformation.csv --data data --output heatmap
+python route_heatmap.py --csv routesinformation.csv --data data --output heatmap --changed-only
+python route_heatmap.py --results route_analysis_summary.csv --data data --cache trace_cache --output heatmap
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import route_cleaning  # registers the trace cleaning stage
+from route_chunked import MEMORY_BUDGET_MB
+from route_pipeline import STAGES, RouteAnalyzerBase, Stage, register_stage
+from route_regions import distant_jump_segments
+from trace_codec import find_cache_folder
+
+logger = logging.getLogger(__name__)
+
+LAYERS = ('points', 'anomalies')
+# Stages run before the contribution is taken (the anomaly layer reads the cleaning result)
+HEATMAP_STAGES = ('clean',)
+
+DEFAULT_MIN_ZOOM = 4
+DEFAULT_MAX_ZOOM = 14
+DEFAULT_BINS = 64
+
+# Web Mercator latitude limit
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def mercator_cells(lat, lon, zoom, bins):
+    """Global cell indices (col, row) of points at a zoom level"""
+    size = (1 << zoom) * bins
+    lat = np.clip(np.asarray(lat, dtype=float), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lon = np.asarray(lon, dtype=float)
+    x = (lon + 180.0) / 360.0
+    lat_rad = np.radians(lat)
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0
+    col = np.clip((x * size).astype(np.int64), 0, size - 1)
+    row = np.clip((y * size).astype(np.int64), 0, size - 1)
+    return col, row
+
+
+def cell_counts(lat, lon, zoom, bins):
+    """Sparse cell counts of a set of points: (keys, counts)"""
+    if len(lat) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    size = (1 << zoom) * bins
+    col, row = mercator_cells(lat, lon, zoom, bins)
+    keys, counts = np.unique(col * size + row, return_counts=True)
+    return keys, counts.astype(np.int64)
+
+
+def merge_counts(*parts):
+    """Sum several sparse (keys, counts) sets; cells that reach zero are dropped"""
+    keys = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+    counts = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+    if len(keys) == 0:
+        return keys.astype(np.int64), counts.astype(np.int64)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    summed = np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int64)
+    keep = summed != 0
+    return unique_keys[keep], summed[keep]
+
+
+def save_npz(path, **arrays):
+    """np.savez to a temporary file, then atomically replace path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def anomaly_point_mask(ctx, at_other_depot=False):
+    """Points involved in the route's anomalies.
+
+    Duplicate, stationary and large-jump segments, latitude band changes and
+    distant cell jumps (region spans, teleport-backs, interleaving), points
+    the clean stage dropped or split off the primary track (when it ran), and
+    the start and end of a route at another BU's depot.
+    """
+    n = ctx.valid_points
+    mask = np.zeros(n, dtype=bool)
+    if n == 0:
+        return mask
+    if n >= 2:
+        segment_km = ctx.segment('segment_km')
+        lat_band = ctx.segment('lat_band')
+        regions = STAGES['regions']
+        flagged = (ctx.segment('same_as_next') | (segment_km > 100) | ((segment_km > 0) & (segment_km < 0.01)) |
+                   (lat_band[1:] != lat_band[:-1]) |
+                   distant_jump_segments(ctx.lat, ctx.lon, regions.cell_deg, regions.geohash_precision))
+        mask[:-1] |= flagged
+        mask[1:] |= flagged
+    cleaned = ctx.artifacts.get('cleaning')
+    if cleaned is not None and cleaned['tracks']:
+        primary = np.zeros(n, dtype=bool)
+        primary[cleaned['tracks'][0]] = True
+        mask |= ~primary
+    if at_other_depot:
+        mask[[0, -1]] = True
+    return mask
+
+
+def route_contribution(ctx, zoom, bins, at_other_depot=False):
+    """Cell counts of the route's points and anomaly points at a zoom level"""
+    mask = anomaly_point_mask(ctx, at_other_depot)
+    return {
+        'points': cell_counts(ctx.lat, ctx.lon, zoom, bins),
+        'anomalies': cell_counts(ctx.lat[mask], ctx.lon[mask], zoom, bins),
+    }
+
+
+@register_stage
+class HeatmapStage(Stage):
+    """Cell counts of the route's points and anomaly locations at max zoom.
+
+    The depot check runs after the analysis, so the stage's anomaly layer has
+    no depot points; HeatmapBuilder adds them from the run's results.
+    """
+    name = 'heatmap'
+    requires = ('segment_km', 'same_as_next', 'lat_band')
+    default = False
+    zoom = DEFAULT_MAX_ZOOM
+    bins = DEFAULT_BINS
+
+    def run(self, ctx):
+        ctx.artifacts['heatmap'] = route_contribution(ctx, self.zoom, self.bins)
+
+
+class HeatmapStore:
+    def __init__(self, folder, min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM, bins=DEFAULT_BINS):
+        self.folder = folder
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.bins = bins
+        self.size = (1 << max_zoom) * bins
+        self.route_folder = os.path.join(folder, 'store', 'routes')
+        os.makedirs(self.route_folder, exist_ok=True)
+        self._check_config()
+        self.layers = {layer: self._load_layer(layer) for layer in LAYERS}
+        self.dirty = {layer: [] for layer in LAYERS}
+        # Route deltas not yet merged into the layers; merged once per batch
+        self.pending = {layer: [] for layer in LAYERS}
+        # file_id -> (mtime, at other depot, contributions) of routes not yet written, None for
+        # removed routes; written by save()
+        self.pending_routes = {}
+
+    def _check_config(self):
+        """Cell keys are only meaningful for the zoom and bins they were built with"""
+        config = {'max_zoom': self.max_zoom, 'bins': self.bins}
+        path = os.path.join(self.folder, 'store', 'config.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored != config:
+                raise ValueError(f"Heatmap store was built with {stored}, not {config}; use a new folder")
+        else:
+            with open(path, 'w') as f:
+                json.dump(config, f)
+
+    def _layer_path(self, layer):
+        return os.path.join(self.folder, 'store', f"{layer}.npz")
+
+    def _route_path(self, file_id):
+        return os.path.join(self.route_folder, f"{file_id}.npz")
+
+    def _load_layer(self, layer):
+        path = self._layer_path(layer)
+        if not os.path.exists(path):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        with np.load(path) as data:
+            return data['keys'], data['counts']
+
+    def route_state(self, file_id):
+        """(source file mtime, at other depot) recorded for a route (None if not in the store)"""
+        if file_id in self.pending_routes:
+            entry = self.pending_routes[file_id]
+            return entry[:2] if entry is not None else None
+        path = self._route_path(file_id)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return float(data['mtime']), bool(data['depot']) if 'depot' in data.files else False
+
+    def route_ids(self):
+        """File ids of every route in the store"""
+        stored = {name[:-len('.npz')] for name in os.listdir(self.route_folder) if name.endswith('.npz')}
+        stored.update(self.pending_routes)
+        return {file_id for file_id in stored if self.pending_routes.get(file_id, True) is not None}
+
+    def _previous(self, file_id):
+        if file_id in self.pending_routes:
+            entry = self.pending_routes[file_id]
+            return entry[2] if entry is not None else {}
+        path = self._route_path(file_id)
+        if not os.path.exists(path):
+            return {}
+        with np.load(path) as data:
+            return {layer: (data[f"{layer}_keys"], data[f"{layer}_counts"]) for layer in LAYERS}
+
+    def _replace(self, file_id, contributions):
+        previous = self._previous(file_id)
+        for layer in LAYERS:
+            new = contributions.get(layer, (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)))
+            old = previous.get(layer, (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)))
+            self.pending[layer].extend([(old[0], -old[1]), new])
+            self.dirty[layer].extend([old[0], new[0]])
+
+    def update_route(self, file_id, contributions, mtime=0.0, at_other_depot=False):
+        """Replace a route's contribution: {'points': (keys, counts), 'anomalies': (keys, counts)}"""
+        self._replace(file_id, contributions)
+        self.pending_routes[file_id] = (mtime, at_other_depot, contributions)
+
+    def remove_route(self, file_id):
+        """Subtract a route's contribution and drop it from the store"""
+        self._replace(file_id, {})
+        self.pending_routes[file_id] = None
+
+    def prune(self, file_ids):
+        """Remove every stored route that is not in file_ids; returns the number removed"""
+        stale = self.route_ids() - set(file_ids)
+        for file_id in stale:
+            self.remove_route(file_id)
+        return len(stale)
+
+    def flush(self):
+        """Merge pending route deltas into the layer counts"""
+        for layer, deltas in self.pending.items():
+            if deltas:
+                self.layers[layer] = merge_counts(self.layers[layer], *deltas)
+                self.pending[layer] = []
+
+    def save(self):
+        """Write the layers, then the route contributions merged into them"""
+        self.flush()
+        for layer, (keys, counts) in self.layers.items():
+            save_npz(self._layer_path(layer), keys=keys, counts=counts)
+        for file_id, entry in self.pending_routes.items():
+            path = self._route_path(file_id)
+            if entry is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            mtime, at_other_depot, contributions = entry
+            save_npz(path, mtime=mtime, depot=at_other_depot,
+                     **{f"{layer}_{part}": contributions[layer][i]
+                        for layer in LAYERS for i, part in enumerate(('keys', 'counts'))})
+        self.pending_routes = {}
+
+    def write_tiles(self, full=False):
+        """Rewrite tiles touched since the last write (or all tiles)"""
+        self.flush()
+        meta = {'min_zoom': self.min_zoom, 'max_zoom': self.max_zoom, 'bins': self.bins, 'layers': {}}
+        written = 0
+        for layer, (keys, counts) in self.layers.items():
+            dirty_keys = np.unique(np.concatenate(self.dirty[layer])) if self.dirty[layer] else np.zeros(0, np.int64)
+            cols, rows = keys // self.size, keys % self.size
+            dirty_cols, dirty_rows = dirty_keys // self.size, dirty_keys % self.size
+            layer_meta = {}
+            for zoom in range(self.min_zoom, self.max_zoom + 1):
+                shift = self.max_zoom - zoom
+                zoom_size = (1 << zoom) * self.bins
+                zoom_keys, zoom_counts = merge_counts(((cols >> shift) * zoom_size + (rows >> shift), counts))
+                layer_meta[zoom] = int(zoom_counts.max()) if len(zoom_counts) else 0
+
+                zcol, zrow = zoom_keys // zoom_size, zoom_keys % zoom_size
+                tile_ids = (zcol // self.bins) * (1 << zoom) + (zrow // self.bins)
+                if full:
+                    targets = np.unique(tile_ids)
+                else:
+                    targets = np.unique(((dirty_cols >> shift) // self.bins) * (1 << zoom) +
+                                        ((dirty_rows >> shift) // self.bins))
+                written += self._write_zoom(layer, zoom, targets, tile_ids, zcol, zrow, zoom_counts)
+            meta['layers'][layer] = {'max_count': layer_meta, 'cells': int(len(keys))}
+            self.dirty[layer] = []
+
+        os.makedirs(os.path.join(self.folder, 'tiles'), exist_ok=True)
+        with open(os.path.join(self.folder, 'tiles', 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return written
+
+    def _write_zoom(self, layer, zoom, targets, tile_ids, zcol, zrow, counts):
+        """Write the target tiles of one zoom level; empty targets are removed"""
+        order = np.argsort(tile_ids, kind='stable')
+        sorted_ids = tile_ids[order]
+        starts = np.searchsorted(sorted_ids, targets, side='left')
+        ends = np.searchsorted(sorted_ids, targets, side='right')
+        tiles_per_axis = 1 << zoom
+        for tile_id, start, end in zip(targets.tolist(), starts.tolist(), ends.tolist()):
+            x, y = divmod(tile_id, tiles_per_axis)
+            path = os.path.join(self.folder, 'tiles', layer, str(zoom), str(x), f"{y}.json")
+            if start == end:
+                if os.path.exists(path):
+                    os.remove(path)
+                    if not os.listdir(os.path.dirname(path)):
+                        os.rmdir(os.path.dirname(path))
+                continue
+            idx = order[start:end]
+            cells = np.column_stack((zcol[idx] % self.bins, zrow[idx] % self.bins, counts[idx])).tolist()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump({'z': zoom, 'x': x, 'y': y, 'bins': self.bins, 'cells': cells}, f,
+                          separators=(',', ':'))
+        return len(targets)
+
+
+_analyzer = None
+
+
+def _init_worker(zoom, bins, cache_folder=None, memory_budget_mb=MEMORY_BUDGET_MB):
+    global _analyzer
+    HeatmapStage.zoom = zoom
+    HeatmapStage.bins = bins
+    _analyzer = RouteAnalyzerBase('', stages=HEATMAP_STAGES, cache_folder=cache_folder,
+                                  memory_budget_mb=memory_budget_mb)
+
+
+def _heatmap_route(task):
+    """Heatmap contribution of one route, from the trace cache when it holds the file (pool worker)"""
+    filepath, at_other_depot = task
+    ctx = _analyzer.analyze_file(filepath)
+    return filepath, at_other_depot, route_contribution(ctx, HeatmapStage.zoom, HeatmapStage.bins, at_other_depot)
+
+
+class HeatmapBuilder:
+    def __init__(self, csv_file, data_folder, output_folder='heatmap', num_workers=None, results_file=None,
+                 cache_folder=None, memory_budget_mb=MEMORY_BUDGET_MB, **store_options):
+        """results_file: summary CSV of the analysis run; its routes and depot check replace the index
+        cache_folder: trace cache of the analysis run
+        """
+        self.csv_file = csv_file
+        self.data_folder = data_folder
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.results_file = results_file
+        self.cache_folder = cache_folder
+        self.memory_budget_mb = memory_budget_mb
+        self.store = HeatmapStore(output_folder, **store_options)
+        self.worker_args = (self.store.max_zoom, self.store.bins, cache_folder, memory_budget_mb)
+        _init_worker(*self.worker_args)
+
+    def indexed_routes(self):
+        """(filename, at other depot) of the routes of the run's results, or of the index"""
+        if self.results_file:
+            results = pd.read_csv(self.results_file, dtype=str)
+            # Routes the run found no valid points in contribute nothing
+            results = results[pd.to_numeric(results['valid_points'], errors='coerce') > 0]
+            depot = results['depot_check'] == 'Other depot' if 'depot_check' in results else [False] * len(results)
+            return list(zip(results['filename'], depot))
+        csv_data = pd.read_csv(self.csv_file)
+        return [(f"{row.iloc[0]}_{row.iloc[2]}.xlsx", False) for _, row in csv_data.iterrows()]
+
+    def route_tasks(self, changed_only=False):
+        """(filepath, at other depot) of the routes to add, and the file ids of all existing routes"""
+        tasks, current = [], set()
+        for filename, at_other_depot in self.indexed_routes():
+            filepath = os.path.join(self.data_folder, filename)
+            if not os.path.exists(filepath):
+                continue
+            file_id = filename.split('.')[0]
+            current.add(file_id)
+            if changed_only and self.store.route_state(file_id) == (os.path.getmtime(filepath), bool(at_other_depot)):
+                continue
+            tasks.append((filepath, bool(at_other_depot)))
+        return tasks, current
+
+    def run(self, files=None, changed_only=False, full_tiles=False):
+        """Add or refresh routes in the store and rewrite the affected tiles.
+
+        Without an explicit file list, stored routes that are no longer indexed are removed.
+        """
+        if files is not None:
+            tasks = [(filepath, False) for filepath in files]
+        else:
+            tasks, current = self.route_tasks(changed_only)
+            removed = self.store.prune(current)
+            if removed:
+                logger.info(f"Removing {removed} routes that are no longer indexed")
+        logger.info(f"Updating heatmap with {len(tasks)} routes")
+        start = time.time()
+        if self.num_workers > 1 and len(tasks) > 1:
+            with mp.Pool(self.num_workers, initializer=_init_worker, initargs=self.worker_args) as pool:
+                outputs = pool.imap_unordered(_heatmap_route, tasks, chunksize=4)
+                updated = self._apply(outputs)
+        else:
+            updated = self._apply(map(_heatmap_route, tasks))
+        self.store.save()
+        tiles = self.store.write_tiles(full=full_tiles)
+        logger.info(f"Updated {updated} routes, wrote {tiles} tiles in {time.time() - start:.1f}s")
+        return updated
+
+    def _apply(self, outputs):
+        updated = 0
+        for filepath, at_other_depot, contribution in outputs:
+            file_id = os.path.basename(filepath).split('.')[0]
+            # Unreadable or empty routes still replace any earlier contribution
+            self.store.update_route(file_id, contribution, mtime=os.path.getmtime(filepath),
+                                    at_other_depot=at_other_depot)
+            updated += 1
+        return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute fleet heatmap tiles')
+    parser.add_argument('--csv', default='routesinformation.csv')
+    parser.add_argument('--data', default='data')
+    parser.add_argument('--results', help='Summary CSV of the analysis run (routes and depot check; '
+                                          'replaces --csv)')
+    parser.add_argument('--cache', help='Trace cache folder of the analysis run '
+                                        '(default: trace_cache when it exists)')
+    parser.add_argument('--memory-budget', type=float, default=MEMORY_BUDGET_MB,
+                        help='Per-worker memory budget (MB); larger uncached files are streamed in chunks')
+    parser.add_argument('--output', default='heatmap')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--min-zoom', type=int, default=DEFAULT_MIN_ZOOM)
+    parser.add_argument('--max-zoom', type=int, default=DEFAULT_MAX_ZOOM)
+    parser.add_argument('--bins', type=int, default=DEFAULT_BINS, help='Cells per tile side')
+    parser.add_argument('--changed-only', action='store_true',
+                        help='Only routes whose Excel file or depot check changed')
+    parser.add_argument('--full', action='store_true', help='Rewrite every tile')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    cache_folder = args.cache or find_cache_folder(args.results)
+    builder = HeatmapBuilder(args.csv, args.data, args.output, num_workers=args.workers,
+                             results_file=args.results, cache_folder=cache_folder,
+                             memory_budget_mb=args.memory_budget,
+                             min_zoom=args.min_zoom, max_zoom=args.max_zoom, bins=args.bins)
+    builder.run(changed_only=args.changed_only, full_tiles=args.full)
+
+
+if __name__ == "__main__":
+    main()
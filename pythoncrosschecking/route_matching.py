@@ -0,0 +1,638 @@
+"""
+Offline Map Matching
+====================
+Snaps GPS traces to a local road network with a hidden Markov model
+(Newson & Krumm). The hidden states are candidate road positions within
+search_radius_m of every point:
+
+- emissions score the GPS error of a candidate (Gaussian, gps_sigma_m)
+- transitions score how well the road route between two candidates agrees
+  with the distance between the points (exponential, beta_m)
+
+The Viterbi path gives the matched road distance and the road edges a route
+actually uses.
+
+The road network is a compact edge table, one row per straight segment
+between two nodes (e.g. an OSM extract split at its nodes):
+
+    u, v, u_lat, u_lon, v_lat, v_lon        required
+    oneway, edge_id, highway, ref, name     optional
+
+It is read from CSV, or from the .npz that --convert writes. Edges are held
+in a grid spatial index: each cell lists the edges whose segment passes
+through it, so long diagonal edges take cells along their length, not their
+bounding box. Candidate lookup for a whole trace is therefore one vectorized
+query. Road routes between candidates come from a bounded Dijkstra, and its
+shortest-path trees are reused by the following points.
+
+As in the paper, points closer than 2 * gps_sigma_m (straight line) to the
+previous kept point are skipped. Points without candidates stay unmatched.
+A step that no road route can explain, or that is longer than max_gap_km,
+splits the trace into separately matched pieces (match_breaks).
+
+GPS noise near junctions makes cross streets look like short detours. Each
+candidate remembers the node its edge was entered by, and leaving the edge
+through that node again (a U-turn) costs uturn_penalty_m of extra route.
+When the path is decoded, the distance along an edge only grows with the
+furthest point driven to in the driving direction (moving back by less than
+the GPS noise is not driving), and short out-and-back spurs onto an edge
+(within the search radius) are dropped before edge usage and traversals are
+counted.
+
+Columns added to every result by the 'match' stage:
+- matched_distance_km   road distance along the matched path
+- matched_points        kept points on the matched path
+- match_breaks          splits of the matched path
+- matched_edges         distinct road edges used
+- matched_roads         roads with the most matched km (ref, name or class)
+
+match_fleet() matches many routes on the hybrid executor, loading the
+network once per worker. It adds up per-edge usage for the whole fleet
+(routes, traversals, matched km) into a table for the road services
+(highway detection, road conditions).
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+
+Usage:
+------
+python route_matching.py --convert roads.csv --network roads.npz
+python route_matching.py --routes route_analysis_summary.csv --data data --network roads.npz --output fleet
+python route_cli.py match --routes routesinformation.csv --network roads.npz --cache trace_cache
+
+MapMatchStage.network_file = 'roads.npz'
+ctx = RoutePipeline(enabled=['match']).run('data/1527_0041000139.xlsx')
+"""
+
+import argparse
+import heapq
+import logging
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from route_pipeline import RoutePipeline, Stage, geodesic_km, register_stage, segment_distances_km
+
+logger = logging.getLogger(__name__)
+
+EDGE_COLUMNS = ['u', 'v', 'u_lat', 'u_lon', 'v_lat', 'v_lon']
+EDGE_ATTRIBUTES = ['edge_id', 'highway', 'ref', 'name']
+ONEWAY_VALUES = ('1', 'true', 'yes')
+
+# Spatial index cell; must be larger than the search radius
+INDEX_CELL_DEG = 0.01
+SEARCH_RADIUS_M = 50.0
+MAX_CANDIDATES = 6
+GPS_SIGMA_M = 15.0
+BETA_M = 25.0
+# Road routes longer than this multiple of the step (plus two search radii) are impossible
+MAX_ROUTE_FACTOR = 3.0
+MAX_GAP_KM = 10.0
+# Extra route length charged for leaving an edge through the node it was entered by
+UTURN_PENALTY_M = 100.0
+# Shortest-path trees kept for reuse by the next points
+PATH_MEMO_SIZE = 256
+MATCHED_ROADS = 3
+# Matched km below which an edge counts as touched, not used
+MIN_EDGE_KM = 0.001
+MATCH_COLUMNS = ('matched_distance_km', 'matched_points', 'match_breaks', 'matched_edges', 'matched_roads')
+
+# Local equirectangular frame for point-to-edge distances
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320
+
+
+class RoadNetwork:
+    """Road edge table with integer node ids, edge lengths and the directed arc graph"""
+
+    def __init__(self, edges):
+        missing = set(EDGE_COLUMNS) - set(edges.columns)
+        if missing:
+            raise ValueError(f"Road edge table lacks columns: {sorted(missing)}")
+        self.u_lat = edges['u_lat'].to_numpy(dtype=float)
+        self.u_lon = edges['u_lon'].to_numpy(dtype=float)
+        self.v_lat = edges['v_lat'].to_numpy(dtype=float)
+        self.v_lon = edges['v_lon'].to_numpy(dtype=float)
+        n_edges = len(edges)
+        self.node_ids, codes = np.unique(np.concatenate((edges['u'].to_numpy(), edges['v'].to_numpy())),
+                                         return_inverse=True)
+        self.u, self.v = codes[:n_edges], codes[n_edges:]
+        self.oneway = (edges['oneway'].astype(str).str.lower().isin(ONEWAY_VALUES).to_numpy()
+                       if 'oneway' in edges.columns else np.zeros(n_edges, dtype=bool))
+        self.length_km = geodesic_km(self.u_lat, self.u_lon, self.v_lat, self.v_lon)
+        self.attributes = {name: edges[name].fillna('').astype(str).to_numpy(dtype=str)
+                           for name in EDGE_ATTRIBUTES if name in edges.columns}
+
+        # Directed arcs u -> v, plus v -> u for two-way edges, grouped by start node
+        two_way = np.flatnonzero(~self.oneway)
+        start = np.concatenate((self.u, self.v[two_way]))
+        order = np.argsort(start, kind='stable')
+        self.arc_start = start[order]
+        self.arc_end = np.concatenate((self.v, self.u[two_way]))[order]
+        self.arc_edge = np.concatenate((np.arange(n_edges), two_way))[order]
+        self.arc_ptr = np.searchsorted(self.arc_start, np.arange(len(self.node_ids) + 1))
+
+    @classmethod
+    def from_file(cls, path):
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                edges = pd.DataFrame({name: data[name] for name in data.files})
+        else:
+            edges = pd.read_csv(path, dtype={name: str for name in EDGE_ATTRIBUTES})
+        logger.info(f"Loaded {len(edges)} road edges from {path}")
+        return cls(edges)
+
+    def __len__(self):
+        return len(self.length_km)
+
+    def save(self, path):
+        """Write the compact .npz edge table"""
+        # Plain (not object) arrays, so the table loads without pickle
+        node_ids = self.node_ids.astype(str) if self.node_ids.dtype == object else self.node_ids
+        arrays = {'u': node_ids[self.u], 'v': node_ids[self.v], 'u_lat': self.u_lat,
+                  'u_lon': self.u_lon, 'v_lat': self.v_lat, 'v_lon': self.v_lon, 'oneway': self.oneway}
+        arrays.update(self.attributes)
+        np.savez_compressed(path, **arrays)
+
+    def label(self, edge):
+        """Road name of an edge for reports: ref, else name, else road class"""
+        for name in ('ref', 'name', 'highway'):
+            if name in self.attributes and self.attributes[name][edge]:
+                return self.attributes[name][edge]
+        return ''
+
+    def edge_table(self, edges):
+        """Edge table rows of the given edges (for usage reports)"""
+        table = pd.DataFrame({'edge': edges})
+        for name, values in self.attributes.items():
+            table[name] = values[edges]
+        table['u'] = self.node_ids[self.u[edges]]
+        table['v'] = self.node_ids[self.v[edges]]
+        table['length_km'] = np.round(self.length_km[edges], 4)
+        return table
+
+
+class EdgeIndex:
+    """Grid spatial index: edges listed under every cell their segment passes through"""
+
+    def __init__(self, network, cell_deg=INDEX_CELL_DEG):
+        self.network = network
+        self.cell_deg = cell_deg
+        self.n_cols = int(round(360.0 / cell_deg))
+        # Sample every edge at most half a cell apart; consecutive samples are then in the same
+        # or a neighbouring cell, and diagonal steps add both cells they may cut through
+        d_lat, d_lon = network.v_lat - network.u_lat, network.v_lon - network.u_lon
+        steps = np.maximum(1, np.ceil(np.maximum(np.abs(d_lat), np.abs(d_lon)) / (cell_deg / 2))).astype(np.int64)
+        edge = np.repeat(np.arange(len(network)), steps + 1)
+        within = np.arange(len(edge)) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)
+        t = within / steps[edge]
+        rows, cols = self.cell(network.u_lat[edge] + t * d_lat[edge], network.u_lon[edge] + t * d_lon[edge])
+        step = within[1:] > 0
+        diagonal = step & (rows[1:] != rows[:-1]) & (cols[1:] != cols[:-1])
+        edge = np.concatenate((edge, edge[1:][diagonal], edge[1:][diagonal]))
+        rows = np.concatenate((rows, rows[:-1][diagonal], rows[1:][diagonal]))
+        cols = np.concatenate((cols, cols[1:][diagonal], cols[:-1][diagonal]))
+        pairs = np.unique((rows * self.n_cols + cols) * len(network) + edge)
+        keys, self.edges = pairs // len(network), pairs % len(network)
+        self.keys, first = np.unique(keys, return_index=True)
+        self.starts = np.append(first, len(keys))
+
+    def cell(self, lat, lon):
+        return (np.floor((lat + 90.0) / self.cell_deg).astype(np.int64),
+                np.floor((lon + 180.0) / self.cell_deg).astype(np.int64))
+
+    def candidates(self, lat, lon, radius_km, max_candidates):
+        """(point, edge, fraction along the edge, distance km) of the nearest edges within radius_km
+        of every point, sorted by point and distance"""
+        net = self.network
+        rows, cols = self.cell(lat, lon)
+        offsets = np.array([(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)])
+        query = ((rows[:, None] + offsets[:, 0]) * self.n_cols + cols[:, None] + offsets[:, 1]).ravel()
+        pos = np.minimum(np.searchsorted(self.keys, query), max(len(self.keys) - 1, 0))
+        hit = self.keys[pos] == query if len(self.keys) else np.zeros(len(query), dtype=bool)
+        point = np.repeat(np.arange(len(lat)), len(offsets))[hit]
+        starts = self.starts[pos[hit]]
+        counts = self.starts[pos[hit] + 1] - starts
+        pair = np.repeat(np.arange(len(point)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        # An edge is listed in several of the 9 cells around a point
+        key = np.unique(point[pair] * len(net) + self.edges[starts[pair] + within])
+        point, edge = key // len(net), key % len(net)
+
+        # Point-to-segment distance in a local km frame centred on the point
+        km_lon = KM_PER_DEG_LON * np.cos(np.radians(lat[point]))
+        ax, ay = (net.u_lon[edge] - lon[point]) * km_lon, (net.u_lat[edge] - lat[point]) * KM_PER_DEG_LAT
+        dx, dy = (net.v_lon[edge] - lon[point]) * km_lon - ax, (net.v_lat[edge] - lat[point]) * KM_PER_DEG_LAT - ay
+        length2 = dx * dx + dy * dy
+        fraction = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        distance = np.hypot(ax + fraction * dx, ay + fraction * dy)
+
+        near = distance <= radius_km
+        point, edge, fraction, distance = point[near], edge[near], fraction[near], distance[near]
+        order = np.lexsort((distance, point))
+        point, edge, fraction, distance = point[order], edge[order], fraction[order], distance[order]
+        rank = np.arange(len(point)) - np.searchsorted(point, point)
+        keep = rank < max_candidates
+        return point[keep], edge[keep], fraction[keep], distance[keep]
+
+
+def keep_points(lat, lon, min_step_km):
+    """Indices of the points at least min_step_km (straight line) from the previous kept point;
+    the last point is always kept"""
+    if len(lat) == 0:
+        return np.zeros(0, dtype=np.int64)
+    kept = [0]
+    # Plain floats: one comparison per point, in trace order
+    lat_km = (np.asarray(lat, dtype=float) * KM_PER_DEG_LAT).tolist()
+    lon_km = (np.asarray(lon, dtype=float) * KM_PER_DEG_LON * np.cos(np.radians(np.mean(lat)))).tolist()
+    last_y, last_x = lat_km[0], lon_km[0]
+    min_step2 = min_step_km * min_step_km
+    for i in range(1, len(lat_km)):
+        dy, dx = lat_km[i] - last_y, lon_km[i] - last_x
+        if dy * dy + dx * dx >= min_step2:
+            kept.append(i)
+            last_y, last_x = lat_km[i], lon_km[i]
+    if kept[-1] != len(lat_km) - 1:
+        kept.append(len(lat_km) - 1)
+    return np.array(kept, dtype=np.int64)
+
+
+class MapMatcher:
+    def __init__(self, network, search_radius_m=SEARCH_RADIUS_M, max_candidates=MAX_CANDIDATES,
+                 gps_sigma_m=GPS_SIGMA_M, beta_m=BETA_M, max_gap_km=MAX_GAP_KM, cell_deg=INDEX_CELL_DEG,
+                 uturn_penalty_m=UTURN_PENALTY_M):
+        self.network = network
+        self.index = EdgeIndex(network, cell_deg)
+        self.radius_km = search_radius_m / 1000
+        self.max_candidates = max_candidates
+        self.sigma_km = gps_sigma_m / 1000
+        self.beta_km = beta_m / 1000
+        self.uturn_km = uturn_penalty_m / 1000
+        self.max_gap_km = max_gap_km
+        # Plain lists: the Dijkstra loop indexes them one element at a time
+        self._ptr = network.arc_ptr.tolist()
+        self._arc_start = network.arc_start.tolist()
+        self._arc_end = network.arc_end.tolist()
+        self._arc_edge = network.arc_edge.tolist()
+        self._arc_km = network.length_km[network.arc_edge].tolist()
+        self._memo = {}
+
+    def shortest_paths(self, source, limit):
+        """(distance, predecessor arc) of the nodes within limit km of source (bounded Dijkstra)"""
+        cached = self._memo.get(source)
+        if cached is not None and cached[0] >= limit:
+            return cached[1], cached[2]
+        distance, predecessor = {source: 0.0}, {}
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > distance[node]:
+                continue
+            for arc in range(self._ptr[node], self._ptr[node + 1]):
+                end, nd = self._arc_end[arc], d + self._arc_km[arc]
+                if nd <= limit and nd < distance.get(end, math.inf):
+                    distance[end] = nd
+                    predecessor[end] = arc
+                    heapq.heappush(heap, (nd, end))
+        if len(self._memo) >= PATH_MEMO_SIZE:
+            self._memo.clear()
+        self._memo[source] = (limit, distance, predecessor)
+        return distance, predecessor
+
+    def path_edges(self, source, target, limit):
+        """Edges of the shortest path between two nodes, in driving order"""
+        _, predecessor = self.shortest_paths(source, limit)
+        edges = []
+        while target != source:
+            arc = predecessor[target]
+            edges.append(self._arc_edge[arc])
+            target = self._arc_start[arc]
+        return edges[::-1]
+
+    def entered_after(self, entered, e, ta, tb):
+        """Entry node of edge e after moving along it from fraction ta to tb; moving back further
+        than the GPS noise turns around, as if the edge was entered from the other end"""
+        if entered is None:
+            return None
+        u, v = int(self.network.u[e]), int(self.network.v[e])
+        back_km = (ta - tb if entered == u else tb - ta) * float(self.network.length_km[e])
+        if back_km > 2 * self.sigma_km:
+            return v if entered == u else u
+        return entered
+
+    def transitions(self, edges_a, fractions_a, entered_a, edges_b, fractions_b, step_km):
+        """Road distance between every pair of candidates (inf when no route within the bound),
+        U-turn penalties and how each route leaves / enters its edges.
+
+        entered_a: node through which the best path entered each candidate's edge (None if
+        unknown); leaving the edge through that node again is a U-turn.
+        """
+        net = self.network
+        limit = step_km * MAX_ROUTE_FACTOR + 2 * self.radius_km
+        route = np.full((len(edges_a), len(edges_b)), np.inf)
+        turns = np.zeros((len(edges_a), len(edges_b)))
+        links = [[None] * len(edges_b) for _ in edges_a]
+        entries = []
+        for eb, tb in zip(edges_b.tolist(), fractions_b.tolist()):
+            length = float(net.length_km[eb])
+            entry = [(int(net.u[eb]), tb * length)]
+            if not net.oneway[eb]:
+                entry.append((int(net.v[eb]), (1 - tb) * length))
+            entries.append(entry)
+
+        for i, (ea, ta) in enumerate(zip(edges_a.tolist(), fractions_a.tolist())):
+            length = float(net.length_km[ea])
+            exits = [(int(net.v[ea]), (1 - ta) * length)]
+            if not net.oneway[ea]:
+                exits.append((int(net.u[ea]), ta * length))
+            reach = [(node, cost, self.uturn_km if node == entered_a[i] else 0.0,
+                      self.shortest_paths(node, limit)[0]) for node, cost in exits if cost <= limit]
+            for j, (eb, tb) in enumerate(zip(edges_b.tolist(), fractions_b.tolist())):
+                # Routes are compared by distance plus U-turn penalty
+                best, best_turn, link = math.inf, 0.0, None
+                if ea == eb and (tb >= ta or not net.oneway[ea]):
+                    best = abs(tb - ta) * length
+                for exit_node, exit_km, turn, distance in reach:
+                    for entry_node, entry_km in entries[j]:
+                        d = distance.get(entry_node)
+                        if d is not None and exit_km + d + entry_km + turn < best + best_turn:
+                            best, best_turn = exit_km + d + entry_km, turn
+                            link = (exit_node, exit_km, entry_node, entry_km, limit)
+                if best <= limit:
+                    route[i, j] = best
+                    turns[i, j] = best_turn
+                    links[i][j] = link
+        return route, turns, links
+
+    def match(self, lat, lon, segment_km=None):
+        """Viterbi match of a trace; returns the matched distance, path and per-edge usage"""
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        if segment_km is None:
+            segment_km = segment_distances_km(lat, lon)
+        kept = keep_points(lat, lon, 2 * self.sigma_km)
+        travelled = np.concatenate(([0.0], np.cumsum(segment_km)))[kept]
+        point, edge, fraction, distance = self.index.candidates(lat[kept], lon[kept], self.radius_km,
+                                                                self.max_candidates)
+        bounds = np.searchsorted(point, np.arange(len(kept) + 1))
+
+        # Each step: (kept point, candidate rows, scores, back pointers, route matrix, links,
+        # node through which the best path entered each candidate's edge)
+        pieces, current = [], []
+        for p in range(len(kept)):
+            rows = np.arange(bounds[p], bounds[p + 1])
+            if len(rows) == 0:
+                continue
+            emission = -0.5 * (distance[rows] / self.sigma_km) ** 2
+            if current:
+                last_p, last_rows, last_scores = current[-1][:3]
+                last_entered = current[-1][6]
+                step_km = travelled[p] - travelled[last_p]
+                if step_km <= self.max_gap_km:
+                    route, turns, links = self.transitions(edge[last_rows], fraction[last_rows], last_entered,
+                                                           edge[rows], fraction[rows], step_km)
+                    total = last_scores[:, None] - (np.abs(route - step_km) + turns) / self.beta_km
+                    back = np.argmax(total, axis=0)
+                    scores = total[back, np.arange(len(rows))] + emission
+                    if np.isfinite(scores).any():
+                        entered = [self.entered_after(last_entered[i], edge[last_rows[i]], fraction[last_rows[i]],
+                                                      fraction[rows[j]]) if links[i][j] is None else links[i][j][2]
+                                   for j, i in enumerate(back.tolist())]
+                        current.append((p, rows, scores, back, route, links, entered))
+                        continue
+                # No road route explains the step: match the rest separately
+                pieces.append(current)
+            current = [(p, rows, emission, None, None, None, [None] * len(rows))]
+        if current:
+            pieces.append(current)
+
+        matched_km = 0.0
+        edge_km, traversals, path = {}, {}, []
+        for piece in pieces:
+            chosen = [0] * len(piece)
+            j = int(np.argmax(piece[-1][2]))
+            for s in range(len(piece) - 1, -1, -1):
+                chosen[s] = j
+                if piece[s][3] is not None:
+                    j = int(piece[s][3][j])
+            # Visits of the matched edges in driving order: [edge, km]. Along the current edge, reach
+            # is the furthest fraction driven to and forward the direction (towards v; None if unknown)
+            visits = []
+            for s, (p, rows, _, _, _, links, _) in enumerate(piece):
+                candidate = rows[chosen[s]]
+                e = int(edge[candidate])
+                t = float(fraction[candidate])
+                path.append((int(kept[p]), e, t))
+                if s == 0:
+                    reach, forward = t, None
+                    continue
+                i, j = chosen[s - 1], chosen[s]
+                length = float(self.network.length_km[e])
+                turned = False
+                if links[i][j] is None:
+                    # Along the same edge; moving back up to the GPS noise is not driving
+                    ahead = (t - reach if forward else reach - t) * length if forward is not None else None
+                    if ahead is None or ahead >= 0:
+                        km = abs(t - reach) * length
+                        reach = t
+                    elif -ahead <= 2 * self.sigma_km:
+                        km = 0.0
+                    else:
+                        km, reach, forward, turned = -ahead, t, not forward, True
+                    legs = [(e, km)]
+                else:
+                    exit_node, exit_km, entry_node, entry_km, limit = links[i][j]
+                    previous = int(edge[piece[s - 1][1][i]])
+                    if forward is not None:
+                        behind = int(self.network.u[previous] if forward else self.network.v[previous])
+                        if exit_node == behind and visits and visits[-1][0] == previous and \
+                                visits[-1][1] + exit_km <= 2 * self.radius_km:
+                            # Short spur: the edge was left through the node it was entered by
+                            matched_km -= visits.pop()[1]
+                            exit_km = 0.0
+                        elif exit_node != behind:
+                            # The rest of the edge beyond the furthest point driven to
+                            exit_km = (1 - reach if forward else reach) * float(self.network.length_km[previous])
+                    legs = [(previous, exit_km)]
+                    legs += [(b, float(self.network.length_km[b])) for b in self.path_edges(exit_node, entry_node, limit)]
+                    legs.append((e, entry_km))
+                    reach, forward = t, entry_node == int(self.network.u[e])
+                matched_km += sum(km for _, km in legs)
+                for leg_edge, km in legs:
+                    # Edges only touched at a node (e.g. cross streets of a snapped point) are not used
+                    if km <= MIN_EDGE_KM:
+                        continue
+                    if visits and visits[-1][0] == leg_edge and not turned:
+                        visits[-1][1] += km
+                    else:
+                        visits.append([leg_edge, km])
+            for e, km in visits:
+                edge_km[e] = edge_km.get(e, 0.0) + km
+                traversals[e] = traversals.get(e, 0) + 1
+
+        return {
+            'distance_km': float(matched_km),
+            'kept_points': len(kept),
+            'matched_points': len(path),
+            'breaks': max(0, len(pieces) - 1),
+            'path': path,
+            'edge_km': {e: km for e, km in edge_km.items() if km > MIN_EDGE_KM},
+            'traversals': traversals,
+        }
+
+
+def match_columns(match, network, roads=MATCHED_ROADS):
+    """Result columns of a match"""
+    road_km = {}
+    for e, km in match['edge_km'].items():
+        label = network.label(e)
+        if label:
+            road_km[label] = road_km.get(label, 0.0) + km
+    top = [(label, km) for label, km in sorted(road_km.items(), key=lambda item: -item[1])[:roads] if km >= 0.05]
+    return {
+        'matched_distance_km': round(match['distance_km'], 2),
+        'matched_points': match['matched_points'],
+        'match_breaks': match['breaks'],
+        'matched_edges': len(match['traversals']),
+        'matched_roads': '; '.join(f"{label} ({km:.1f} km)" for label, km in top),
+    }
+
+
+# Matchers loaded in this process, by network file
+_matchers = {}
+
+
+def matcher_for(network_file):
+    """Matcher of a network file, loaded once per process"""
+    if network_file not in _matchers:
+        _matchers[network_file] = MapMatcher(RoadNetwork.from_file(network_file))
+    return _matchers[network_file]
+
+
+@register_stage(after='distance')
+class MapMatchStage(Stage):
+    """Road distance and road edges of the trace matched to network_file"""
+    name = 'match'
+    requires = ('segment_km',)
+    default = False
+    network_file = None
+
+    def run(self, ctx):
+        if self.network_file is None or ctx.valid_points < 2:
+            return
+        matcher = matcher_for(self.network_file)
+        match = matcher.match(ctx.lat, ctx.lon, ctx.segment('segment_km'))
+        ctx.artifacts['matching'] = match
+        ctx.extra.update(match_columns(match, matcher.network))
+
+
+# Pipeline of match_fleet workers
+_fleet_pipeline = None
+
+
+def _init_fleet_worker(network_file, cache_folder):
+    global _fleet_pipeline
+    MapMatchStage.network_file = network_file
+    matcher_for(network_file)
+    _fleet_pipeline = RoutePipeline(stages=['distance', 'match'], cache_folder=cache_folder)
+
+
+def _match_route(filepath):
+    """Match one route (executor task): (result row, (edges, km, traversals) or None)"""
+    filename = os.path.basename(filepath)
+    row = {'file_id': filename.split('.')[0], 'filename': filename}
+    try:
+        ctx = _fleet_pipeline.run(filepath)
+    except Exception as e:
+        row['status'] = f'Error: {str(e)}'
+        return row, None
+    row.update({'status': ctx.status, 'valid_points': ctx.valid_points,
+                'total_distance_km': round(ctx.metrics['total_distance_km'], 2)})
+    row.update({key: ctx.extra[key] for key in MATCH_COLUMNS if key in ctx.extra})
+    match = ctx.artifacts.get('matching')
+    if match is None:
+        return row, None
+    edges = np.fromiter(match['edge_km'], dtype=np.int64, count=len(match['edge_km']))
+    usage = (edges, np.array([match['edge_km'][e] for e in edges.tolist()]),
+             np.array([match['traversals'].get(e, 0) for e in edges.tolist()], dtype=np.int64))
+    return row, usage
+
+
+def match_fleet(filenames, data_folder, network_file, cache_folder=None, num_workers=None):
+    """Match the given Excel files; returns (per-route DataFrame, per-edge usage DataFrame)"""
+    from route_executor import HybridExecutor
+    tasks = [os.path.join(data_folder, name) for name in filenames
+             if os.path.exists(os.path.join(data_folder, name))]
+    start = time.time()
+    executor = HybridExecutor(num_workers)
+    routes = []
+    usage = None
+    for row, route_usage in executor.imap(_match_route, tasks, initializer=_init_fleet_worker,
+                                          initargs=(network_file, cache_folder)):
+        routes.append(row)
+        if usage is None:
+            # The initializer has loaded the network in this process as well
+            network = matcher_for(network_file).network
+            usage = {'routes': np.zeros(len(network), dtype=np.int64),
+                     'traversals': np.zeros(len(network), dtype=np.int64), 'matched_km': np.zeros(len(network))}
+        if route_usage is not None:
+            edges, km, traversals = route_usage
+            usage['routes'][edges] += 1
+            usage['traversals'][edges] += traversals
+            usage['matched_km'][edges] += km
+
+    routes = pd.DataFrame(routes)
+    if usage is None:
+        return routes, pd.DataFrame()
+    used = np.flatnonzero(usage['routes'])
+    edge_usage = matcher_for(network_file).network.edge_table(used)
+    edge_usage['routes'] = usage['routes'][used]
+    edge_usage['traversals'] = usage['traversals'][used]
+    edge_usage['matched_km'] = np.round(usage['matched_km'][used], 3)
+    edge_usage = edge_usage.sort_values(['routes', 'matched_km'], ascending=False).reset_index(drop=True)
+    logger.info(f"Matched {len(routes)} of {len(filenames)} routes onto {len(used)} road edges in "
+                f"{time.time() - start:.1f}s ({len(filenames) - len(tasks)} missing, "
+                f"{executor.report.get('mode')} execution)")
+    return routes, edge_usage
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Map-match routes to a local road network')
+    parser.add_argument('--network', required=True, help='Road edge table (.csv or .npz)')
+    parser.add_argument('--convert', metavar='EDGE_CSV', help='Convert an edge CSV to the compact --network .npz')
+    parser.add_argument('--routes', default='route_analysis_summary.csv', help='Results CSV or route index CSV')
+    parser.add_argument('--data', default='data', help='Folder containing Excel files')
+    parser.add_argument('--status', nargs='+', help='Only routes with these statuses')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--cache', help='Trace cache folder of the analysis run (skips re-reading Excel files)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='fleet', help='Prefix of <prefix>_matches.csv / <prefix>_edge_usage.csv')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.convert:
+        network = RoadNetwork.from_file(args.convert)
+        network.save(args.network)
+        print(f"Wrote {len(network)} edges, {len(network.node_ids)} nodes to {args.network}")
+        return
+
+    from route_renderer import select_routes
+    filenames = select_routes(args.routes, args.status, limit=args.limit)
+    routes, edge_usage = match_fleet(filenames, args.data, args.network, cache_folder=args.cache,
+                                     num_workers=args.workers)
+    for suffix, table in (('matches', routes), ('edge_usage', edge_usage)):
+        output_file = f"{args.output}_{suffix}.csv"
+        table.to_csv(output_file, index=False)
+        print(f"Saved: {output_file}")
+    if 'matched_distance_km' in routes.columns:
+        matched = routes.dropna(subset=['matched_distance_km'])
+        print(f"{len(matched)} routes matched: {matched['matched_distance_km'].sum():.1f} road km vs "
+              f"{matched['total_distance_km'].sum():.1f} km between GPS points")
+
+
+if __name__ == "__main__":
+    main()
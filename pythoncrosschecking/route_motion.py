@@ -0,0 +1,149 @@
+"""
+Route Motion Analytics
+======================
+Time- and speed-aware metrics for traces whose sheet carries a timestamp
+column (detected by the parse stage; traces without one are skipped).
+
+Per-segment speeds come from the geodesic segment lengths the pipeline already
+computed and the time between fixes; everything below is one vectorized pass
+over those arrays, with runs of slow / fast segments found from the edges of
+boolean masks.
+
+- stops:      runs of segments slower than stop_speed_kmh lasting at least
+              min_stop_seconds (dwell at customers and depots)
+- idle:       shorter slow runs (traffic, queueing)
+- overspeed:  runs of segments faster than speed_limit_kmh (60 km/h, the
+              speedLimit default of riskCalculationService.js); runs less
+              than merge_gap_seconds apart count as one stretch
+- moving:     time and average speed of the remaining segments
+
+Segments with a missing or non-increasing timestamp, gaps longer than
+max_gap_seconds (logger off) and implausible speeds (> MAX_SPEED_KMH, GPS
+jumps) are left out of every metric.
+
+Columns added to every timed result:
+- duration_minutes / moving_minutes / avg_moving_speed_kmh / max_speed_kmh
+- stop_count / dwell_minutes / longest_stop_minutes / idle_minutes
+- overspeed_count / overspeed_km / overspeed_minutes
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+
+Usage:
+------
+import route_motion                          # registers the 'motion' pipeline stage
+motion = route_motion.motion_metrics(segment_km, seconds)
+"""
+
+import logging
+
+import numpy as np
+
+from route_cleaning import MAX_SPEED_KMH
+from route_pipeline import Stage, register_stage
+
+logger = logging.getLogger(__name__)
+
+STOP_SPEED_KMH = 3.0
+MIN_STOP_SECONDS = 120.0
+SPEED_LIMIT_KMH = 60.0
+MAX_GAP_SECONDS = 3600.0
+MERGE_GAP_SECONDS = 30.0
+
+
+def segment_speeds(segment_km, seconds, max_gap_seconds=MAX_GAP_SECONDS):
+    """(speed_kmh, dt_seconds) per segment; speed is NaN where the timing is unusable"""
+    dt = np.diff(seconds)
+    with np.errstate(invalid='ignore'):
+        usable = (dt > 0) & (dt <= max_gap_seconds)
+    speed = np.full(len(dt), np.nan)
+    speed[usable] = segment_km[usable] / (dt[usable] / 3600.0)
+    return speed, dt
+
+
+def true_runs(mask):
+    """(starts, ends) of the runs of True values; ends are exclusive"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def run_sums(values, starts, ends):
+    """Sum of values over every run"""
+    if len(starts) == 0:
+        return np.zeros(0)
+    totals = np.concatenate(([0.0], np.cumsum(values)))
+    return totals[ends] - totals[starts]
+
+
+def merge_runs(starts, ends, dt, merge_gap_seconds):
+    """Join runs separated by less than merge_gap_seconds"""
+    if len(starts) < 2:
+        return starts, ends
+    joined = run_sums(dt, ends[:-1], starts[1:]) < merge_gap_seconds
+    return starts[np.concatenate(([True], ~joined))], ends[np.concatenate((~joined, [True]))]
+
+
+def motion_metrics(segment_km, seconds, stop_speed_kmh=STOP_SPEED_KMH, min_stop_seconds=MIN_STOP_SECONDS,
+                   speed_limit_kmh=SPEED_LIMIT_KMH, max_speed_kmh=MAX_SPEED_KMH, max_gap_seconds=MAX_GAP_SECONDS,
+                   merge_gap_seconds=MERGE_GAP_SECONDS):
+    """Speed, stop, idle and overspeed metrics of a timed trace.
+
+    Returns (metrics, details): metrics are the result columns, details hold the
+    per-segment speeds and the (start, end) point indices of stops and
+    overspeed stretches.
+    """
+    segment_km = np.asarray(segment_km, dtype=float)
+    seconds = np.asarray(seconds, dtype=float)
+    speed, dt = segment_speeds(segment_km, seconds, max_gap_seconds)
+    with np.errstate(invalid='ignore'):
+        plausible = speed <= max_speed_kmh
+        slow = plausible & (speed < stop_speed_kmh)
+        fast = plausible & (speed > speed_limit_kmh)
+    moving = plausible & ~slow
+    dt_used = np.where(plausible, dt, 0.0)
+
+    slow_starts, slow_ends = true_runs(slow)
+    slow_seconds = run_sums(dt_used, slow_starts, slow_ends)
+    is_stop = slow_seconds >= min_stop_seconds
+    fast_starts, fast_ends = merge_runs(*true_runs(fast), dt_used, merge_gap_seconds)
+
+    moving_seconds = float(np.sum(dt_used[moving]))
+    moving_km = float(np.sum(segment_km[moving]))
+    known = seconds[~np.isnan(seconds)]
+    metrics = {
+        'duration_minutes': round(float(known.max() - known.min()) / 60, 1) if len(known) else 0.0,
+        'moving_minutes': round(moving_seconds / 60, 1),
+        'avg_moving_speed_kmh': round(moving_km / (moving_seconds / 3600), 1) if moving_seconds else 0.0,
+        'max_speed_kmh': round(float(speed[plausible].max()), 1) if plausible.any() else 0.0,
+        'stop_count': int(np.count_nonzero(is_stop)),
+        'dwell_minutes': round(float(slow_seconds[is_stop].sum()) / 60, 1),
+        'longest_stop_minutes': round(float(slow_seconds[is_stop].max()) / 60, 1) if is_stop.any() else 0.0,
+        'idle_minutes': round(float(slow_seconds[~is_stop].sum()) / 60, 1),
+        'overspeed_count': len(fast_starts),
+        'overspeed_km': round(float(np.sum(segment_km[fast])), 2),
+        'overspeed_minutes': round(float(np.sum(dt_used[fast])) / 60, 1),
+    }
+    # Segment s runs from point s to point s + 1
+    details = {
+        'speed_kmh': speed,
+        'stops': list(zip(slow_starts[is_stop].tolist(), slow_ends[is_stop].tolist())),
+        'overspeed': list(zip(fast_starts.tolist(), fast_ends.tolist())),
+    }
+    return metrics, details
+
+
+@register_stage(after='distance')
+class MotionStage(Stage):
+    """Speed, stop/dwell, idle and overspeed metrics of timed traces"""
+    name = 'motion'
+    requires = ('segment_km',)
+    speed_limit_kmh = SPEED_LIMIT_KMH
+
+    def run(self, ctx):
+        if ctx.seconds is None or ctx.valid_points < 2:
+            return
+        metrics, details = motion_metrics(ctx.segment('segment_km'), ctx.seconds,
+                                          speed_limit_kmh=self.speed_limit_kmh)
+        ctx.artifacts['motion'] = details
+        ctx.extra.update(metrics)
@@ -0,0 +1,795 @@
+"""
+Route Analysis Pipeline
+=======================
+Shared analysis core for route_analyzer.py and analyzerv2.py.
+
+Each route runs through registered stages over one RouteContext that holds
+the trace as NumPy arrays:
+
+    read -> parse (incl. validation) -> distance -> anomalies -> format -> regions
+
+Per-segment arrays (geodesic lengths, duplicate flags, latitude bands) are
+computed together in a single fused pass after parsing, and only for the
+arrays the enabled stages declare in `requires`. New checks register a Stage
+subclass with @register_stage instead of adding another method (and another
+walk over the points) to every analyzer copy.
+
+Files too large for the per-worker memory budget of an analyzer are streamed
+in chunks by route_chunked.py instead of running through the stages.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy
+
+Usage:
+------
+pipeline = RoutePipeline()                         # default stages
+pipeline = RoutePipeline(stages=['distance'])      # read + parse + distance only
+pipeline = RoutePipeline(cache_folder='trace_cache')  # reuse parsed traces of unchanged files
+ctx = pipeline.run('data/1527_0041000139.xlsx')
+result = ctx.to_result(csv_row, INDEX_COLUMNS_V2)
+"""
+
+import logging
+import math
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from route_regions import REGION_CELL_DEG, profile_messages, region_profile
+from trace_codec import TraceCache, decode_trace, encode_polyline, encode_trace
+
+logger = logging.getLogger(__name__)
+
+# Column name variations used to find the coordinate columns
+LAT_VARIATIONS = ['Latitude', 'latitude', 'lat', 'Lat', 'LATITUDE']
+LON_VARIATIONS = ['Longitude', 'longitude', 'lon', 'Lon', 'LONGITUDE', 'Long']
+
+# Column name variations of timestamp columns (checked to actually hold times)
+TIME_VARIATIONS = ['Timestamp', 'timestamp', 'TIMESTAMP', 'DateTime', 'Datetime', 'datetime', 'Time', 'time',
+                   'TIME', 'Date', 'date', 'DATE']
+
+# Excel serial day numbers accepted as timestamps (1954-2119) and the serial of 1970-01-01
+EXCEL_SERIAL_RANGE = (20000, 80000)
+EXCEL_UNIX_EPOCH = 25569
+# Unix epoch seconds accepted as timestamps (2000-2100); the same range x 1000 is epoch milliseconds
+EPOCH_SECONDS_RANGE = (946684800, 4102444800)
+
+# Region profile values added to every result
+REGION_COLUMNS = ('region_cells', 'cell_transitions', 'teleport_backs', 'interleave_returns', 'lat_span_cells',
+                  'lon_span_cells')
+
+# Result keys for the four index CSV columns
+INDEX_COLUMNS_V1 = ('csv_col1', 'csv_col2', 'csv_col3', 'csv_col4')
+INDEX_COLUMNS_V2 = ('BU_Code', 'Location', 'Row_Labels', 'Customer_Name')
+
+# Rough boundaries of India used for coordinate validation
+# Version of what read + parse yield for a file; bump it when parsing changes so cached traces are re-read
+PARSE_VERSION = 1
+# Fixed-point precision (micro-degrees) of the traces results carry to the parent process
+TRACE_PRECISION = 6
+TRACE_EXPORT_FILE = 'route_traces.csv'
+
+INDIA_LAT_RANGE = (6, 38)
+INDIA_LON_RANGE = (68, 98)
+
+# WGS-84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+
+# ---------------------------------------------------------------------------
+# Vectorized building blocks
+# ---------------------------------------------------------------------------
+
+def detect_coordinate_columns(columns):
+    """Return (lat_col, lon_col); the last matching column wins"""
+    lat_col = None
+    lon_col = None
+    for col in columns:
+        if any(lat_var in str(col) for lat_var in LAT_VARIATIONS):
+            lat_col = col
+        if any(lon_var in str(col) for lon_var in LON_VARIATIONS):
+            lon_col = col
+    return lat_col, lon_col
+
+
+def numeric_seconds(numbers):
+    """Unix seconds of Excel serial days, epoch seconds or epoch milliseconds (NaN for other numbers)"""
+    with np.errstate(invalid='ignore'):
+        serial = (numbers >= EXCEL_SERIAL_RANGE[0]) & (numbers <= EXCEL_SERIAL_RANGE[1])
+        epoch_s = (numbers >= EPOCH_SECONDS_RANGE[0]) & (numbers <= EPOCH_SECONDS_RANGE[1])
+        epoch_ms = (numbers >= EPOCH_SECONDS_RANGE[0] * 1000) & (numbers <= EPOCH_SECONDS_RANGE[1] * 1000)
+    seconds = np.select([serial, epoch_s, epoch_ms],
+                        [(numbers - EXCEL_UNIX_EPOCH) * 86400.0, numbers, numbers / 1000.0], np.nan)
+    # Whole milliseconds, the resolution the trace cache keeps
+    return np.round(seconds, 3)
+
+
+def to_seconds(values):
+    """Convert a column to Unix seconds (float64); unparseable values become NaN.
+
+    Accepts datetime columns, date/time strings, Excel serial day numbers and
+    Unix epoch seconds or milliseconds (also as digit strings).
+    """
+    series = pd.Series(values)
+    if pd.api.types.is_bool_dtype(series):
+        return np.full(len(series), np.nan)
+    if pd.api.types.is_numeric_dtype(series):
+        return numeric_seconds(series.to_numpy(dtype=float, na_value=np.nan))
+    numbers = None
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        numbers = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            series = pd.to_datetime(series.where(np.isnan(numbers)), errors='coerce')
+    if getattr(series.dt, 'tz', None) is not None:
+        series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+    nanoseconds = series.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(float)
+    seconds = np.where(series.isna().to_numpy(), np.nan, np.round(nanoseconds / 1e9, 3))
+    if numbers is not None:
+        seconds = np.where(np.isnan(numbers), seconds, numeric_seconds(numbers))
+    return seconds
+
+
+def detect_timestamp_column(df, min_parsed=0.5):
+    """Name of the column holding point timestamps, or None.
+
+    Datetime-typed columns come first, then columns named like a time; a
+    candidate is accepted when at least min_parsed of its values parse.
+    """
+    named = [col for col in df.columns if any(var in str(col) for var in TIME_VARIATIONS)]
+    typed = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    for col in typed + [col for col in named if col not in typed]:
+        if len(df) and np.count_nonzero(~np.isnan(to_seconds(df[col]))) >= min_parsed * len(df):
+            return col
+    return None
+
+
+def to_float_array(values):
+    """Convert a column to float64; anything float() would reject becomes NaN"""
+    series = pd.Series(values)
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    if pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_timedelta64_dtype(series):
+        return np.full(len(series), np.nan)
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+def valid_coordinate_mask(lat, lon):
+    """Vectorized validate_coordinates: valid ranges and inside India"""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    with np.errstate(invalid='ignore'):
+        return ((lat >= INDIA_LAT_RANGE[0]) & (lat <= INDIA_LAT_RANGE[1]) &
+                (lon >= INDIA_LON_RANGE[0]) & (lon <= INDIA_LON_RANGE[1]))
+
+
+def geodesic_km(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    """Vectorized WGS-84 geodesic distance in km (Vincenty inverse formula).
+
+    Agrees with geopy's geodesic to well below a millimetre for the distances
+    seen in route traces; pairs where the iteration does not converge
+    (nearly antipodal points) fall back to geopy.
+    """
+    lat1, lon1, lat2, lon2 = (np.asarray(a, dtype=float) for a in (lat1, lon1, lat2, lon2))
+    if lat1.size == 0:
+        return np.zeros(0)
+
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - lam_prev) < tol
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distance_km = WGS84_B * A * (sigma - delta_sigma) / 1000.0
+
+    failed = ~converged | ~np.isfinite(distance_km)
+    if failed.any():
+        from geopy.distance import geodesic
+        for i in np.flatnonzero(failed):
+            try:
+                distance_km[i] = geodesic((lat1[i], lon1[i]), (lat2[i], lon2[i])).kilometers
+            except Exception:
+                distance_km[i] = 0.0
+    return distance_km
+
+
+def segment_distances_km(lat, lon):
+    """Geodesic length of every consecutive segment of a trace"""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    if len(lat) < 2:
+        return np.zeros(0)
+    return geodesic_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+
+def fused_segment_pass(lat, lon, names):
+    """Compute the requested per-segment/per-point arrays in one pass.
+
+    segment_km   - geodesic length of each segment (n - 1)
+    same_as_next - point equals the next point (n - 1)
+    lat_band     - integer latitude prefix of each point (n)
+    """
+    arrays = {}
+    if 'segment_km' in names:
+        arrays['segment_km'] = segment_distances_km(lat, lon)
+    if 'same_as_next' in names:
+        arrays['same_as_next'] = (lat[:-1] == lat[1:]) & (lon[:-1] == lon[1:])
+    if 'lat_band' in names:
+        arrays['lat_band'] = np.trunc(lat).astype(np.int64)
+    return arrays
+
+
+def parse_standard_columns(df, lat_col, lon_col):
+    """Valid (lat, lon) arrays from named coordinate columns"""
+    lat = to_float_array(df[lat_col])
+    lon = to_float_array(df[lon_col])
+    mask = valid_coordinate_mask(lat, lon)
+    return lat[mask], lon[mask]
+
+
+def parse_timed_columns(df, lat_col, lon_col, time_col):
+    """Valid (lat, lon, seconds) arrays; seconds is NaN where the time is unreadable"""
+    lat = to_float_array(df[lat_col])
+    lon = to_float_array(df[lon_col])
+    mask = valid_coordinate_mask(lat, lon)
+    return lat[mask], lon[mask], to_seconds(df[time_col])[mask]
+
+
+def parse_mixed_columns(df):
+    """Vectorized parse of sheets without coordinate headers.
+
+    Each row's numeric values are taken left to right: four values are two
+    coordinate pairs, two values are one pair, three values use the first pair
+    and are reported. Returns (lat, lon, anomalies).
+    """
+    if df.shape[0] == 0 or df.shape[1] == 0:
+        return np.zeros(0), np.zeros(0), []
+
+    matrix = np.column_stack([to_float_array(df.iloc[:, i]) for i in range(df.shape[1])])
+    present = ~np.isnan(matrix)
+    counts = present.sum(axis=1)
+    # Shift each row's numeric values to the left, keeping their order
+    order = np.argsort(~present, axis=1, kind='stable')
+    packed = np.take_along_axis(matrix, order, axis=1)
+    if packed.shape[1] < 4:
+        packed = np.pad(packed, ((0, 0), (0, 4 - packed.shape[1])), constant_values=np.nan)
+
+    anomalies = [f"Row {idx}: Found 3 values, expected 2 or 4" for idx in df.index[counts == 3]]
+
+    # Candidate pairs per row: (first pair, second pair), flattened in row order
+    has_first = (counts >= 2) & (counts <= 4)
+    has_second = counts == 4
+    lat = np.column_stack((packed[:, 0], packed[:, 2])).ravel()
+    lon = np.column_stack((packed[:, 1], packed[:, 3])).ravel()
+    keep = np.column_stack((has_first, has_second)).ravel() & valid_coordinate_mask(lat, lon)
+
+    if has_second.any():
+        anomalies.append("Mixed format detected: Multiple coordinate pairs per row")
+    return lat[keep], lon[keep], anomalies
+
+
+def count_duplicates(same_as_next):
+    return int(np.count_nonzero(same_as_next))
+
+
+def count_stationary(segment_km):
+    return int(np.count_nonzero((segment_km > 0) & (segment_km < 0.01)))
+
+
+def anomaly_messages(same_as_next, segment_km):
+    """Messages of detect_anomalies from the shared segment arrays"""
+    return anomaly_count_messages(count_duplicates(same_as_next), np.flatnonzero(segment_km > 100).tolist(),
+                                  count_stationary(segment_km))
+
+
+def anomaly_count_messages(duplicates, large_jumps, stationary):
+    """Anomaly messages from the duplicate count, large jump positions and stationary count"""
+    anomalies = []
+    if duplicates > 0:
+        anomalies.append(f"Found {duplicates} duplicate consecutive points")
+    if large_jumps:
+        anomalies.append(f"Large jumps (>100km) at positions: {large_jumps}")
+    if stationary > 5:
+        anomalies.append(f"Many stationary points ({stationary} segments < 10m)")
+    return anomalies
+
+
+def region_messages(lat_band):
+    """Messages of check_alternating_regions from the latitude bands"""
+    if len(lat_band) < 2:
+        return []
+    changes = np.flatnonzero(lat_band[1:] != lat_band[:-1])
+    if len(changes) == 0:
+        return []
+
+    # Regions are listed in order of first appearance; only band changes can be first appearances
+    run_starts = np.concatenate(([0], changes + 1))
+    bands, first_run = np.unique(lat_band[run_starts], return_index=True)
+    counts = np.bincount(lat_band - bands[0])[bands - bands[0]]
+    order = np.argsort(first_run)
+    return band_messages(bands[order], counts[order], len(changes), len(lat_band))
+
+
+def band_messages(bands, counts, alternations, n_points):
+    """Region messages from the latitude bands (in order of first appearance), their point
+    counts and the number of band changes"""
+    if alternations == 0:
+        return []
+    region_desc = ", ".join(f"{band}° ({count} points)" for band, count in zip(bands, counts))
+    anomalies = [f"Route spans multiple latitude regions: {region_desc}"]
+    if alternations > n_points * 0.3:  # More than 30% alternations
+        anomalies.append(f"Frequent alternation between regions detected ({alternations} times)")
+    return anomalies
+
+
+def format_location(lat, lon):
+    return f"{lat:.6f}, {lon:.6f}"
+
+
+# ---------------------------------------------------------------------------
+# Context and result building
+# ---------------------------------------------------------------------------
+
+class RouteContext:
+    """Per-route state shared by all stages"""
+
+    def __init__(self, filepath, df=None):
+        self.filepath = filepath
+        self.filename = os.path.basename(filepath)
+        self.file_id = self.filename.split('.')[0]
+        self.df = df
+        self.lat = np.zeros(0)
+        self.lon = np.zeros(0)
+        # Unix seconds of every valid point when the sheet has a timestamp column
+        self.seconds = None
+        # Valid point count of traces streamed in chunks (lat/lon then hold the first and last point only)
+        self.streamed_points = None
+        self.total_points = 0
+        # Point stride of the 'stride' stage, set from the pipeline
+        self.point_stride = 1
+        self.format_anomalies = []
+        self.anomalies = []
+        self.metrics = {'total_distance_km': 0.0}
+        self.extra = {}
+        # Per-route outputs of optional stages that are not result columns
+        self.artifacts = {}
+        self.status = None
+        self.error = None
+        self.done = False
+        self._segments = {}
+
+    @property
+    def valid_points(self):
+        return self.streamed_points if self.streamed_points is not None else len(self.lat)
+
+    @property
+    def points(self):
+        """Valid points as an (n, 2) array"""
+        return np.column_stack((self.lat, self.lon))
+
+    def segment(self, name):
+        """Shared per-segment array, computed on first use if not fused in"""
+        if name not in self._segments:
+            self._segments.update(fused_segment_pass(self.lat, self.lon, {name}))
+        return self._segments[name]
+
+    def stop(self, status, anomalies):
+        self.status = status
+        self.anomalies = anomalies
+        self.done = True
+
+    def finalize(self):
+        """Determine the status from point quality and anomalies"""
+        if self.status is not None:
+            return
+        if self.valid_points < self.total_points * 0.5:
+            self.status = 'Poor quality data'
+        elif self.anomalies:
+            self.status = 'Has anomalies'
+        else:
+            self.status = 'Good'
+
+    def to_result(self, csv_row_data=None, index_columns=INDEX_COLUMNS_V2):
+        has_points = self.valid_points > 0 and not self.error
+        result = route_result(self.file_id, self.filename, csv_row_data, index_columns, self.status,
+                              total_points=self.total_points, valid_points=self.valid_points,
+                              total_distance_km=round(self.metrics['total_distance_km'], 2) if has_points else 0,
+                              start_location=format_location(self.lat[0], self.lon[0]) if has_points else None,
+                              end_location=format_location(self.lat[-1], self.lon[-1]) if has_points else None,
+                              anomalies=self.anomalies if self.anomalies else ['None detected'])
+        result.update(self.extra)
+        return result
+
+
+def route_result(file_id, filename, csv_row_data, index_columns, status, total_points=0, valid_points=0,
+                 total_distance_km=0, start_location=None, end_location=None, anomalies=None):
+    """Build a result dict in the analyzers' output schema"""
+    result = {'file_id': file_id, 'filename': filename}
+    for i, key in enumerate(index_columns):
+        result[key] = csv_row_data.iloc[i] if csv_row_data is not None else None
+    result.update({
+        'status': status,
+        'total_points': total_points,
+        'valid_points': valid_points,
+        'total_distance_km': total_distance_km,
+        'start_location': start_location,
+        'end_location': end_location,
+        'anomalies': anomalies if anomalies is not None else [],
+    })
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Stages
+# ---------------------------------------------------------------------------
+
+class Stage:
+    """A pipeline step. Subclasses set name and implement run(ctx).
+
+    requires:  shared segment arrays read by the stage (see fused_segment_pass)
+    required:  stage cannot be disabled
+    default:   stage runs unless the pipeline is given an explicit stage list
+    """
+    name = None
+    requires = ()
+    required = False
+    default = True
+
+    def run(self, ctx):
+        raise NotImplementedError
+
+
+# Registered stage instances, in execution order
+STAGES = {}
+
+
+def register_stage(stage_cls=None, after=None):
+    """Class decorator adding a stage to the registry (optionally after another stage)"""
+    def decorator(cls):
+        stage = cls()
+        if after is None or after not in STAGES:
+            STAGES[cls.name] = stage
+        else:
+            items = list(STAGES.items())
+            position = [name for name, _ in items].index(after) + 1
+            items.insert(position, (cls.name, stage))
+            STAGES.clear()
+            STAGES.update(items)
+        return cls
+    return decorator(stage_cls) if stage_cls is not None else decorator
+
+
+@register_stage
+class ReadStage(Stage):
+    name = 'read'
+    required = True
+
+    def run(self, ctx):
+        if ctx.df is not None:
+            return
+        try:
+            logger.debug(f"Reading Excel file: {ctx.filepath}")
+            ctx.df = pd.read_excel(ctx.filepath)
+            logger.debug(f"Successfully read Excel with {len(ctx.df)} rows")
+        except Exception as e:
+            ctx.error = str(e)
+            ctx.stop('Error reading file', ['Could not read Excel file'])
+
+
+@register_stage
+class ParseStage(Stage):
+    name = 'parse'
+    required = True
+
+    def run(self, ctx):
+        df = ctx.df
+        lat_col, lon_col = detect_coordinate_columns(df.columns)
+        ctx.total_points = len(df)
+        if lat_col is not None and lon_col is not None:
+            logger.debug(f"Using standard format processing for {ctx.filename} ({lat_col}, {lon_col})")
+            time_col = detect_timestamp_column(df)
+            if time_col is not None:
+                logger.debug(f"Using timestamp column {time_col} for {ctx.filename}")
+                ctx.lat, ctx.lon, ctx.seconds = parse_timed_columns(df, lat_col, lon_col, time_col)
+            else:
+                ctx.lat, ctx.lon = parse_standard_columns(df, lat_col, lon_col)
+        else:
+            logger.debug(f"No standard lat/lon columns found, trying mixed format parsing for {ctx.filename}")
+            ctx.lat, ctx.lon, ctx.format_anomalies = parse_mixed_columns(df)
+        self.check_points(ctx)
+
+    def check_points(self, ctx):
+        """Stop routes without valid points (also used for traces loaded from the cache)"""
+        logger.debug(f"Found {ctx.valid_points} valid points out of {ctx.total_points}")
+        if ctx.valid_points == 0:
+            ctx.stop('No valid coordinates', ['No valid coordinates found'] + ctx.format_anomalies)
+
+
+@register_stage
+class PointStrideStage(Stage):
+    """Keep every point_stride-th valid point (sampled triage runs, see route_triage.py)"""
+    name = 'stride'
+    default = False
+
+    def run(self, ctx):
+        stride = ctx.point_stride
+        if stride <= 1 or ctx.valid_points <= stride:
+            return
+        kept = math.ceil(ctx.valid_points / stride)
+        # Scale the row count alike so the valid point ratio (poor quality check) is unchanged
+        ctx.total_points = round(ctx.total_points * kept / ctx.valid_points)
+        ctx.lat = ctx.lat[::stride]
+        ctx.lon = ctx.lon[::stride]
+        if ctx.seconds is not None:
+            ctx.seconds = ctx.seconds[::stride]
+        ctx.extra['point_stride'] = stride
+
+
+@register_stage
+class DistanceStage(Stage):
+    name = 'distance'
+    requires = ('segment_km',)
+
+    def run(self, ctx):
+        ctx.metrics['total_distance_km'] = math.fsum(ctx.segment('segment_km'))
+
+
+@register_stage
+class AnomalyStage(Stage):
+    """Duplicate points, large jumps and stationary segments"""
+    name = 'anomalies'
+    requires = ('segment_km', 'same_as_next')
+
+    def run(self, ctx):
+        ctx.anomalies.extend(anomaly_messages(ctx.segment('same_as_next'), ctx.segment('segment_km')))
+
+
+@register_stage
+class FormatStage(Stage):
+    """Reports problems found while parsing the sheet layout"""
+    name = 'format'
+
+    def run(self, ctx):
+        ctx.anomalies.extend(ctx.format_anomalies)
+
+
+@register_stage
+class RegionStage(Stage):
+    """Latitude regions plus the grid / geohash region profile (route_regions.py)"""
+    name = 'regions'
+    cell_deg = REGION_CELL_DEG
+    geohash_precision = None
+
+    def run(self, ctx):
+        profile = region_profile(ctx.lat, ctx.lon, cell_deg=self.cell_deg, geohash_precision=self.geohash_precision)
+        if profile['lat_bands'] is not None:
+            ctx.anomalies.extend(band_messages(*profile['lat_bands'], ctx.valid_points))
+        else:
+            # Geohash cells straddle whole degrees; the bands come from the points
+            ctx.anomalies.extend(region_messages(ctx.segment('lat_band')))
+        ctx.anomalies.extend(profile_messages(profile))
+        ctx.artifacts['regions'] = profile
+        ctx.extra.update({key: profile[key] for key in REGION_COLUMNS})
+
+
+@register_stage
+class TraceExportStage(Stage):
+    """Compact binary trace (trace_codec) in the result, carried from the worker to the parent;
+    RouteAnalyzerBase.save_traces exports it as polylines"""
+    name = 'trace'
+    default = False
+
+    def run(self, ctx):
+        ctx.extra['trace'] = encode_trace(ctx.lat, ctx.lon, precision=TRACE_PRECISION)
+
+
+# Stages whose output the trace cache holds
+CACHED_STAGES = ('read', 'parse')
+
+
+class RoutePipeline:
+    def __init__(self, stages=None, disabled=(), enabled=(), cache_folder=None, point_stride=1):
+        """stages: names to run (required stages are always added); None = defaults
+        enabled: optional stages to run in addition to stages/defaults
+        cache_folder: keep parsed traces there and skip reading unchanged files
+        point_stride: analyze every point_stride-th valid point (enables the 'stride' stage when > 1)
+        """
+        if point_stride > 1:
+            enabled = tuple(enabled) + ('stride',)
+        self.point_stride = point_stride
+        unknown = set(stages or ()) | set(disabled) | set(enabled)
+        unknown -= set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown pipeline stages: {sorted(unknown)}")
+        self.stage_names = [
+            name for name, stage in STAGES.items()
+            if stage.required or name in enabled or ((name in stages if stages is not None else stage.default)
+                                                     and name not in disabled)
+        ]
+        self.cache = TraceCache(cache_folder, version=PARSE_VERSION) if cache_folder else None
+
+    @property
+    def stages(self):
+        return [STAGES[name] for name in self.stage_names]
+
+    def run(self, filepath, df=None):
+        """Run the enabled stages for one route and return its context"""
+        ctx = RouteContext(filepath, df)
+        ctx.point_stride = self.point_stride
+        cached = self.cache.load(filepath) if self.cache is not None and df is None else None
+        if cached is not None:
+            ctx.lat, ctx.lon = cached['lat'], cached['lon']
+            ctx.total_points = cached['total_points']
+            ctx.format_anomalies = cached['format_anomalies']
+            ctx.seconds = cached['seconds']
+        fused = False
+        for stage in self.stages:
+            if cached is not None and stage.name in CACHED_STAGES:
+                if stage.name == 'parse':
+                    stage.check_points(ctx)
+                    if ctx.done:
+                        return ctx
+                continue
+            if not fused and stage.requires:
+                # One fused pass for every segment array the remaining stages need
+                needs = {name for s in self.stages for name in s.requires}
+                ctx._segments.update(fused_segment_pass(ctx.lat, ctx.lon, needs))
+                fused = True
+            stage.run(ctx)
+            if stage.name == 'parse' and self.cache is not None and df is None:
+                self.cache.store(filepath, ctx.lat, ctx.lon, ctx.total_points, ctx.format_anomalies,
+                                 ctx.seconds)
+            if ctx.done:
+                return ctx
+        ctx.finalize()
+        return ctx
+
+
+# ---------------------------------------------------------------------------
+# Shared analyzer base
+# ---------------------------------------------------------------------------
+
+class RouteAnalyzerBase:
+    """Per-route methods shared by route_analyzer.py and analyzerv2.py"""
+
+    # Result keys for the four index CSV columns
+    index_columns = INDEX_COLUMNS_V2
+
+    def __init__(self, csv_file, data_folder='data', stages=None, cache_folder=None, memory_budget_mb=None,
+                 enabled=()):
+        """memory_budget_mb: files estimated to need more are streamed in chunks (route_chunked.py)
+        enabled: optional stages to run on top of stages / the defaults (e.g. 'trace')
+        """
+        self.csv_file = csv_file
+        self.data_folder = data_folder
+        self.results = []
+        self.csv_data = None
+        self.pipeline = RoutePipeline(stages, enabled=enabled, cache_folder=cache_folder)
+        self.memory_budget_mb = memory_budget_mb
+        self.depot_index = None
+
+    def generate_filename(self, row):
+        """Generate Excel filename from CSV row"""
+        # Using BU Code (col1) and Row Labels (col3) for filename
+        col1 = str(row.iloc[0])
+        col3 = str(row.iloc[2])
+        return f"{col1}_{col3}.xlsx"
+
+    def validate_coordinates(self, lat, lon):
+        """Validate if coordinates are within valid ranges"""
+        try:
+            lat = float(lat)
+            lon = float(lon)
+        except (TypeError, ValueError):
+            return False
+        return (INDIA_LAT_RANGE[0] <= lat <= INDIA_LAT_RANGE[1] and
+                INDIA_LON_RANGE[0] <= lon <= INDIA_LON_RANGE[1])
+
+    def calculate_route_distance(self, points):
+        """Calculate total distance for a route"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        distances = segment_distances_km(points[:, 0], points[:, 1])
+        return math.fsum(distances), distances.tolist()
+
+    def detect_anomalies(self, points, distances):
+        """Detect anomalies in the route"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        same_as_next = fused_segment_pass(points[:, 0], points[:, 1], {'same_as_next'})['same_as_next']
+        return anomaly_messages(same_as_next, np.asarray(distances, dtype=float))
+
+    def parse_mixed_coordinates(self, df):
+        """Parse coordinates from files with mixed format issues"""
+        lat, lon, anomalies = parse_mixed_columns(df)
+        return list(zip(lat.tolist(), lon.tolist())), anomalies
+
+    def check_alternating_regions(self, points):
+        """Check if coordinates alternate between different regions"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return region_messages(np.trunc(points[:, 0]).astype(np.int64)) + \
+            profile_messages(region_profile(points[:, 0], points[:, 1]))
+
+    def route_result(self, filename, csv_row_data, status, **fields):
+        """Result dict for routes that never reached the pipeline"""
+        return route_result(filename.split('.')[0], filename, csv_row_data, self.index_columns, status, **fields)
+
+    def not_found_result(self, filename, csv_row_data):
+        return self.route_result(filename, csv_row_data, 'File not found',
+                                 anomalies=['Excel file not found in data folder'])
+
+    def load_depots(self, depot_file):
+        """Enable the depot start/end check with a depot coordinate table"""
+        from route_depots import DepotIndex
+        self.depot_index = DepotIndex.from_file(depot_file)
+        return self.depot_index
+
+    def check_depots(self):
+        """Validate start/end points of all results against the depots in one batch"""
+        if self.depot_index is not None and self.results:
+            from route_depots import validate_depots
+            validate_depots(self.results, self.depot_index, self.index_columns[0])
+
+    def save_traces(self, output_file):
+        """Move the encoded traces of the results into route_traces.csv next to output_file.
+
+        The file holds file_id, points and the Google encoded polyline of every
+        trace (for the Node services); returns its path, or None without traces.
+        """
+        rows = []
+        for result in self.results:
+            data = result.pop('trace', None)
+            # Results merged from DataFrames (shards) hold NaN for routes without a trace
+            if isinstance(data, bytes):
+                lat, lon = decode_trace(data)
+                rows.append({'file_id': result['file_id'], 'points': len(lat), 'polyline': encode_polyline(lat, lon)})
+        if not rows:
+            return None
+        trace_file = os.path.join(os.path.dirname(output_file), TRACE_EXPORT_FILE)
+        pd.DataFrame(rows).to_csv(trace_file, index=False)
+        return trace_file
+
+    def analyze_file(self, filepath, df=None):
+        """Run the pipeline and return the RouteContext (arrays included)"""
+        if df is None and self.memory_budget_mb:
+            from route_chunked import analyze_chunked, chunk_rows_for_budget, estimate_memory_mb
+            if estimate_memory_mb(filepath) > self.memory_budget_mb:
+                ctx = analyze_chunked(filepath, self.pipeline, chunk_rows_for_budget(self.memory_budget_mb))
+                if ctx is not None:
+                    return ctx
+        return self.pipeline.run(filepath, df)
+
+    def process_file(self, filepath, csv_row_data=None):
+        """Process a single Excel file"""
+        try:
+            return self.analyze_file(filepath).to_result(csv_row_data, self.index_columns)
+        except Exception as e:
+            return self.route_result(os.path.basename(filepath), csv_row_data, 'Processing error',
+                                     anomalies=[f'Error: {str(e)}'])
@@ -0,0 +1,239 @@
+"""
+Route Region Profiling
+======================
+Bins every point of a trace into a grid cell (fixed degree steps, or the
+cells of a geohash precision) and profiles how the trace moves between cells,
+in both latitude and longitude:
+
+- region_cells        occupied cells
+- cell_transitions    cell changes along the trace
+- distant jumps       consecutive points more than one cell apart
+- teleport-backs      a short excursion (<= teleport_max_points) to a distant
+                      cell and straight back (A -> B -> A), between longer
+                      stays in A
+- interleave returns  distant jumps back into a cell the trace already left
+                      earlier (two traces merged in blocks), not counting
+                      teleport-backs
+- spans               extent of the occupied cells north-south and east-west,
+                      in cells and km; wider than span_km in either
+                      dimension is a wide region span
+- lat_bands           whole-degree latitude bands, their point counts and the
+                      band changes (the latitude region check), taken from
+                      the runs when the cells tile whole degrees
+
+Binning is O(n): the cell sequence is run-length encoded first, cells are
+counted with np.bincount over the bounding box of the trace (np.unique only
+for huge boxes), and all pattern checks run on the runs. Traces read in
+chunks concatenate their runs and call runs_profile once.
+
+Installation Requirements:
+------------------------
+pip install numpy
+
+Usage:
+------
+profile = region_profile(lat, lon, cell_deg=0.25)
+profile = region_profile(lat, lon, geohash_precision=4)
+messages = profile_messages(profile)
+"""
+
+import numpy as np
+
+REGION_CELL_DEG = 0.25
+TELEPORT_MAX_POINTS = 5
+INTERLEAVE_MIN_RETURNS = 2
+# Extent of the occupied cells (either dimension) above which a route has a wide region span
+REGION_SPAN_KM = 250.0
+KM_PER_DEGREE = 111.32
+# Largest bounding box (in cells) counted with a dense bincount
+MAX_DENSE_CELLS = 1 << 22
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_steps(precision):
+    """(lat_step, lon_step) in degrees of the cells of a geohash precision"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def geohash_label(row, col, precision):
+    """Geohash string of a cell given as grid row/col of geohash_steps(precision)"""
+    bits = 5 * precision
+    code = 0
+    for bit in range(bits):
+        # Even bits (from the most significant) are longitude bits
+        source, index = (col, (bits + 1) // 2 - 1 - bit // 2) if bit % 2 == 0 else (row, bits // 2 - 1 - bit // 2)
+        code = (code << 1) | ((int(source) >> index) & 1)
+    return ''.join(GEOHASH_BASE32[(code >> shift) & 31] for shift in range(bits - 5, -1, -5))
+
+
+def grid_cells(lat, lon, lat_step, lon_step):
+    """Grid (row, col) of every point, counted from (-90, -180)"""
+    rows = np.floor((np.asarray(lat, dtype=float) + 90.0) / lat_step).astype(np.int64)
+    cols = np.floor((np.asarray(lon, dtype=float) + 180.0) / lon_step).astype(np.int64)
+    # Points on the north pole / antimeridian belong to the last cell
+    return np.minimum(rows, int(round(180.0 / lat_step)) - 1), np.minimum(cols, int(round(360.0 / lon_step)) - 1)
+
+
+def compact_cells(rows, cols, weights=None):
+    """(cell id of every entry, row, col and total weight (default: count) of every cell)"""
+    row0, col0 = rows.min(), cols.min()
+    width = int(cols.max() - col0) + 1
+    key = (rows - row0) * width + (cols - col0)
+    size = int(rows.max() - row0 + 1) * width
+    if size <= MAX_DENSE_CELLS:
+        counts = np.bincount(key, weights, minlength=size)
+        occupied = np.flatnonzero(counts)
+        lookup = np.empty(size, dtype=np.int64)
+        lookup[occupied] = np.arange(len(occupied))
+        cell = lookup[key]
+        counts = counts[occupied]
+    else:
+        occupied, cell = np.unique(key, return_inverse=True)
+        counts = np.bincount(cell, weights)
+    return cell, occupied // width + row0, occupied % width + col0, counts.astype(np.int64)
+
+
+def cell_runs(rows, cols):
+    """Run-length encoding of a cell sequence: (run rows, run cols, run lengths)"""
+    starts = np.concatenate(([0], np.flatnonzero((rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])) + 1))
+    return rows[starts], cols[starts], np.diff(np.append(starts, len(rows)))
+
+
+def cells_per_degree(lat_step):
+    """Cell rows per whole degree of latitude, or None when cells straddle whole degrees.
+
+    Only power-of-two divisions of a degree, whose row boundaries are exact.
+    """
+    cells = round(1 / lat_step)
+    if cells < 1 or cells & (cells - 1) or cells * lat_step != 1.0:
+        return None
+    return cells
+
+
+def run_bands(run_rows, run_len, lat_step):
+    """(bands in order of first appearance, their point counts, band changes) of the runs.
+
+    A band is the truncated latitude in whole degrees, as in the latitude
+    region check (southern cells take the band of their upper edge; points
+    exactly on a negative whole degree differ). None when the cells straddle
+    whole degrees.
+    """
+    cells = cells_per_degree(lat_step)
+    if cells is None:
+        return None
+    if len(run_rows) == 0:
+        return [], [], 0
+    offset = run_rows - 90 * cells
+    band = np.where(offset >= 0, offset // cells, -((-offset - 1) // cells))
+    values, first_run, inverse = np.unique(band, return_index=True, return_inverse=True)
+    counts = np.bincount(inverse, run_len).astype(np.int64)
+    order = np.argsort(first_run)
+    return values[order].tolist(), counts[order].tolist(), int(np.count_nonzero(band[1:] != band[:-1]))
+
+
+def cell_steps(cell_deg=REGION_CELL_DEG, geohash_precision=None):
+    """(lat_step, lon_step) of the grid or geohash cells"""
+    if geohash_precision is not None:
+        return geohash_steps(geohash_precision)
+    return cell_deg, cell_deg
+
+
+def distant_jump_segments(lat, lon, cell_deg=REGION_CELL_DEG, geohash_precision=None):
+    """Segments between points more than one cell apart (the distant jumps of the profile)"""
+    if len(lat) < 2:
+        return np.zeros(0, dtype=bool)
+    rows, cols = grid_cells(lat, lon, *cell_steps(cell_deg, geohash_precision))
+    return np.maximum(np.abs(np.diff(rows)), np.abs(np.diff(cols))) > 1
+
+
+def region_profile(lat, lon, cell_deg=REGION_CELL_DEG, geohash_precision=None,
+                   teleport_max_points=TELEPORT_MAX_POINTS):
+    """Cell occupancy and cell-to-cell movement patterns of a trace"""
+    lat_step, lon_step = cell_steps(cell_deg, geohash_precision)
+    if len(lat) == 0:
+        return runs_profile(np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64),
+                            lat_step, lon_step, geohash_precision)
+    rows, cols = grid_cells(lat, lon, lat_step, lon_step)
+    return runs_profile(*cell_runs(rows, cols), lat_step, lon_step, geohash_precision, teleport_max_points)
+
+
+def runs_profile(run_rows, run_cols, run_len, lat_step, lon_step, geohash_precision=None,
+                 teleport_max_points=TELEPORT_MAX_POINTS):
+    """Region profile from the run-length encoded cell sequence (see cell_runs).
+
+    Adjacent runs in the same cell must be merged already; traces read in
+    chunks pass their concatenated runs here.
+    """
+    profile = {'lat_step': lat_step, 'lon_step': lon_step, 'geohash_precision': geohash_precision,
+               'region_cells': 0, 'cell_transitions': 0, 'distant_jumps': 0, 'teleport_backs': 0,
+               'interleave_returns': 0, 'lat_span_cells': 0, 'lon_span_cells': 0, 'lat_span_km': 0.0,
+               'lon_span_km': 0.0, 'top_cells': [],
+               'lat_bands': run_bands(run_rows, run_len, lat_step)}
+    n_runs = len(run_len)
+    if n_runs == 0:
+        return profile
+    run_cell, cell_rows, cell_cols, counts = compact_cells(run_rows, run_cols, run_len)
+
+    distant = np.maximum(np.abs(np.diff(run_rows)), np.abs(np.diff(run_cols))) > 1
+    teleport = np.zeros(n_runs, dtype=bool)
+    # Isolated excursions only; point-by-point alternation is interleaving
+    teleport[1:-1] = (run_cell[:-2] == run_cell[2:]) & distant[:-1] & (run_len[1:-1] <= teleport_max_points) & \
+        (np.minimum(run_len[:-2], run_len[2:]) > teleport_max_points)
+    # Runs entering a cell an earlier run already occupied
+    _, first_run = np.unique(run_cell, return_index=True)
+    lookup = np.empty(len(counts), dtype=np.int64)
+    lookup[run_cell[first_run]] = first_run
+    revisit = np.arange(n_runs) > lookup[run_cell]
+    returns = distant & revisit[1:] & ~teleport[:-1] & ~teleport[1:]
+
+    # Busiest cell and the busiest cell distant from it (the two areas of an interleaved trace)
+    top = [int(np.argmax(counts))]
+    far = np.maximum(np.abs(cell_rows - cell_rows[top[0]]), np.abs(cell_cols - cell_cols[top[0]])) > 1
+    if far.any():
+        top.append(int(np.flatnonzero(far)[np.argmax(counts[far])]))
+    lat_span = int(cell_rows.max() - cell_rows.min()) + 1
+    lon_span = int(cell_cols.max() - cell_cols.min()) + 1
+    # East-west km at the middle latitude of the occupied cells
+    mid_lat = (cell_rows.min() + cell_rows.max() + 1) / 2 * lat_step - 90.0
+    profile.update({
+        'region_cells': len(counts),
+        'cell_transitions': n_runs - 1,
+        'distant_jumps': int(np.count_nonzero(distant)),
+        'teleport_backs': int(np.count_nonzero(teleport)),
+        'interleave_returns': int(np.count_nonzero(returns)),
+        'lat_span_cells': lat_span,
+        'lon_span_cells': lon_span,
+        'lat_span_km': lat_span * lat_step * KM_PER_DEGREE,
+        'lon_span_km': lon_span * lon_step * KM_PER_DEGREE * float(np.cos(np.radians(mid_lat))),
+        'top_cells': [(int(cell_rows[c]), int(cell_cols[c]), int(counts[c])) for c in top],
+    })
+    return profile
+
+
+def cell_label(profile, row, col):
+    """Geohash of a cell, or the coordinates of its centre"""
+    if profile['geohash_precision'] is not None:
+        return geohash_label(row, col, profile['geohash_precision'])
+    lat = (row + 0.5) * profile['lat_step'] - 90.0
+    lon = (col + 0.5) * profile['lon_step'] - 180.0
+    return f"{lat:.2f}, {lon:.2f}"
+
+
+def profile_messages(profile, interleave_min_returns=INTERLEAVE_MIN_RETURNS, span_km=REGION_SPAN_KM):
+    """Anomaly messages of a region profile"""
+    anomalies = []
+    if max(profile['lat_span_km'], profile['lon_span_km']) > span_km:
+        anomalies.append(f"Wide region span: {profile['lat_span_km']:.0f} km north-south x "
+                         f"{profile['lon_span_km']:.0f} km east-west ({profile['lat_span_cells']} x "
+                         f"{profile['lon_span_cells']} cells of {profile['lat_step']:g}° x {profile['lon_step']:g}°)")
+    if profile['teleport_backs']:
+        anomalies.append(f"Teleport-back pattern: {profile['teleport_backs']} short excursion(s) "
+                         f"to a distant cell and back")
+    if profile['interleave_returns'] >= interleave_min_returns:
+        areas = " and ".join(f"{cell_label(profile, row, col)} ({count} points)"
+                             for row, col, count in profile['top_cells'])
+        anomalies.append(f"Interleaved trace: {profile['interleave_returns']} jumps back to earlier distant "
+                         f"cells ({profile['region_cells']} cells of {profile['lat_step']:g}° x "
+                         f"{profile['lon_step']:g}°, mainly {areas})")
+    return anomalies
@@ -0,0 +1,247 @@
+"""
+Batch Route Renderer
+====================
+Renders route thumbnails (PNG/SVG) for a filtered set of routes across a
+process pool on the headless Agg backend.
+
+Routes selected from a results CSV (problem_routes.csv) keep the status,
+anomalies and distance of their row; the pipeline then only reads the trace
+and computes the segment distances the drawing needs. Routes selected from
+the route index run the analysis stages that determine the status. Traces
+come from the trace cache when one is given or found (trace_cache next to
+the routes CSV or in the working directory) instead of the Excel files.
+Long traces are decimated for plotting while keeping the endpoints of
+anomaly segments, and anomalies are marked on the map:
+- large jumps (>100 km) as red dashed segments
+- points coloured by latitude region when the route spans several (e.g. 17°/21°)
+- duplicate / stationary points as small grey markers
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy matplotlib
+
+Usage:
+------
+python route_renderer.py --routes problem_routes.csv --data data --output route_images
+python route_renderer.py --routes problem_routes.csv --anomaly "Large jumps" --limit 200 --format svg
+python route_renderer.py --routes problem_routes.csv --cache trace_cache
+"""
+
+import argparse
+import logging
+import math
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from route_pipeline import RoutePipeline
+from trace_codec import DEFAULT_CACHE_FOLDER, find_cache_folder
+
+logger = logging.getLogger(__name__)
+
+REGION_COLORS = ['orange', 'purple', 'teal', 'brown', 'olive', 'magenta']
+MAX_REGIONS = len(REGION_COLORS)
+
+# Stages run for routes whose row carries the analysis results, and for routes that need a status
+DRAW_STAGES = ('distance',)
+STATUS_STAGES = ('distance', 'anomalies', 'format', 'regions')
+# Result columns of a results CSV row that replace the re-computed values
+ROW_COLUMNS = ('status', 'anomalies', 'total_distance_km')
+
+
+def decimate_indices(n_points, max_points, keep=None):
+    """Evenly strided point indices, always including the ends and kept points"""
+    if n_points <= max_points:
+        return np.arange(n_points)
+    stride = math.ceil(n_points / max_points)
+    indices = np.arange(0, n_points, stride)
+    indices = np.union1d(indices, [n_points - 1])
+    if keep is not None:
+        indices = np.union1d(indices, np.flatnonzero(keep))
+    return indices
+
+
+def draw_route(fig, ctx, result, max_points=3000):
+    """Draw the route map and distance progression of an analyzed route on fig"""
+    from matplotlib.collections import LineCollection
+
+    ax1, ax2 = fig.subplots(1, 2)
+    lat, lon = ctx.lat, ctx.lon
+    n = len(lat)
+    segment_km = ctx.segment('segment_km') if n > 1 else np.zeros(0)
+    jumps = np.flatnonzero(segment_km > 100)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[jumps] = True
+    keep[np.minimum(jumps + 1, n - 1)] = True
+    idx = decimate_indices(n, max_points, keep)
+
+    # Plot 1: Route map; large jumps are drawn separately so the path stays readable
+    path_lon, path_lat = lon[idx].copy(), lat[idx].copy()
+    jump_starts = np.isin(idx[:-1], jumps) & (idx[1:] == idx[:-1] + 1)
+    path_lon = np.insert(path_lon, np.flatnonzero(jump_starts) + 1, np.nan)
+    path_lat = np.insert(path_lat, np.flatnonzero(jump_starts) + 1, np.nan)
+    ax1.plot(path_lon, path_lat, 'b-', linewidth=1, alpha=0.6, label='Route')
+    if len(jumps):
+        segments = np.stack((np.column_stack((lon[jumps], lat[jumps])),
+                             np.column_stack((lon[jumps + 1], lat[jumps + 1]))), axis=1)
+        ax1.add_collection(LineCollection(segments, colors='red', linestyles='dashed', linewidths=0.6,
+                                          alpha=0.5, zorder=1, label=f'Large jumps ({len(jumps)})'))
+
+    bands = ctx.segment('lat_band')
+    unique_bands, band_counts = np.unique(bands, return_counts=True)
+    if len(unique_bands) > 1:
+        for band, color in zip(unique_bands[np.argsort(-band_counts)][:MAX_REGIONS], REGION_COLORS):
+            in_band = idx[bands[idx] == band]
+            ax1.scatter(lon[in_band], lat[in_band], c=color, s=8, alpha=0.5, zorder=3, label=f'{band}° region')
+
+    if n > 1:
+        stationary = ctx.segment('same_as_next') | ((segment_km > 0) & (segment_km < 0.01))
+        marked = idx[:-1][stationary[idx[:-1]]] if len(idx) > 1 else idx[:0]
+        if len(marked):
+            ax1.scatter(lon[marked], lat[marked], c='grey', s=4, alpha=0.6, label='Duplicate/stationary')
+
+    ax1.scatter(lon[0], lat[0], c='green', s=100, marker='o', label='Start', zorder=5)
+    ax1.scatter(lon[-1], lat[-1], c='red', s=100, marker='s', label='End', zorder=5)
+    ax1.set_xlabel('Longitude')
+    ax1.set_ylabel('Latitude')
+    ax1.set_title(f'Route Map: {result["file_id"]}\n{result["status"]}')
+    ax1.legend(fontsize='small')
+    ax1.grid(True, alpha=0.3)
+
+    # Plot 2: Distance progression from the analysis' own segment distances
+    cumulative = np.cumsum(segment_km)
+    if len(cumulative):
+        dist_idx = decimate_indices(len(cumulative), max_points)
+        ax2.plot(dist_idx + 1, cumulative[dist_idx], 'g-', linewidth=2)
+        for i in jumps[:200]:
+            ax2.axvline(i + 1, color='red', alpha=0.15, linewidth=0.5)
+    ax2.set_xlabel('Point Number')
+    ax2.set_ylabel('Cumulative Distance (km)')
+    ax2.set_title(f'Distance Progression\nTotal: {result["total_distance_km"]} km')
+    ax2.grid(True, alpha=0.3)
+    fig.tight_layout()
+    return ax1, ax2
+
+
+# Pipelines of this worker, by stage list
+_pipelines = {}
+
+
+def _render_one(task):
+    """Analyze and render one route (pool worker)"""
+    filepath, output_path, max_points, figsize, dpi, cache_folder, row = task
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    stages = DRAW_STAGES if row and row.get('status') else STATUS_STAGES
+    if stages not in _pipelines:
+        _pipelines[stages] = RoutePipeline(stages=stages, cache_folder=cache_folder)
+    file_id = os.path.basename(filepath).split('.')[0]
+    try:
+        ctx = _pipelines[stages].run(filepath)
+        result = ctx.to_result()
+        if stages == DRAW_STAGES:
+            result.update({key: row[key] for key in ROW_COLUMNS if row.get(key) is not None})
+        if ctx.valid_points == 0:
+            return file_id, None, result['status']
+        fig = plt.figure(figsize=figsize)
+        draw_route(fig, ctx, result, max_points=max_points)
+        fig.savefig(output_path, dpi=dpi, bbox_inches='tight')
+        plt.close(fig)
+        return file_id, output_path, result['status']
+    except Exception as e:
+        return file_id, None, f'Error: {str(e)}'
+
+
+def select_rows(routes_file, status=None, anomaly=None, limit=None):
+    """Selected rows of a results CSV (problem_routes.csv) or the route index, with a filename column"""
+    routes = pd.read_csv(routes_file, dtype=str)
+    if status:
+        routes = routes[routes['status'].isin(status)]
+    if anomaly:
+        routes = routes[routes['anomalies'].str.contains(anomaly, regex=False, na=False)]
+    if 'filename' not in routes.columns:
+        routes = routes.assign(filename=routes.iloc[:, 0] + '_' + routes.iloc[:, 2] + '.xlsx')
+    return routes.iloc[:limit] if limit else routes
+
+
+def select_routes(routes_file, status=None, anomaly=None, limit=None):
+    """File names from a results CSV (problem_routes.csv) or the route index"""
+    return select_rows(routes_file, status, anomaly, limit)['filename'].tolist()
+
+
+def row_results(rows):
+    """filename -> analysis results of the row (status, anomalies, distance), for results CSVs"""
+    if 'status' not in rows.columns:
+        return {}
+    from route_rollups import parse_anomalies
+    results = {}
+    for row in rows.to_dict('records'):
+        result = {key: row.get(key) for key in ROW_COLUMNS if isinstance(row.get(key), str)}
+        if 'anomalies' in result:
+            result['anomalies'] = parse_anomalies(result['anomalies'])
+        if 'total_distance_km' in result:
+            result['total_distance_km'] = float(result['total_distance_km'])
+        results[row['filename']] = result
+    return results
+
+
+def render_batch(filenames, data_folder, output_folder, fmt='png', num_workers=None, max_points=3000,
+                 figsize=(10, 4), dpi=80, cache_folder=None, results=None):
+    """Render thumbnails for the given Excel files; returns {file_id: path or None}
+
+    results: filename -> status / anomalies / total_distance_km already known (see row_results)
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    results = results or {}
+    tasks = [(os.path.join(data_folder, name), os.path.join(output_folder, f"{name.split('.')[0]}.{fmt}"),
+              max_points, figsize, dpi, cache_folder, results.get(name))
+             for name in filenames if os.path.exists(os.path.join(data_folder, name))]
+    num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+
+    start = time.time()
+    if num_workers > 1 and len(tasks) > 1:
+        with mp.Pool(num_workers) as pool:
+            rendered = list(pool.imap_unordered(_render_one, tasks, chunksize=2))
+    else:
+        rendered = [_render_one(task) for task in tasks]
+
+    images = {file_id: path for file_id, path, _ in rendered}
+    failed = [(file_id, status) for file_id, path, status in rendered if path is None]
+    logger.info(f"Rendered {len(images) - len(failed)} of {len(filenames)} routes in {time.time() - start:.1f}s "
+                f"({len(filenames) - len(tasks)} missing, {len(failed)} without plottable points)")
+    return images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render route thumbnails in parallel')
+    parser.add_argument('--routes', default='problem_routes.csv', help='Results CSV or route index CSV')
+    parser.add_argument('--data', default='data')
+    parser.add_argument('--output', default='route_images')
+    parser.add_argument('--status', nargs='+', help='Only routes with these statuses')
+    parser.add_argument('--anomaly', help='Only routes whose anomalies contain this text')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--format', choices=['png', 'svg'], default='png')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-points', type=int, default=3000, help='Points plotted per route')
+    parser.add_argument('--dpi', type=int, default=80)
+    parser.add_argument('--cache', help='Trace cache folder of the analysis run (skips re-reading Excel files; '
+                                        f'default: {DEFAULT_CACHE_FOLDER} when it exists)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    rows = select_rows(args.routes, args.status, args.anomaly, args.limit)
+    cache_folder = args.cache or find_cache_folder(args.routes)
+    if cache_folder:
+        logger.info(f"Reading traces through the trace cache in {cache_folder}")
+    render_batch(rows['filename'].tolist(), args.data, args.output, fmt=args.format, num_workers=args.workers,
+                 max_points=args.max_points, dpi=args.dpi, cache_folder=cache_folder, results=row_results(rows))
+
+
+if __name__ == "__main__":
+    main()
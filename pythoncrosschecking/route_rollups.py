@@ -0,0 +1,191 @@
+"""
+Depot and Customer Rollups
+==========================
+Per-depot (BU Code + Location) and per-customer aggregates of analysis
+results: status mix, problem rate, distance percentiles, anomaly-type counts
+and the worst routes of every group.
+
+All levels are accumulated together in a single pass over the results (or
+incrementally with add() as results arrive), so large indexes are not
+rescanned with one boolean filter per statistic. Only the per-group distance
+lists are kept for the percentiles; worst routes are held in a bounded heap.
+
+Anomaly messages carry counts and positions, so they are reduced to types
+(duplicates, large_jumps, ...) before counting; a route counts once per type.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy
+
+Usage:
+------
+rollup = RouteRollup(INDEX_COLUMNS_V2)
+rollup.extend(results)
+rollup.table('depot').to_csv('route_depot_report.csv', index=False)
+
+python route_rollups.py --summary route_analysis_summary.csv --output route
+"""
+
+import argparse
+import ast
+import heapq
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from route_pipeline import INDEX_COLUMNS_V1, INDEX_COLUMNS_V2
+
+STATUS_ORDER = ['Good', 'Has anomalies', 'Poor quality data', 'No valid coordinates', 'Error reading file',
+                'Processing error', 'File not found']
+# Rank used to pick the worst routes of a group (then anomaly types, then distance)
+STATUS_SEVERITY = {'Good': 0, 'Has anomalies': 1, 'Poor quality data': 2, 'File not found': 2,
+                   'No valid coordinates': 3, 'Error reading file': 3, 'Processing error': 3}
+
+# (message fragment, anomaly type), first match wins
+ANOMALY_TYPES = [
+    ('duplicate consecutive points', 'duplicates'),
+    ('Large jumps', 'large_jumps'),
+    ('stationary points', 'stationary'),
+    ('multiple latitude regions', 'multi_region'),
+    ('alternation between regions', 'alternation'),
+    ('Teleport-back pattern', 'teleport_back'),
+    ('Interleaved trace', 'interleaved'),
+    ('Wide region span', 'wide_span'),
+    ('Mixed format', 'mixed_format'),
+    ('starts/ends at depot', 'other_depot'),
+    ('No valid coordinates', 'no_coordinates'),
+    ('Could not read', 'unreadable'),
+    ('Error:', 'error'),
+]
+NO_ANOMALY = 'None detected'
+WORST_ROUTES = 3
+PERCENTILES = (50, 90)
+
+
+def rollup_levels(index_columns):
+    """Group keys of the report levels under an index column schema"""
+    bu, location, _, customer = index_columns
+    return {'depot': (bu, location), 'customer': (customer,)}
+
+
+def anomaly_type(message):
+    for fragment, name in ANOMALY_TYPES:
+        if fragment in message:
+            return name
+    return 'other'
+
+
+def parse_anomalies(value):
+    """Anomaly list of a result; summary CSVs hold the lists as their repr"""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str) and value.startswith('['):
+        return ast.literal_eval(value)
+    return [] if value is None or (isinstance(value, float) and np.isnan(value)) else [str(value)]
+
+
+def _new_group():
+    return {'routes': 0, 'status': {}, 'anomalies': {}, 'distances': [], 'corrected_km': 0.0, 'worst': []}
+
+
+class RouteRollup:
+    def __init__(self, index_columns, worst_routes=WORST_ROUTES):
+        self.levels = rollup_levels(index_columns)
+        self.worst_routes = worst_routes
+        self.groups = {level: {} for level in self.levels}
+        # Tie breaker so the heap never compares result dicts
+        self._order = itertools.count()
+
+    def add(self, result):
+        status = result.get('status')
+        types = sorted({anomaly_type(m) for m in parse_anomalies(result.get('anomalies')) if m != NO_ANOMALY})
+        distance = float(result.get('total_distance_km') or 0.0)
+        distance = distance if np.isfinite(distance) else 0.0
+        corrected = result.get('corrected_distance_km')
+        rank = (STATUS_SEVERITY.get(status, 3), len(types), distance)
+        label = f"{result.get('file_id')} ({status})"
+
+        for level, keys in self.levels.items():
+            group = self.groups[level].setdefault(tuple(result.get(key) for key in keys), _new_group())
+            group['routes'] += 1
+            group['status'][status] = group['status'].get(status, 0) + 1
+            for name in types:
+                group['anomalies'][name] = group['anomalies'].get(name, 0) + 1
+            if distance > 0:
+                group['distances'].append(distance)
+            if corrected is not None and corrected == corrected:
+                group['corrected_km'] += corrected
+            if rank[0] > 0:
+                entry = (rank, next(self._order), label)
+                if len(group['worst']) < self.worst_routes:
+                    heapq.heappush(group['worst'], entry)
+                else:
+                    heapq.heappushpop(group['worst'], entry)
+
+    def extend(self, results):
+        for result in results:
+            self.add(result)
+        return self
+
+    def table(self, level):
+        """One row per group of a level, most problem routes first"""
+        keys = self.levels[level]
+        groups = self.groups[level]
+        statuses = [s for s in STATUS_ORDER if any(s in g['status'] for g in groups.values())]
+        statuses += sorted({s for g in groups.values() for s in g['status']} - set(statuses), key=str)
+        types = [name for _, name in ANOMALY_TYPES] + ['other']
+        types = [name for name in types if any(name in g['anomalies'] for g in groups.values())]
+
+        rows = []
+        for key, group in groups.items():
+            row = dict(zip(keys, key))
+            row['routes'] = group['routes']
+            for status in statuses:
+                row[status] = group['status'].get(status, 0)
+            row['problem_rate'] = round(1 - group['status'].get('Good', 0) / group['routes'], 3)
+            distances = np.asarray(group['distances'])
+            row['distance_km_total'] = round(float(distances.sum()), 2)
+            for q, value in zip(PERCENTILES, np.percentile(distances, PERCENTILES) if len(distances)
+                                else [np.nan] * len(PERCENTILES)):
+                row[f'distance_km_p{q}'] = round(float(value), 2)
+            row['distance_km_max'] = round(float(distances.max()), 2) if len(distances) else np.nan
+            row['corrected_distance_km_total'] = round(group['corrected_km'], 2)
+            for name in types:
+                row[f'anomaly_{name}'] = group['anomalies'].get(name, 0)
+            row['worst_routes'] = '; '.join(label for _, _, label in sorted(group['worst'], reverse=True))
+            rows.append(row)
+
+        table = pd.DataFrame(rows)
+        if len(table):
+            problems = table['routes'] - (table['Good'] if 'Good' in table.columns else 0)
+            table = table.iloc[np.lexsort((-table['routes'].to_numpy(), -problems.to_numpy()))]
+        return table.reset_index(drop=True)
+
+    def save(self, prefix='route'):
+        """Write <prefix>_<level>_report.csv for every level; returns the file names"""
+        files = []
+        for level in self.levels:
+            output_file = f"{prefix}_{level}_report.csv"
+            self.table(level).to_csv(output_file, index=False)
+            files.append(output_file)
+        return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-depot and per-customer rollups of an analysis summary')
+    parser.add_argument('--summary', default='route_analysis_summary.csv', help='Analysis summary CSV')
+    parser.add_argument('--output', default='route', help='Prefix of the <prefix>_<level>_report.csv files')
+    parser.add_argument('--worst', type=int, default=WORST_ROUTES, help='Worst routes listed per group')
+    args = parser.parse_args(argv)
+
+    summary = pd.read_csv(args.summary)
+    index_columns = INDEX_COLUMNS_V2 if INDEX_COLUMNS_V2[0] in summary.columns else INDEX_COLUMNS_V1
+    rollup = RouteRollup(index_columns, worst_routes=args.worst).extend(summary.to_dict('records'))
+    for output_file in rollup.save(args.output):
+        print(f"Report saved to: {output_file}")
+    print(rollup.table('depot').head(10).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Route Triage
+============
+Quick "did today's data drop look OK?" check: analyzes a stratified sample of
+routes (per BU_Code) with stride-sampled traces and estimates the fleet-wide
+count of every status and the total (raw and corrected) distance, with
+confidence intervals. It runs as the triage mode of the normal analysis,
+RouteAnalyzer.process_all_routes(triage={...}) / analyzerv2.py --triage.
+
+- File existence is checked for every route, so 'File not found' is exact.
+- Each BU is a stratum; fraction of its routes (at least min_per_stratum)
+  are sampled at random and read with every point_stride-th point (files
+  streamed in chunks are strided while streaming, see route_chunked.py).
+- Strata whose sampled problem rate (status other than 'Good') exceeds
+  escalate_rate are re-analyzed completely at full resolution; their numbers
+  are exact in the report.
+- Estimates use the stratified estimator with finite population correction;
+  intervals are normal approximations.
+
+Stride sampling keeps the ratio of valid to total points, but distances of
+strided traces are slightly shorter (corners are cut) and duplicate /
+stationary counts are not representative. The raw distance of traces made of
+large jumps (interleaved exports) shrinks by up to the stride factor; use the
+corrected distance, or --stride 1, when those dominate.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy tqdm
+
+Usage:
+------
+python analyzerv2.py --triage --csv routesinformation.csv --data data --fraction 0.05
+python analyzerv2.py --triage --csv routesinformation.csv --data data --stride 10 --escalate 0.4
+"""
+
+import logging
+import math
+import os
+import time
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from route_pipeline import RoutePipeline
+
+logger = logging.getLogger(__name__)
+
+GOOD_STATUS = 'Good'
+NOT_FOUND_STATUS = 'File not found'
+DISTANCE_COLUMNS = ('total_distance_km', 'corrected_distance_km')
+
+
+def stratified_sample(strata, fraction, min_per_stratum, rng):
+    """Index labels of a random sample of every stratum"""
+    sample = []
+    for _, labels in strata.groupby(strata).groups.items():
+        n = min(len(labels), max(min_per_stratum, math.ceil(fraction * len(labels))))
+        sample.extend(rng.choice(np.asarray(labels), size=n, replace=False).tolist())
+    return sample
+
+
+def estimate_total(values, population):
+    """Stratum total of values sampled from population units: (estimate, variance)"""
+    n = len(values)
+    if n == 0:
+        return 0.0, 0.0
+    estimate = population * float(np.mean(values))
+    if n >= population or n < 2:
+        return estimate, 0.0
+    variance = population ** 2 * (1 - n / population) * float(np.var(values, ddof=1)) / n
+    return estimate, variance
+
+
+class RouteTriage:
+    def __init__(self, analyzer, fraction=0.1, min_per_stratum=5, point_stride=5, escalate_rate=0.5,
+                 confidence=0.95, seed=0, use_multiprocessing=True):
+        """analyzer: analyzerv2.RouteAnalyzer with the CSV index loaded"""
+        self.analyzer = analyzer
+        self.fraction = fraction
+        self.min_per_stratum = min_per_stratum
+        self.point_stride = point_stride
+        self.escalate_rate = escalate_rate
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.confidence = confidence
+        self.rng = np.random.default_rng(seed)
+        self.use_multiprocessing = use_multiprocessing
+
+    def _analyze(self, rows, stride):
+        """Analyze the given index rows with the pipeline at a point stride"""
+        analyzer = self.analyzer
+        default_pipeline = analyzer.pipeline
+        cache = default_pipeline.cache
+        # The stride travels with the pipeline, which workers receive with the analyzer
+        analyzer.pipeline = RoutePipeline(stages=default_pipeline.stage_names, point_stride=stride,
+                                          cache_folder=cache.folder if cache is not None else None)
+        analyzer.results = []
+        try:
+            results = analyzer.process_all_routes(use_multiprocessing=self.use_multiprocessing, rows=rows)
+        finally:
+            analyzer.pipeline = default_pipeline
+        return pd.DataFrame(results, index=rows)
+
+    def run(self):
+        start = time.time()
+        csv_data = self.analyzer.csv_data
+        filenames = csv_data.apply(self.analyzer.generate_filename, axis=1)
+        found = filenames.map(lambda name: os.path.exists(os.path.join(self.analyzer.data_folder, name)))
+        strata = csv_data.iloc[:, 0].astype(str)[found]
+
+        sample = stratified_sample(strata, self.fraction, self.min_per_stratum, self.rng)
+        sampled = self._analyze(sample, self.point_stride) if sample else pd.DataFrame()
+
+        strata_rows = []
+        escalate = []
+        for stratum, labels in strata.groupby(strata).groups.items():
+            results = sampled.loc[sampled.index.isin(labels)]
+            problem_rate = float((results['status'] != GOOD_STATUS).mean()) if len(results) else 0.0
+            # Strata analyzed completely at full resolution are exact already
+            escalated = problem_rate > self.escalate_rate and (len(results) < len(labels) or self.point_stride > 1)
+            strata_rows.append({'stratum': stratum, 'routes': len(labels), 'sampled': len(results),
+                                'sampled_problem_rate': round(problem_rate, 3), 'escalated': escalated})
+            if escalated:
+                escalate.extend(labels)
+        if escalate:
+            logger.info(f"Escalating {sum(r['escalated'] for r in strata_rows)} strata "
+                        f"({len(escalate)} routes) to full analysis")
+        full = self._analyze(escalate, 1) if escalate else pd.DataFrame()
+
+        report = self.estimate(strata, sampled, full, found)
+        # Results of the routes behind the estimate: escalated strata in full, the others sampled
+        kept = sampled.loc[~sampled.index.isin(full.index)] if len(full) else sampled
+        self.analyzer.results = pd.concat([kept, full]).to_dict('records') if len(kept) + len(full) else []
+        report.attrs['strata'] = pd.DataFrame(strata_rows)
+        report.attrs['analyzed_routes'] = len(sampled) + len(full)
+        report.attrs['elapsed_seconds'] = time.time() - start
+        return report
+
+    def estimate(self, strata, sampled, full, found):
+        """Stratified estimates of status counts and total distance"""
+        statuses = sorted(set(sampled.get('status', pd.Series(dtype=str))) |
+                          set(full.get('status', pd.Series(dtype=str))))
+        metrics = {status: [0.0, 0.0] for status in statuses}
+        distance_columns = [column for column in DISTANCE_COLUMNS
+                            if column in sampled.columns or column in full.columns]
+        for column in distance_columns:
+            metrics[column] = [0.0, 0.0]
+
+        for stratum, labels in strata.groupby(strata).groups.items():
+            exact = full.loc[full.index.isin(labels)] if len(full) else full
+            results = exact if len(exact) else sampled.loc[sampled.index.isin(labels)]
+            population = len(results) if len(exact) else len(labels)
+            for status in statuses:
+                estimate, variance = estimate_total((results['status'] == status).to_numpy(float), population)
+                metrics[status][0] += estimate
+                metrics[status][1] += variance
+            for column in distance_columns:
+                # Routes without points have no corrected distance; they count as 0 km
+                estimate, variance = estimate_total(results[column].fillna(0).to_numpy(float), population)
+                metrics[column][0] += estimate
+                metrics[column][1] += variance
+
+        rows = [{'metric': NOT_FOUND_STATUS, 'estimate': int((~found).sum()), 'ci_low': int((~found).sum()),
+                 'ci_high': int((~found).sum())}]
+        for metric, (estimate, variance) in metrics.items():
+            margin = self.z * math.sqrt(variance)
+            low = max(0.0, estimate - margin)
+            rows.append({'metric': metric, 'estimate': round(estimate, 2), 'ci_low': round(low, 2),
+                         'ci_high': round(estimate + margin, 2)})
+        return pd.DataFrame(rows)
+
+
+def print_report(report, confidence):
+    print("\n=== TRIAGE REPORT ===")
+    print(f"Routes analyzed: {report.attrs['analyzed_routes']} "
+          f"in {report.attrs['elapsed_seconds']:.1f}s")
+    print(f"Estimates with {confidence:.0%} confidence intervals:")
+    print(report.to_string(index=False))
+    strata = report.attrs['strata']
+    if len(strata) and strata['escalated'].any():
+        print("\nEscalated to full analysis:")
+        print(strata[strata['escalated']].to_string(index=False))
+
+
+def save_report(report, output_file):
+    """Write the estimates, and the strata next to them (<output>_strata.csv)"""
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    report.to_csv(output_file, index=False)
+    report.attrs['strata'].to_csv(os.path.splitext(output_file)[0] + '_strata.csv', index=False)
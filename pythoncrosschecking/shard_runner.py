@@ -0,0 +1,398 @@
+"""
+Sharded Route Analysis
+======================
+Splits the route index into shards and lets any number of worker nodes claim
+and process them through a shared folder, then merges the shard outputs into
+the standard summary files.
+
+Coordination is file based, so the shard folder only has to be visible to all
+nodes (e.g. an NFS mount):
+- shards/shard_NNNN.pkl       index rows of the shard
+- leases/shard_NNNN.lease     claimed by a worker; kept fresh by a heartbeat
+- results/shard_NNNN.pkl      analysis results of a finished shard
+
+A lease whose heartbeat is older than the lease timeout belongs to a dead
+worker and is taken over by the next worker that looks at it. Node clocks
+should be roughly in sync (NTP) for the timeout to be meaningful. Every lease
+holds its owner's token; a holder whose lease was taken over stops its
+heartbeat and leaves the new owner's lease in place.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl geopy tqdm
+
+Usage:
+------
+python shard_runner.py split --csv routesinformation.csv --dir shards --by bu
+python shard_runner.py worker --dir shards --data data --cache trace_cache   (on every node)
+python shard_runner.py merge --dir shards --depots depot_locations.csv
+python shard_runner.py local --csv routesinformation.csv --data data --nodes 3 --output summary/route_analysis_summary.csv
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+import pandas as pd
+
+from route_chunked import MEMORY_BUDGET_MB
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def _shard_name(shard_id):
+    return f"shard_{shard_id:04d}"
+
+
+def _atomic_pickle(df, path):
+    """Write a DataFrame pickle so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def split_index(csv_file, shard_dir, by='bu', num_shards=16):
+    """Split the route index into shard files and write the shard manifest.
+
+    by='bu':   one shard per BU Code (first index column)
+    by='hash': num_shards shards by a stable hash of the Excel file name
+    """
+    csv_data = pd.read_csv(csv_file)
+    if by == 'bu':
+        keys = csv_data.iloc[:, 0].astype(str)
+        shard_keys = {key: i for i, key in enumerate(pd.unique(keys))}
+        assignment = keys.map(shard_keys).to_numpy()
+    elif by == 'hash':
+        names = csv_data.iloc[:, 0].astype(str) + '_' + csv_data.iloc[:, 2].astype(str)
+        assignment = names.map(lambda name: zlib.crc32(name.encode()) % num_shards).to_numpy()
+    else:
+        raise ValueError(f"Unknown shard key: {by}")
+
+    # A new split starts a new job: drop shards, leases and results of the last one
+    for folder in ('shards', 'leases', 'results'):
+        path = os.path.join(shard_dir, folder)
+        os.makedirs(path, exist_ok=True)
+        for stale in os.listdir(path):
+            os.remove(os.path.join(path, stale))
+
+    shards = []
+    for shard_id in sorted(set(assignment.tolist())):
+        rows = csv_data[assignment == shard_id]
+        name = _shard_name(len(shards))
+        _atomic_pickle(rows, os.path.join(shard_dir, 'shards', f"{name}.pkl"))
+        shards.append({'name': name, 'routes': len(rows), 'positions': rows.index.tolist()})
+
+    manifest = {'csv_file': os.path.abspath(csv_file), 'by': by, 'total_routes': len(csv_data),
+                'columns': list(csv_data.columns), 'shards': shards}
+    with open(os.path.join(shard_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Split {len(csv_data)} routes into {len(shards)} shards by {by}")
+    return manifest
+
+
+def load_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+class ShardLease:
+    """Exclusive, heartbeat-refreshed claim on one shard"""
+
+    def __init__(self, shard_dir, name, worker_id, timeout):
+        self.path = os.path.join(shard_dir, 'leases', f"{name}.lease")
+        self.worker_id = worker_id
+        self.timeout = timeout
+        # Written into the lease; only the owner of this token may refresh or release it
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _create(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': self.worker_id, 'claimed_at': time.time(), 'token': self.token}, f)
+        return True
+
+    @staticmethod
+    def _read(path):
+        with open(path) as f:
+            return f.read()
+
+    def _holds_token(self, path):
+        try:
+            return json.loads(self._read(path)).get('token') == self.token
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def owned(self):
+        """The lease file still holds this lease's token (it was not taken over)"""
+        return self._holds_token(self.path)
+
+    def acquire(self):
+        """Claim the shard; take over the lease if its holder stopped heart-beating"""
+        if self._create():
+            return True
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+            holder = self._read(self.path)
+        except FileNotFoundError:
+            return self._create()
+        if age < self.timeout:
+            return False
+        # Only one worker can win the rename of an expired lease
+        stale_path = f"{self.path}.expired.{self.worker_id}"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return False
+        # Another worker may have taken the lease over (or its holder heart-beaten) between the
+        # check and the rename; then the renamed lease is fresh and goes back in place
+        if self._read(stale_path) != holder or time.time() - os.path.getmtime(stale_path) < self.timeout:
+            try:
+                os.link(stale_path, self.path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        logger.warning(f"Lease {os.path.basename(self.path)} expired ({age:.0f}s old), taking over")
+        return self._create()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.timeout / 3):
+            if not self.owned():
+                logger.warning(f"Lease {os.path.basename(self.path)} was taken over, {self.worker_id} stops "
+                               f"refreshing it")
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def release(self):
+        """Remove the lease file if it is still this lease's"""
+        # Renamed aside first, so a lease another worker took over meanwhile is never deleted
+        released_path = f"{self.path}.released.{self.token}"
+        try:
+            os.rename(self.path, released_path)
+        except FileNotFoundError:
+            return False
+        if self._holds_token(released_path):
+            os.remove(released_path)
+            return True
+        try:
+            os.link(released_path, self.path)
+        except FileExistsError:
+            pass
+        os.remove(released_path)
+        logger.warning(f"Lease {os.path.basename(self.path)} was taken over, leaving it to its new owner")
+        return False
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.release()
+
+
+class ShardWorker:
+    def __init__(self, shard_dir, data_folder='data', worker_id=None, num_workers=None,
+                 lease_timeout=300, poll_interval=5, cache_folder=None, memory_budget_mb=MEMORY_BUDGET_MB):
+        self.shard_dir = shard_dir
+        self.data_folder = data_folder
+        self.cache_folder = cache_folder
+        self.memory_budget_mb = memory_budget_mb
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+
+    def result_path(self, name):
+        return os.path.join(self.shard_dir, 'results', f"{name}.pkl")
+
+    def process_shard(self, name):
+        """Analyze one shard with the standard multiprocessing analyzer"""
+        from analyzerv2 import RouteAnalyzer
+        # Per-file logs of every node would drown the coordinator output
+        for logger_name in ('analyzerv2', 'route_pipeline'):
+            logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+        analyzer = RouteAnalyzer('', self.data_folder, num_workers=self.num_workers, cache_folder=self.cache_folder,
+                                 memory_budget_mb=self.memory_budget_mb)
+        analyzer.csv_data = pd.read_pickle(os.path.join(self.shard_dir, 'shards', f"{name}.pkl"))
+        results = analyzer.process_all_routes(use_multiprocessing=self.num_workers > 1)
+        _atomic_pickle(pd.DataFrame(results), self.result_path(name))
+        return len(results)
+
+    def run(self):
+        """Claim and process shards until every shard has a result"""
+        manifest = load_manifest(self.shard_dir)
+        names = [shard['name'] for shard in manifest['shards']]
+        processed = 0
+        while True:
+            pending = [name for name in names if not os.path.exists(self.result_path(name))]
+            if not pending:
+                break
+            claimed = False
+            for name in pending:
+                lease = ShardLease(self.shard_dir, name, self.worker_id, self.lease_timeout)
+                if not lease.acquire():
+                    continue
+                claimed = True
+                with lease:
+                    # Another worker may have finished it while we were claiming
+                    if os.path.exists(self.result_path(name)):
+                        continue
+                    start = time.time()
+                    routes = self.process_shard(name)
+                    processed += 1
+                    logger.info(f"[{self.worker_id}] {name}: {routes} routes in {time.time() - start:.1f}s")
+            if not claimed:
+                # Remaining shards are leased by other workers; wait for them or their expiry
+                time.sleep(self.poll_interval)
+        logger.info(f"[{self.worker_id}] finished, processed {processed} shards")
+        return processed
+
+
+def shard_status(shard_dir):
+    """Counts of done, leased and pending shards"""
+    manifest = load_manifest(shard_dir)
+    status = {'done': 0, 'leased': 0, 'pending': 0}
+    for shard in manifest['shards']:
+        name = shard['name']
+        if os.path.exists(os.path.join(shard_dir, 'results', f"{name}.pkl")):
+            status['done'] += 1
+        elif os.path.exists(os.path.join(shard_dir, 'leases', f"{name}.lease")):
+            status['leased'] += 1
+        else:
+            status['pending'] += 1
+    return status
+
+
+def merge_shards(shard_dir, output_file='route_analysis_summary.csv', depot_file=None):
+    """Merge shard results in index order and write the standard summary files.
+
+    With a depot file, start/end points of all merged results are checked
+    against the depots in one batch.
+    """
+    from analyzerv2 import RouteAnalyzer
+
+    manifest = load_manifest(shard_dir)
+    frames = []
+    for shard in manifest['shards']:
+        path = os.path.join(shard_dir, 'results', f"{shard['name']}.pkl")
+        if not os.path.exists(path):
+            raise RuntimeError(f"Shard {shard['name']} has no results yet")
+        frame = pd.read_pickle(path)
+        frame.index = shard['positions']
+        frames.append(frame)
+    merged = pd.concat(frames).sort_index()
+
+    analyzer = RouteAnalyzer(manifest['csv_file'], num_workers=1)
+    analyzer.results = merged.to_dict('records')
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    if depot_file and os.path.exists(depot_file):
+        analyzer.load_depots(depot_file)
+        analyzer.check_depots()
+    return analyzer.generate_summary_report(output_file)
+
+
+def run_local(csv_file, data_folder, shard_dir, nodes=2, by='bu', num_shards=16, workers_per_node=1,
+              lease_timeout=300, cache_folder=None, memory_budget_mb=MEMORY_BUDGET_MB, depot_file=None,
+              output_file='route_analysis_summary.csv'):
+    """Split, run several worker processes standing in for nodes, then merge"""
+    split_index(csv_file, shard_dir, by=by, num_shards=num_shards)
+    command = [sys.executable, os.path.abspath(__file__), 'worker', '--dir', shard_dir, '--data', data_folder,
+               '--workers', str(workers_per_node), '--lease-timeout', str(lease_timeout),
+               '--memory-budget', str(memory_budget_mb)]
+    if cache_folder:
+        command += ['--cache', cache_folder]
+    processes = [subprocess.Popen(command + ['--worker-id', f"node{i}"]) for i in range(nodes)]
+    codes = [p.wait() for p in processes]
+    if any(codes):
+        raise RuntimeError(f"Worker exit codes: {codes}")
+    return merge_shards(shard_dir, output_file, depot_file=depot_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded route analysis across several nodes')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('split', help='Split the route index into shards')
+    p.add_argument('--csv', default='routesinformation.csv')
+    p.add_argument('--dir', default='shards')
+    p.add_argument('--by', choices=['bu', 'hash'], default='bu')
+    p.add_argument('--shards', type=int, default=16, help='Number of shards for --by hash')
+
+    p = sub.add_parser('worker', help='Claim and process shards until all are done')
+    p.add_argument('--dir', default='shards')
+    p.add_argument('--data', default='data')
+    p.add_argument('--workers', type=int, default=None, help='Processes per node')
+    p.add_argument('--worker-id', default=None)
+    p.add_argument('--lease-timeout', type=float, default=300, help='Seconds without heartbeat before retry')
+    p.add_argument('--poll-interval', type=float, default=5)
+    p.add_argument('--cache', default=None, help='Trace cache folder (reuses parsed traces of unchanged files)')
+    p.add_argument('--memory-budget', type=float, default=MEMORY_BUDGET_MB,
+                   help='Memory per worker in MB; larger files are streamed in chunks (0: never)')
+
+    p = sub.add_parser('merge', help='Merge shard results into the summary files')
+    p.add_argument('--dir', default='shards')
+    p.add_argument('--output', default='route_analysis_summary.csv')
+    p.add_argument('--depots', default='depot_locations.csv',
+                   help='Optional depot coordinates (BU Code, Location, Latitude, Longitude)')
+
+    p = sub.add_parser('status', help='Show shard progress')
+    p.add_argument('--dir', default='shards')
+
+    p = sub.add_parser('local', help='Run split, N local worker processes and merge')
+    p.add_argument('--csv', default='routesinformation.csv')
+    p.add_argument('--data', default='data')
+    p.add_argument('--dir', default='shards')
+    p.add_argument('--nodes', type=int, default=2)
+    p.add_argument('--by', choices=['bu', 'hash'], default='bu')
+    p.add_argument('--shards', type=int, default=16)
+    p.add_argument('--workers', type=int, default=1, help='Processes per node')
+    p.add_argument('--lease-timeout', type=float, default=300)
+    p.add_argument('--cache', default=None, help='Trace cache folder shared by the nodes')
+    p.add_argument('--memory-budget', type=float, default=MEMORY_BUDGET_MB, help='Memory per worker in MB')
+    p.add_argument('--depots', default='depot_locations.csv', help='Optional depot coordinates')
+    p.add_argument('--output', default='route_analysis_summary.csv')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == 'split':
+        split_index(args.csv, args.dir, by=args.by, num_shards=args.shards)
+    elif args.command == 'worker':
+        ShardWorker(args.dir, args.data, worker_id=args.worker_id, num_workers=args.workers,
+                    lease_timeout=args.lease_timeout, poll_interval=args.poll_interval, cache_folder=args.cache,
+                    memory_budget_mb=args.memory_budget).run()
+    elif args.command == 'merge':
+        merge_shards(args.dir, args.output, depot_file=args.depots)
+    elif args.command == 'status':
+        print(shard_status(args.dir))
+    elif args.command == 'local':
+        run_local(args.csv, args.data, args.dir, nodes=args.nodes, by=args.by, num_shards=args.shards,
+                  workers_per_node=args.workers, lease_timeout=args.lease_timeout, cache_folder=args.cache,
+                  memory_budget_mb=args.memory_budget, depot_file=args.depots, output_file=args.output)
+
+
+if __name__ == "__main__":
+    main()
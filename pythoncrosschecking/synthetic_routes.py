@@ -0,0 +1,314 @@
+"""
+Synthetic Route Generator
+=========================
+Generates synthetic route fleets (index CSV + Excel files) shaped like the real
+depot exports, so the analyzers can be benchmarked and cross-checked without
+customer data.
+
+Route kinds:
+- clean:         standard Latitude/Longitude sheet, no anomalies
+- duplicates:    duplicate-heavy trace with stationary runs
+- interleaved:   two traces (17° and 21° regions) interleaved in blocks,
+                 like 1527_0041000154
+- mixed_format:  headerless sheet with two coordinate pairs per row
+- huge:          very long clean trace
+- poor_quality:  mostly invalid coordinates
+- empty:         no valid coordinates at all
+- unreadable:    corrupt .xlsx file
+- missing:       index row without an Excel file
+
+With timestamps enabled, standard Latitude/Longitude sheets also get a
+Timestamp column: fixes every 5-15 s, dwell stops of 3-20 minutes and
+stretches driven above 60 km/h, for the motion analytics.
+
+The expected valid points of every route are kept in cache/<file_id>.trace;
+manifest.json lists the routes together with the generator parameters.
+
+Installation Requirements:
+------------------------
+pip install pandas numpy openpyxl
+
+Usage:
+------
+python synthetic_routes.py --routes 200 --output synthetic
+python synthetic_routes.py --routes 50 --timestamps --output synthetic_timed
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from trace_codec import decode_trace, encode_trace
+
+# Expected valid points per route, encoded with trace_codec
+TRACE_SUFFIX = '.trace'
+
+# Index header used by routesinformation.csv
+INDEX_COLUMNS = ['BU Code', 'Location', 'Row Labels', 'Customer Name']
+
+# Synthetic depots (BU Code, Location, latitude, longitude)
+DEPOTS = [
+    (1527, 'Raipur Depot', 21.2514, 81.6296),
+    (1164, 'BHATINDA TERMINAL', 30.2110, 74.9455),
+    (1278, 'JODHPUR TERMINAL', 26.2389, 73.0243),
+    (1630, 'Paradeep Terminal', 20.3167, 86.6114),
+    (1319, 'MUGHALSARAI DEPOT', 25.2817, 83.1198),
+    (1991, 'CHENNAI TERMINAL', 13.0827, 80.2707),
+]
+
+# Default share of each route kind in a generated fleet
+DEFAULT_MIX = {
+    'clean': 0.40,
+    'duplicates': 0.20,
+    'interleaved': 0.10,
+    'mixed_format': 0.10,
+    'poor_quality': 0.05,
+    'empty': 0.05,
+    'unreadable': 0.05,
+    'missing': 0.05,
+}
+
+METERS_PER_DEGREE = 111320.0
+
+
+class SyntheticRouteGenerator:
+    def __init__(self, seed=42, points_per_route=(800, 4000), huge_points=100000, timestamps=False):
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.points_per_route = points_per_route
+        self.huge_points = huge_points
+        self.timestamps = timestamps
+
+    def random_walk(self, n_points, start, min_step_m=30.0, max_step_m=80.0):
+        """Smooth random walk starting at (lat, lon); returns an (n, 2) array"""
+        if n_points <= 0:
+            return np.empty((0, 2))
+        headings = np.cumsum(self.rng.normal(0.0, 0.15, n_points - 1)) + self.rng.uniform(0, 2 * np.pi)
+        steps = self.rng.uniform(min_step_m, max_step_m, n_points - 1)
+        dlat = steps * np.cos(headings) / METERS_PER_DEGREE
+        dlon = steps * np.sin(headings) / (METERS_PER_DEGREE * np.cos(np.radians(start[0])))
+        lats = start[0] + np.concatenate(([0.0], np.cumsum(dlat)))
+        lons = start[1] + np.concatenate(([0.0], np.cumsum(dlon)))
+        # Real exports carry 5 decimals
+        return np.round(np.column_stack((lats, lons)), 5)
+
+    def clean_trace(self, n_points, start):
+        return self.random_walk(n_points, start)
+
+    def duplicate_trace(self, n_points, start):
+        """Trace with repeated fixes and sub-10 m jitter while parked"""
+        base = self.random_walk(max(n_points // 2, 2), start)
+        repeats = self.rng.choice([1, 1, 1, 2, 3, 6], size=len(base))
+        points = np.repeat(base, repeats, axis=0)[:n_points]
+        parked = self.rng.random(len(points)) < 0.15
+        jitter = self.rng.normal(0.0, 2.0, (len(points), 2)) / METERS_PER_DEGREE
+        points[parked] += jitter[parked]
+        return np.round(points, 5)
+
+    def interleaved_trace(self, n_points, start):
+        """Two traces (17° and 21° regions) merged in alternating blocks"""
+        south = self.random_walk(n_points, (17.0 + self.rng.uniform(0.05, 0.6), 74.5 + self.rng.uniform(0, 0.5)))
+        north = self.random_walk(n_points, (21.0 + self.rng.uniform(0.1, 0.6), 81.5 + self.rng.uniform(0, 0.5)))
+        points = []
+        i = j = 0
+        north_block = False
+        while len(points) < n_points:
+            # Every block fits in what is left, so i and j never pass n_points
+            block = min(int(self.rng.integers(20, 200)), n_points - len(points))
+            if self.rng.random() < 0.3:
+                # Point-by-point alternation between the two traces
+                for _ in range((block + 1) // 2):
+                    points.append(south[i])
+                    points.append(north[j])
+                    i += 1
+                    j += 1
+            elif north_block:
+                points.extend(north[j:j + block])
+                j += block
+                north_block = False
+            else:
+                points.extend(south[i:i + block])
+                i += block
+                north_block = True
+        return np.asarray(points[:n_points])
+
+    def invalid_values(self, n_values):
+        """Object array of values that fail coordinate validation"""
+        choices = np.array([0.0, -1.0, 200.0, 45.0, np.nan, 'N/A', ''], dtype=object)
+        return choices[self.rng.integers(0, len(choices), n_values)]
+
+    def timestamps_for(self, n_rows, start=pd.Timestamp('2024-03-01 06:00')):
+        """Fix times every 5-15 s with occasional dwell stops and fast stretches"""
+        if n_rows == 0:
+            return pd.Series([], dtype='datetime64[ns]')
+        dt = self.rng.uniform(5.0, 15.0, n_rows)
+        dt[0] = 0.0
+        # Fast stretches: ~60 m steps in 2-3 s is 70-110 km/h
+        fast = np.repeat(self.rng.random(n_rows // 50 + 1) < 0.2, 50)[:n_rows]
+        dt[fast] = self.rng.uniform(2.0, 3.0, int(fast.sum()))
+        stops = self.rng.random(n_rows) < 0.004
+        dt[stops] += self.rng.uniform(180.0, 1200.0, int(stops.sum()))
+        return start + pd.to_timedelta(np.round(np.cumsum(dt)), unit='s')
+
+    def build_sheet(self, kind, n_points, depot):
+        """Return (DataFrame, valid_points, write_header) for a route kind"""
+        start = (depot[2], depot[3])
+        if kind in ('clean', 'huge'):
+            points = self.clean_trace(n_points, start)
+        elif kind == 'duplicates':
+            points = self.duplicate_trace(n_points, start)
+        elif kind == 'interleaved':
+            points = self.interleaved_trace(n_points, start)
+        elif kind == 'mixed_format':
+            pairs = self.interleaved_trace(n_points * 2, start)
+            rows = pairs[:(len(pairs) // 2) * 2].reshape(-1, 4)
+            df = pd.DataFrame(rows, columns=['c1', 'c2', 'c3', 'c4'])
+            # Some rows carry a single pair or a stray third value
+            single = self.rng.random(len(df)) < 0.05
+            df.loc[single, ['c3', 'c4']] = np.nan
+            stray = self.rng.random(len(df)) < 0.01
+            df.loc[stray, 'c4'] = np.nan
+            points = _points_from_rows(df.values)
+            # Headerless export: pandas will read the first row as header
+            return df, points[_pairs_in_first_row(df.values):], False
+        elif kind == 'poor_quality':
+            points = self.clean_trace(n_points, start)
+            df = pd.DataFrame({'Latitude': points[:, 0].astype(object), 'Longitude': points[:, 1].astype(object)})
+            bad = self.rng.random(n_points) < 0.7
+            df.loc[bad, 'Latitude'] = self.invalid_values(int(bad.sum()))
+            return df, points[~bad], True
+        elif kind == 'empty':
+            df = pd.DataFrame({'Latitude': self.invalid_values(n_points), 'Longitude': self.invalid_values(n_points)})
+            return df, np.empty((0, 2)), True
+        else:
+            raise ValueError(f"Unknown route kind: {kind}")
+        df = pd.DataFrame({'Latitude': points[:, 0], 'Longitude': points[:, 1]})
+        if self.timestamps:
+            df['Timestamp'] = self.timestamps_for(len(df))
+        return df, points, True
+
+    def parameters(self, n_routes, mix=None, include_huge=0):
+        """Everything the generated fleet depends on, as stored in manifest.json"""
+        parameters = {'seed': self.seed, 'points_per_route': self.points_per_route,
+                      'huge_points': self.huge_points, 'timestamps': self.timestamps,
+                      'n_routes': n_routes, 'mix': mix or DEFAULT_MIX, 'include_huge': include_huge}
+        # As read back from JSON (tuples become lists)
+        return json.loads(json.dumps(parameters))
+
+    def generate(self, output_dir, n_routes, mix=None, include_huge=0):
+        """Write a synthetic fleet to output_dir and return its manifest"""
+        mix = mix or DEFAULT_MIX
+        data_folder = os.path.join(output_dir, 'data')
+        cache_folder = os.path.join(output_dir, 'cache')
+        os.makedirs(data_folder, exist_ok=True)
+        os.makedirs(cache_folder, exist_ok=True)
+
+        kinds = list(mix.keys())
+        weights = np.array([mix[k] for k in kinds], dtype=float)
+        counts = np.floor(weights / weights.sum() * n_routes).astype(int)
+        counts[0] += n_routes - counts.sum()
+        plan = [k for k, c in zip(kinds, counts) for _ in range(c)] + ['huge'] * include_huge
+        self.rng.shuffle(plan)
+
+        index_rows = []
+        manifest = []
+        for i, kind in enumerate(plan):
+            depot = DEPOTS[i % len(DEPOTS)]
+            # Keep one alphanumeric label so Row Labels stays a string column
+            row_label = f"P{7000 + i}" if i == 0 else f"{41000000 + i:010d}"
+            file_id = f"{depot[0]}_{row_label}"
+            filename = f"{file_id}.xlsx"
+            filepath = os.path.join(data_folder, filename)
+            index_rows.append([depot[0], depot[1], row_label, f"SYNTHETIC CUSTOMER {i}"])
+
+            n_points = self.huge_points if kind == 'huge' else int(self.rng.integers(*self.points_per_route))
+            points = np.empty((0, 2))
+            if kind == 'unreadable':
+                with open(filepath, 'wb') as f:
+                    f.write(self.rng.bytes(512))
+                n_points = 0
+            elif kind == 'missing':
+                n_points = 0
+            else:
+                df, points, header = self.build_sheet(kind, n_points, depot)
+                df.to_excel(filepath, index=False, header=header)
+                n_points = len(df) - (0 if header else 1)
+            with open(os.path.join(cache_folder, f"{file_id}{TRACE_SUFFIX}"), 'wb') as f:
+                f.write(encode_trace(points[:, 0], points[:, 1], precision=None))
+
+            manifest.append({
+                'file_id': file_id,
+                'filename': filename,
+                'kind': kind,
+                'BU_Code': depot[0],
+                'rows': n_points,
+                'valid_points': int(len(points)),
+            })
+
+        index_file = os.path.join(output_dir, 'routesinformation.csv')
+        pd.DataFrame(index_rows, columns=INDEX_COLUMNS).to_csv(index_file, index=False)
+        pd.DataFrame(DEPOTS, columns=['BU Code', 'Location', 'Latitude', 'Longitude']).to_csv(
+            os.path.join(output_dir, 'depot_locations.csv'), index=False)
+        with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+            json.dump({'parameters': self.parameters(n_routes, mix, include_huge), 'routes': manifest}, f, indent=2)
+        return manifest
+
+
+def load_manifest(output_dir):
+    """(generator parameters, routes) of a generated fleet; parameters are None for old manifests"""
+    with open(os.path.join(output_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        return None, manifest
+    return manifest['parameters'], manifest['routes']
+
+
+def _points_from_rows(values):
+    """Valid points in the order parse_mixed_coordinates reads them"""
+    points = []
+    for row in values:
+        numeric = [float(v) for v in row if pd.notna(v)]
+        if len(numeric) == 4:
+            points.extend([tuple(numeric[:2]), tuple(numeric[2:])])
+        elif len(numeric) in (2, 3):
+            points.append(tuple(numeric[:2]))
+    return np.asarray(points, dtype=float).reshape(-1, 2)
+
+
+def _pairs_in_first_row(values):
+    """Number of points contributed by the first (header) row"""
+    n = int(np.sum(pd.notna(values[0]))) if len(values) else 0
+    return 2 if n == 4 else (1 if n in (2, 3) else 0)
+
+
+def load_cached_points(cache_folder, file_id):
+    """Load the cached (n, 2) point array for a generated route"""
+    path = os.path.join(cache_folder, f"{file_id}{TRACE_SUFFIX}")
+    if not os.path.exists(path):
+        # Fleets generated before the trace codec
+        with np.load(os.path.join(cache_folder, f"{file_id}.npz")) as data:
+            return data['points']
+    with open(path, 'rb') as f:
+        return np.column_stack(decode_trace(f.read()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic route fleet')
+    parser.add_argument('--routes', type=int, default=100, help='Number of routes to generate')
+    parser.add_argument('--huge', type=int, default=0, help='Number of additional huge traces')
+    parser.add_argument('--huge-points', type=int, default=100000, help='Points per huge trace')
+    parser.add_argument('--output', default='synthetic', help='Output folder')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timestamps', action='store_true', help='Add a Timestamp column to standard sheets')
+    args = parser.parse_args()
+
+    generator = SyntheticRouteGenerator(seed=args.seed, huge_points=args.huge_points, timestamps=args.timestamps)
+    manifest = generator.generate(args.output, args.routes, include_huge=args.huge)
+    print(f"Generated {len(manifest)} routes in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
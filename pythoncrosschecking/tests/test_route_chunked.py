@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from route_chunked import ChunkedRouteAnalyzer, analyze_chunked
+from route_pipeline import RoutePipeline, RouteAnalyzerBase
+from synthetic_routes import SyntheticRouteGenerator
+
+CHUNK_ROWS = 97
+
+
+@pytest.fixture(scope='module')
+def fleet(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('fleet'))
+    generator = SyntheticRouteGenerator(seed=3, points_per_route=(200, 700), huge_points=2500, timestamps=True)
+    manifest = generator.generate(folder, 16, include_huge=1)
+    data_folder = os.path.join(folder, 'data')
+    return [(os.path.join(data_folder, item['filename']), item) for item in manifest if item['kind'] != 'missing']
+
+
+def comparable(ctx):
+    result = ctx.to_result()
+    result.pop('chunks', None)
+    return result
+
+
+@pytest.mark.parametrize('enabled, point_stride', [
+    ((), 1),
+    (('clean', 'motion'), 1),
+    (('clean', 'motion'), 4),
+    # Routes of at most point_stride valid points are not strided
+    ((), 100000),
+])
+def test_chunked_matches_full_pipeline(fleet, enabled, point_stride):
+    pipeline = RoutePipeline(enabled=enabled, point_stride=point_stride)
+    streamed = 0
+    for filepath, _ in fleet:
+        chunked = analyze_chunked(filepath, pipeline, CHUNK_ROWS)
+        if chunked is None:
+            # Sheets without coordinate headers are not streamed
+            continue
+        streamed += 1
+        assert comparable(chunked) == comparable(pipeline.run(filepath)), os.path.basename(filepath)
+    assert streamed >= len(fleet) - 3
+
+
+def test_stride_applies_to_streamed_files(fleet):
+    pipeline = RoutePipeline(point_stride=4)
+    filepath, item = max(fleet, key=lambda entry: entry[1]['valid_points'])
+    result = analyze_chunked(filepath, pipeline, CHUNK_ROWS).to_result()
+    assert result['point_stride'] == 4
+    assert result['valid_points'] == -(-item['valid_points'] // 4)
+
+
+def test_analyzer_streams_over_budget(fleet):
+    csv_file = os.path.join(os.path.dirname(os.path.dirname(fleet[0][0])), 'routesinformation.csv')
+    full = RouteAnalyzerBase(csv_file, stages=None)
+    streaming = RouteAnalyzerBase(csv_file, stages=None, memory_budget_mb=1e-6)
+    chunked = ChunkedRouteAnalyzer(csv_file, chunk_rows=CHUNK_ROWS)
+    filepath, item = max(fleet, key=lambda entry: entry[1]['valid_points'])
+    expected = comparable(full.analyze_file(filepath))
+    assert expected['valid_points'] == item['valid_points']
+    assert comparable(streaming.analyze_file(filepath)) == expected
+    assert comparable(chunked.analyze_file(filepath)) == expected
+    assert 'chunks' in streaming.analyze_file(filepath).to_result()
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from route_matching import MapMatcher, RoadNetwork, match_columns
+from route_pipeline import geodesic_km
+
+LAT0, LON0, STEP, SIZE = 21.20, 81.60, 0.005, 12
+# Row of the grid that is a numbered highway
+HIGHWAY_ROW = 5
+
+
+def node(row, col):
+    return row * SIZE + col
+
+
+def position(row, col):
+    return LAT0 + row * STEP, LON0 + col * STEP
+
+
+@pytest.fixture(scope='module')
+def network():
+    """Square street grid of about 550 m blocks"""
+    edges = []
+    for row in range(SIZE):
+        for col in range(SIZE):
+            lat, lon = position(row, col)
+            if col + 1 < SIZE:
+                highway = row == HIGHWAY_ROW
+                edges.append((node(row, col), node(row, col + 1), lat, lon, lat, lon + STEP,
+                              'trunk' if highway else 'residential', 'NH 53' if highway else '', ''))
+            if row + 1 < SIZE:
+                edges.append((node(row, col), node(row + 1, col), lat, lon, lat + STEP, lon,
+                              'residential', '', f'Street {col}'))
+    return RoadNetwork(pd.DataFrame(edges, columns=['u', 'v', 'u_lat', 'u_lon', 'v_lat', 'v_lon',
+                                                    'highway', 'ref', 'name']))
+
+
+def drive(corners, noise_m=8.0, seed=0):
+    """GPS trace along grid corners, a fix about every 30 m, and the driven km"""
+    points, km = [], 0.0
+    for (row_a, col_a), (row_b, col_b) in zip(corners[:-1], corners[1:]):
+        a, b = np.array(position(row_a, col_a)), np.array(position(row_b, col_b))
+        km += float(geodesic_km(a[:1], a[1:], b[:1], b[1:])[0])
+        blocks = abs(row_b - row_a) + abs(col_b - col_a)
+        points.extend(a + t * (b - a) for t in np.linspace(0, 1, 18 * blocks, endpoint=False))
+    points.append(np.array(position(*corners[-1])))
+    noise = np.random.default_rng(seed).normal(0, noise_m / 111000, (len(points), 2))
+    points = np.array(points) + noise
+    return points[:, 0], points[:, 1], km
+
+
+def test_straight_drive_on_the_highway(network):
+    lat, lon, km = drive([(HIGHWAY_ROW, 1), (HIGHWAY_ROW, 9)])
+    match = MapMatcher(network).match(lat, lon)
+    assert match['breaks'] == 0
+    assert match['distance_km'] == pytest.approx(km, rel=0.02)
+    # Edges beyond the end points are at most touched by their GPS noise
+    driven = {e for e, km in match['edge_km'].items() if km > 0.01}
+    assert len(driven) == 8
+    assert all(network.attributes['ref'][e] == 'NH 53' for e in driven)
+    columns = match_columns(match, network)
+    assert columns['matched_roads'].startswith('NH 53 (')
+
+
+def test_turns_follow_the_streets(network):
+    corners = [(2, 2), (2, 6), (7, 6), (7, 3)]
+    lat, lon, km = drive(corners, seed=1)
+    match = MapMatcher(network).match(lat, lon)
+    assert match['breaks'] == 0
+    assert match['distance_km'] == pytest.approx(km, rel=0.03)
+    # Every block driven once, no detours into cross streets
+    driven = {e for e, km in match['edge_km'].items() if km > 0.01}
+    assert len(driven) == 4 + 5 + 3
+    assert all(match['traversals'][e] == 1 for e in driven)
+
+
+def test_points_off_the_network_are_unmatched(network):
+    lat, lon, _ = drive([(HIGHWAY_ROW, 1), (HIGHWAY_ROW, 5)])
+    # A stretch far south of the grid has no candidate edges
+    lat = np.concatenate((lat, np.full(5, LAT0 - 0.05)))
+    lon = np.concatenate((lon, LON0 + 0.02 + np.arange(5) * 0.001))
+    match = MapMatcher(network).match(lat, lon)
+    assert match['matched_points'] < match['kept_points']
+    assert all(point < len(lat) - 5 for point, _, _ in match['path'])
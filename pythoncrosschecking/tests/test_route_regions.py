@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from route_regions import cell_runs, grid_cells, cell_steps, profile_messages, region_profile, runs_profile
+
+HOME = (21.1, 81.1)
+# Distant cell, but within the region span threshold
+AWAY = (20.1, 80.6)
+
+
+def stays(*blocks):
+    """Trace of (point count, (lat, lon)) blocks, with a few metres of movement inside each block"""
+    lat, lon = [], []
+    for count, (block_lat, block_lon) in blocks:
+        lat.extend(block_lat + np.arange(count) * 1e-4)
+        lon.extend(block_lon + np.arange(count) * 1e-4)
+    return np.array(lat), np.array(lon)
+
+
+def test_local_route_has_no_anomalies():
+    profile = region_profile(*stays((200, HOME)))
+    assert profile['region_cells'] == 1
+    assert profile['distant_jumps'] == 0
+    assert profile_messages(profile) == []
+
+
+def test_spans_in_both_dimensions():
+    north_south = region_profile(np.linspace(17.1, 21.1, 100), np.full(100, 81.1))
+    assert north_south['lat_span_cells'] == 17 and north_south['lon_span_cells'] == 1
+    assert north_south['lat_span_km'] == pytest.approx(17 * 0.25 * 111.32)
+    messages = profile_messages(north_south)
+    assert len(messages) == 1 and messages[0].startswith('Wide region span: 473 km north-south x 26 km east-west')
+
+    # East-west km shrink with the cosine of the latitude
+    equator = region_profile(np.full(100, 0.1), np.linspace(10.1, 12.1, 100))
+    north = region_profile(np.full(100, 60.1), np.linspace(10.1, 12.1, 100))
+    assert equator['lon_span_cells'] == north['lon_span_cells'] == 9
+    assert north['lon_span_km'] / equator['lon_span_km'] == pytest.approx(np.cos(np.radians(60.125)), rel=1e-3)
+    assert profile_messages(north) == [] and profile_messages(region_profile(*stays((50, HOME)))) == []
+    assert profile_messages(north, span_km=100.0)[0].startswith('Wide region span')
+
+
+def test_teleport_back():
+    profile = region_profile(*stays((30, HOME), (2, AWAY), (30, HOME)))
+    assert profile['teleport_backs'] == 1
+    assert profile['interleave_returns'] == 0
+    assert [message.split(':')[0] for message in profile_messages(profile)] == ['Teleport-back pattern']
+
+
+def test_interleaved_blocks():
+    profile = region_profile(*stays((20, HOME), (20, AWAY), (20, HOME), (20, AWAY)))
+    assert profile['teleport_backs'] == 0
+    assert profile['interleave_returns'] == 2
+    messages = [message for message in profile_messages(profile) if message.startswith('Interleaved trace')]
+    assert len(messages) == 1 and '(40 points) and ' in messages[0]
+
+
+@pytest.mark.parametrize('geohash_precision', [None, 4])
+def test_runs_of_chunks_give_the_same_profile(geohash_precision):
+    rng = np.random.default_rng(5)
+    lat, lon = stays((300, HOME), (3, AWAY), (300, HOME), (200, AWAY), (100, HOME))
+    lat = lat + rng.normal(0, 0.05, len(lat))
+    lat_step, lon_step = cell_steps(geohash_precision=geohash_precision)
+    run_rows, run_cols, run_len = [], [], []
+    for start in range(0, len(lat), 97):
+        rows, cols, lengths = cell_runs(*grid_cells(lat[start:start + 97], lon[start:start + 97],
+                                                    lat_step, lon_step))
+        if run_len and (run_rows[-1], run_cols[-1]) == (rows[0], cols[0]):
+            # The chunk continues the previous chunk's last cell
+            run_len[-1] += lengths[0]
+            rows, cols, lengths = rows[1:], cols[1:], lengths[1:]
+        run_rows.extend(rows)
+        run_cols.extend(cols)
+        run_len.extend(lengths)
+    chunked = runs_profile(np.array(run_rows), np.array(run_cols), np.array(run_len),
+                           lat_step, lon_step, geohash_precision)
+    assert chunked == region_profile(lat, lon, geohash_precision=geohash_precision)
+    rows, cols = grid_cells(lat, lon, lat_step, lon_step)
+    assert chunked['region_cells'] == len(set(zip(rows.tolist(), cols.tolist())))
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+
+import pytest
+
+from shard_runner import ShardLease
+
+TIMEOUT = 0.3
+
+
+@pytest.fixture
+def shard_dir(tmp_path):
+    os.makedirs(tmp_path / 'leases')
+    return str(tmp_path)
+
+
+def lease_token(lease):
+    with open(lease.path) as f:
+        return json.load(f)['token']
+
+
+def test_lease_is_exclusive(shard_dir):
+    first = ShardLease(shard_dir, 'shard_000', 'node-a', TIMEOUT)
+    second = ShardLease(shard_dir, 'shard_000', 'node-b', TIMEOUT)
+    assert first.acquire()
+    assert not second.acquire()
+    assert ShardLease(shard_dir, 'shard_001', 'node-b', TIMEOUT).acquire()
+    assert first.release()
+    assert not os.path.exists(first.path)
+    assert second.acquire()
+
+
+def test_expired_lease_is_taken_over(shard_dir):
+    first = ShardLease(shard_dir, 'shard_000', 'node-a', TIMEOUT)
+    second = ShardLease(shard_dir, 'shard_000', 'node-b', TIMEOUT)
+    assert first.acquire()
+    time.sleep(TIMEOUT * 1.5)
+    assert second.acquire()
+    assert second.owned() and not first.owned()
+
+    # The former owner neither releases nor refreshes the new owner's lease
+    assert not first.release()
+    assert lease_token(second) == second.token
+    assert second.release()
+    assert not os.path.exists(second.path)
+
+
+def test_heartbeat_keeps_the_lease(shard_dir):
+    first = ShardLease(shard_dir, 'shard_000', 'node-a', TIMEOUT)
+    second = ShardLease(shard_dir, 'shard_000', 'node-b', TIMEOUT)
+    assert first.acquire()
+    with first:
+        time.sleep(TIMEOUT * 2)
+        assert not second.acquire()
+        assert first.owned()
+    assert not os.path.exists(first.path)
+    assert second.acquire()
+
+
+def test_heartbeat_stops_after_takeover(shard_dir):
+    first = ShardLease(shard_dir, 'shard_000', 'node-a', TIMEOUT)
+    second = ShardLease(shard_dir, 'shard_000', 'node-b', TIMEOUT)
+    assert first.acquire()
+    time.sleep(TIMEOUT * 1.5)
+    assert second.acquire()
+    claimed = os.path.getmtime(second.path)
+    with first:
+        time.sleep(TIMEOUT)
+    # The former owner neither refreshed nor released the new owner's lease
+    assert second.owned()
+    assert os.path.getmtime(second.path) == claimed
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+from trace_codec import (TraceCache, decode_polyline, decode_times, decode_trace, encode_polyline,
+                         encode_times, encode_trace, varint_decode, varint_encode)
+
+
+@pytest.fixture
+def trace():
+    rng = np.random.default_rng(7)
+    lat = 21.25 + np.cumsum(rng.normal(0, 2e-4, 500))
+    lon = 81.63 + np.cumsum(rng.normal(0, 2e-4, 500))
+    return lat, lon
+
+
+def test_fixed_precision_round_trip(trace):
+    lat, lon = trace
+    decoded_lat, decoded_lon = decode_trace(encode_trace(lat, lon, precision=6))
+    assert np.abs(decoded_lat - lat).max() <= 5e-7
+    assert np.abs(decoded_lon - lon).max() <= 5e-7
+
+
+def test_lossless_round_trip(trace):
+    lat, lon = trace
+    # Arbitrary floats fall back to raw float64, decimal exports get a fixed-point precision
+    for values in ((lat, lon), (np.round(lat, 5), np.round(lon, 5))):
+        decoded = decode_trace(encode_trace(*values, precision=None))
+        assert np.array_equal(decoded[0], values[0])
+        assert np.array_equal(decoded[1], values[1])
+    assert len(encode_trace(np.round(lat, 5), np.round(lon, 5), precision=None)) < 16 * len(lat)
+
+
+def test_empty_trace():
+    lat, lon = decode_trace(encode_trace([], []))
+    assert len(lat) == len(lon) == 0
+
+
+def test_not_a_trace():
+    with pytest.raises(ValueError):
+        decode_trace(b'nope')
+
+
+def test_truncated_varints():
+    data = varint_encode([1, 300, 70000])
+    assert varint_decode(data).tolist() == [1, 300, 70000]
+    with pytest.raises(ValueError):
+        varint_decode(data[:-1], count=3)
+
+
+def test_polyline_reference():
+    # Example of the encoded polyline format specification
+    lat, lon = [38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]
+    text = encode_polyline(lat, lon)
+    assert text == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    decoded_lat, decoded_lon = decode_polyline(text)
+    assert np.allclose(decoded_lat, lat) and np.allclose(decoded_lon, lon)
+
+
+def test_times_round_trip():
+    seconds = np.array([1.7e9, 1.7e9 + 5.123, np.nan, 1.7e9 + 3.0, np.nan])
+    decoded = decode_times(encode_times(seconds))
+    assert np.array_equal(np.isnan(decoded), np.isnan(seconds))
+    known = ~np.isnan(seconds)
+    assert np.abs(decoded[known] - seconds[known]).max() < 1e-3
+
+
+def test_cache_invalidation(tmp_path, trace):
+    lat, lon = trace
+    source = tmp_path / 'route.xlsx'
+    source.write_bytes(b'sheet')
+    cache = TraceCache(str(tmp_path / 'cache'), version=1)
+    cache.store(str(source), lat, lon, total_points=510, format_anomalies=['Mixed format'],
+                seconds=np.arange(len(lat), dtype=float))
+
+    cached = cache.load(str(source))
+    assert np.array_equal(cached['lat'], lat) and np.array_equal(cached['lon'], lon)
+    assert cached['total_points'] == 510 and cached['format_anomalies'] == ['Mixed format']
+    assert np.array_equal(cached['seconds'], np.arange(len(lat), dtype=float))
+
+    # Another parser version, or a changed source file, makes the entry stale
+    assert TraceCache(cache.folder, version=2).load(str(source)) is None
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert cache.load(str(source)) is None
+    assert cache.clear() == 1
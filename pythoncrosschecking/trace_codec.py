@@ -0,0 +1,282 @@
+"""
+Compact Trace Codec
+===================
+Vectorized encoding of coordinate traces for storage and transfer.
+
+Binary format (encode_trace / decode_trace):
+    b'T' | precision byte | varint point count | payload
+Coordinates are fixed point (int32 at precision 6 = micro-degrees), stored as
+lat/lon interleaved deltas from the previous point, zigzag mapped and varint
+encoded. Smooth traces take about 2-4 bytes per point instead of 16. With precision
+None the smallest precision that reproduces every float exactly is chosen;
+traces that no precision reproduces are stored as raw float64 (precision byte
+255), so the cache never changes analysis results.
+
+Polyline format (encode_polyline / decode_polyline): Google's encoded
+polyline algorithm (precision 5 by default), as used by the Directions API
+responses the Node services already read.
+
+Timestamps (encode_times / decode_times) are stored as zigzag varint deltas of
+whole milliseconds after a bitmask of the unreadable (NaN) ones; regular
+5-15 s fixes take 3 bytes each.
+
+TraceCache keeps the parsed trace of every Excel file (plus its timestamps, row
+count and format anomalies), keyed by the file's size and modification time and
+the parser version (route_pipeline.PARSE_VERSION), so later runs skip read_excel
+and parsing, and traces parsed by an older parser are read again.
+
+Results carry the binary trace from the workers to the parent when the
+pipeline's 'trace' stage runs; the parent exports it as polylines
+(route_traces.csv).
+
+Installation Requirements:
+------------------------
+pip install numpy
+
+Usage:
+------
+data = encode_trace(lat, lon, precision=6)
+lat, lon = decode_trace(data)
+text = encode_polyline(lat, lon)
+pipeline = RoutePipeline(cache_folder='trace_cache')
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+MAGIC = b'T'
+TIMES_MAGIC = b'S'
+RAW_PRECISION = 255
+LOSSLESS_PRECISIONS = (5, 6, 7)
+CACHE_MAGIC = b'RTC2'
+CACHE_SUFFIX = '.trc'
+# Cache folder name used by route_cli.py and looked up by the tools that read analyzed traces
+DEFAULT_CACHE_FOLDER = 'trace_cache'
+
+
+def zigzag_encode(values):
+    """Map signed integers to unsigned: 0, -1, 1, -2 -> 0, 1, 2, 3"""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+def _split_groups(values, bits):
+    """Little-endian groups of bits of every value: (groups, is_last_group_of_value)"""
+    values = np.asarray(values, dtype=np.uint64)
+    shift = np.uint64(bits)
+    counts = np.ones(len(values), dtype=np.int64)
+    rest = values >> shift
+    while rest.any():
+        counts += rest > 0
+        rest >>= shift
+    starts = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(values)), counts)
+    position = np.arange(int(counts.sum())) - np.repeat(starts, counts)
+    groups = (values[owner] >> (position * bits).astype(np.uint64)) & np.uint64((1 << bits) - 1)
+    return groups, position == counts[owner] - 1
+
+
+def _join_groups(groups, last, bits):
+    """Inverse of _split_groups; an unterminated trailing value is ignored"""
+    ends = np.flatnonzero(last)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    groups = groups[:ends[-1] + 1].astype(np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(groups)) - np.repeat(starts, ends - starts + 1)
+    return np.add.reduceat(groups << (position * bits).astype(np.uint64), starts)
+
+
+def varint_encode(values):
+    """Unsigned LEB128 bytes of an array of unsigned integers"""
+    groups, last = _split_groups(values, 7)
+    return (groups | np.where(last, 0, 0x80).astype(np.uint64)).astype(np.uint8).tobytes()
+
+
+def varint_decode(data, count=None):
+    """Unsigned integers from LEB128 bytes (the first count values if given)"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if count is not None:
+        # Only scan as far as the count-th terminating byte
+        ends = np.flatnonzero(raw < 0x80)
+        if len(ends) < count:
+            raise ValueError(f"Truncated varint data: {len(ends)} of {count} values")
+        raw = raw[:ends[count - 1] + 1] if count else raw[:0]
+    return _join_groups(raw & 0x7F, raw < 0x80, 7)
+
+
+def to_fixed(values, precision):
+    return np.round(np.asarray(values, dtype=float) * 10.0 ** precision).astype(np.int64)
+
+
+def lossless_precision(lat, lon, candidates=LOSSLESS_PRECISIONS):
+    """Smallest precision whose fixed-point values decode to the exact floats, or None"""
+    values = np.concatenate((np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)))
+    for precision in candidates:
+        if np.array_equal(to_fixed(values, precision) / 10.0 ** precision, values):
+            return precision
+    return None
+
+
+def _interleaved_deltas(lat, lon, precision):
+    fixed = np.column_stack((to_fixed(lat, precision), to_fixed(lon, precision)))
+    return np.diff(fixed, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+
+
+def _undo_deltas(deltas, precision):
+    fixed = np.cumsum(deltas.reshape(-1, 2), axis=0)
+    scale = 10.0 ** precision
+    return fixed[:, 0] / scale, fixed[:, 1] / scale
+
+
+def encode_trace(lat, lon, precision=6):
+    """Binary trace; precision None picks a lossless one (raw float64 as last resort)"""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    if precision is None:
+        precision = lossless_precision(lat, lon)
+    header = MAGIC + bytes([RAW_PRECISION if precision is None else precision]) + varint_encode([len(lat)])
+    if precision is None:
+        return header + np.column_stack((lat, lon)).astype('<f8').tobytes()
+    return header + varint_encode(zigzag_encode(_interleaved_deltas(lat, lon, precision)))
+
+
+def decode_trace(data):
+    """(lat, lon) float arrays from encode_trace bytes"""
+    if data[:1] != MAGIC:
+        raise ValueError("Not an encoded trace")
+    precision = data[1]
+    header_end = 2 + next(i for i, byte in enumerate(data[2:12]) if byte < 0x80) + 1
+    n = int(varint_decode(data[2:header_end])[0])
+    payload = data[header_end:]
+    if precision == RAW_PRECISION:
+        points = np.frombuffer(payload, dtype='<f8', count=2 * n).reshape(-1, 2)
+        return points[:, 0].copy(), points[:, 1].copy()
+    return _undo_deltas(zigzag_decode(varint_decode(payload, 2 * n)), precision)
+
+
+def encode_times(seconds):
+    """Binary timestamps (Unix seconds, NaN for unknown) at millisecond resolution"""
+    seconds = np.asarray(seconds, dtype=float)
+    known = ~np.isnan(seconds)
+    millis = np.round(seconds[known] * 1000.0).astype(np.int64)
+    deltas = np.diff(millis, prepend=np.int64(0))
+    return TIMES_MAGIC + varint_encode([len(seconds)]) + np.packbits(known).tobytes() + \
+        varint_encode(zigzag_encode(deltas))
+
+
+def decode_times(data):
+    """Unix seconds from encode_times bytes"""
+    if data[:1] != TIMES_MAGIC:
+        raise ValueError("Not encoded timestamps")
+    header_end = 1 + next(i for i, byte in enumerate(data[1:11]) if byte < 0x80) + 1
+    n = int(varint_decode(data[1:header_end])[0])
+    mask_end = header_end + (n + 7) // 8
+    known = np.unpackbits(np.frombuffer(data[header_end:mask_end], dtype=np.uint8), count=n).astype(bool)
+    millis = np.cumsum(zigzag_decode(varint_decode(data[mask_end:], int(known.sum()))))
+    seconds = np.full(n, np.nan)
+    seconds[known] = millis / 1000.0
+    return seconds
+
+
+def encode_polyline(lat, lon, precision=5):
+    """Google encoded polyline string of a trace"""
+    if len(lat) == 0:
+        return ''
+    groups, last = _split_groups(zigzag_encode(_interleaved_deltas(lat, lon, precision)), 5)
+    chars = (groups | np.where(last, 0, 0x20).astype(np.uint64)) + np.uint64(63)
+    return chars.astype(np.uint8).tobytes().decode('ascii')
+
+
+def decode_polyline(text, precision=5):
+    """(lat, lon) float arrays from a Google encoded polyline"""
+    chars = np.frombuffer(text.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    values = _join_groups(chars & 0x1F, chars < 0x20, 5)
+    if len(values) % 2:
+        raise ValueError("Polyline has an odd number of values")
+    return _undo_deltas(zigzag_decode(values), precision)
+
+
+def find_cache_folder(near=None):
+    """DEFAULT_CACHE_FOLDER next to a file of the analysis run or in the working directory, if any"""
+    candidates = [DEFAULT_CACHE_FOLDER]
+    if near:
+        candidates.insert(0, os.path.join(os.path.dirname(near), DEFAULT_CACHE_FOLDER))
+    return next((folder for folder in candidates if os.path.isdir(folder)), None)
+
+
+class TraceCache:
+    """Parsed traces of Excel files on disk, valid while the file and the parser version are unchanged"""
+
+    def __init__(self, folder, version=None):
+        self.folder = folder
+        self.version = version
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, filepath):
+        return os.path.join(self.folder, os.path.basename(filepath).split('.')[0] + CACHE_SUFFIX)
+
+    @staticmethod
+    def _source_key(filepath):
+        stat = os.stat(filepath)
+        return stat.st_size, stat.st_mtime_ns
+
+    def store(self, filepath, lat, lon, total_points, format_anomalies, seconds=None):
+        size, mtime_ns = self._source_key(filepath)
+        trace = encode_trace(lat, lon, precision=None)
+        header = json.dumps({'source_size': size, 'source_mtime_ns': mtime_ns, 'version': self.version,
+                             'total_points': total_points,
+                             'format_anomalies': format_anomalies, 'trace_bytes': len(trace),
+                             'has_seconds': seconds is not None}).encode()
+        data = CACHE_MAGIC + varint_encode([len(header)]) + header + trace
+        if seconds is not None:
+            data += encode_times(seconds)
+        path = self.path(filepath)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load(self, filepath):
+        """dict(lat, lon, seconds, total_points, format_anomalies), or None when missing or stale"""
+        try:
+            with open(self.path(filepath), 'rb') as f:
+                data = f.read()
+            if data[:4] != CACHE_MAGIC:
+                return None
+            header_end = 4 + next(i for i, byte in enumerate(data[4:14]) if byte < 0x80) + 1
+            header_len = int(varint_decode(data[4:header_end])[0])
+            header = json.loads(data[header_end:header_end + header_len])
+            if (header['source_size'], header['source_mtime_ns']) != self._source_key(filepath):
+                return None
+            if header.get('version') != self.version:
+                return None
+            trace_start = header_end + header_len
+            trace_end = trace_start + header['trace_bytes']
+            lat, lon = decode_trace(data[trace_start:trace_end])
+            seconds = decode_times(data[trace_end:]) if header['has_seconds'] else None
+        except (OSError, ValueError, KeyError, StopIteration):
+            return None
+        return {'lat': lat, 'lon': lon, 'seconds': seconds, 'total_points': header['total_points'],
+                'format_anomalies': header['format_anomalies']}
+
+    def stats(self):
+        """Number of cached traces and their total size in bytes"""
+        sizes = [entry.stat().st_size for entry in os.scandir(self.folder) if entry.name.endswith(CACHE_SUFFIX)]
+        return {'folder': self.folder, 'traces': len(sizes), 'bytes': sum(sizes)}
+
+    def clear(self):
+        removed = 0
+        for name in os.listdir(self.folder):
+            if name.endswith(CACHE_SUFFIX):
+                os.remove(os.path.join(self.folder, name))
+                removed += 1
+        return removed